@@ -343,46 +343,47 @@ class relationalBone(baseBone):
 		dbVals.filter("viur_dest_kind =", self.kind)
 		dbVals.filter("viur_src_property =", boneName)
 		dbVals.filter("src.__key__ =", key)
-		for dbObj in dbVals.iter():
-			try:
-				if not dbObj["dest"].key in [x["dest"]["key"] for x in values]:  # Relation has been removed
+		with db.WriteBuffer():  # Collect our writes, so they can be sent in as few batches as possible
+			for dbObj in dbVals.iter():
+				try:
+					if not dbObj["dest"].key in [x["dest"]["key"] for x in values]:  # Relation has been removed
+						db.Delete(dbObj.key)
+						continue
+				except:  # This entry is corrupt
 					db.Delete(dbObj.key)
-					continue
-			except:  # This entry is corrupt
-				db.Delete(dbObj.key)
-			else:  # Relation: Updated
-				data = [x for x in values if x["dest"]["key"] == dbObj["dest"].key][0]
-				# Write our (updated) values in
-				refSkel = data["dest"]
+				else:  # Relation: Updated
+					data = [x for x in values if x["dest"]["key"] == dbObj["dest"].key][0]
+					# Write our (updated) values in
+					refSkel = data["dest"]
+					dbObj["dest"] = refSkel.serialize(parentIndexed=True)
+					dbObj["src"] = parentValues
+					if self.using is not None:
+						usingSkel = data["rel"]
+						dbObj["rel"] = usingSkel.serialize(parentIndexed=True)
+					dbObj["viur_delayed_update_tag"] = time()
+					dbObj["viur_relational_updateLevel"] = self.updateLevel
+					dbObj["viur_relational_consistency"] = self.consistency.value
+					dbObj["viur_foreign_keys"] = self.refKeys
+					dbObj["viurTags"] = srcEntity.get("viurTags")  # Copy tags over so we can still use our searchengine
+					db.Put(dbObj)
+					values.remove(data)
+			# Add any new Relation
+			for val in values:
+				dbObj = db.Entity(db.Key("viur-relations", parent=key))
+				refSkel = val["dest"]
 				dbObj["dest"] = refSkel.serialize(parentIndexed=True)
 				dbObj["src"] = parentValues
 				if self.using is not None:
-					usingSkel = data["rel"]
+					usingSkel = val["rel"]
 					dbObj["rel"] = usingSkel.serialize(parentIndexed=True)
 				dbObj["viur_delayed_update_tag"] = time()
+				dbObj["viur_src_kind"] = skel.kindName  # The kind of the entry referencing
+				dbObj["viur_src_property"] = boneName  # The key of the bone referencing
+				dbObj["viur_dest_kind"] = self.kind
 				dbObj["viur_relational_updateLevel"] = self.updateLevel
 				dbObj["viur_relational_consistency"] = self.consistency.value
 				dbObj["viur_foreign_keys"] = self.refKeys
-				dbObj["viurTags"] = srcEntity.get("viurTags")  # Copy tags over so we can still use our searchengine
 				db.Put(dbObj)
-				values.remove(data)
-		# Add any new Relation
-		for val in values:
-			dbObj = db.Entity(db.Key("viur-relations", parent=key))
-			refSkel = val["dest"]
-			dbObj["dest"] = refSkel.serialize(parentIndexed=True)
-			dbObj["src"] = parentValues
-			if self.using is not None:
-				usingSkel = val["rel"]
-				dbObj["rel"] = usingSkel.serialize(parentIndexed=True)
-			dbObj["viur_delayed_update_tag"] = time()
-			dbObj["viur_src_kind"] = skel.kindName  # The kind of the entry referencing
-			dbObj["viur_src_property"] = boneName  # The key of the bone referencing
-			dbObj["viur_dest_kind"] = self.kind
-			dbObj["viur_relational_updateLevel"] = self.updateLevel
-			dbObj["viur_relational_consistency"] = self.consistency.value
-			dbObj["viur_foreign_keys"] = self.refKeys
-			db.Put(dbObj)
 
 	def postDeletedHandler(self, skel, boneName, key):
 		dbVals = db.Query("viur-relations")  # skel.kindName+"_"+self.kind+"_"+key
@@ -390,7 +391,7 @@ class relationalBone(baseBone):
 		dbVals.filter("viur_dest_kind =", self.kind)
 		dbVals.filter("viur_src_property =", boneName)
 		dbVals.filter("src.key =", key)
-		db.Delete([x for x in dbVals.run(keysOnly=True)])
+		db.Delete(list(dbVals.iter(keysOnly=True)))
 
 	def isInvalid(self, key):
 		return None
@@ -1,9 +1,20 @@
 # -*- coding: utf-8 -*-
+import json
 import logging
-from datetime import timedelta
+import zlib
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar, copy_context
+from copy import copy
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
 from functools import wraps
-from hashlib import sha512
-from typing import List, Union
+from hashlib import blake2b
+from threading import Event, Lock
+from time import monotonic, sleep
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+import webob
 
 from viur.core import db, tasks, utils
 from viur.core.config import conf
@@ -17,12 +28,771 @@ from viur.core.utils import currentLanguage, currentRequest
 	be used to cache the output of custom build functions.
 	Admins can bypass this cache by sending the X-Viur-Disable-Cache http Header
 	along with their requests.
+
+	Results are kept in two tiers: An in-process LRU (bounded by conf["viur.cache.localMaxBytes"])
+	in front of the viur-cache kind in the datastore. To invalidate the in-process tiers of all
+	instances, flushCache increases generation counters (one per top-level path and one per kind)
+	stored in the datastore; each instance re-reads them at most every
+	conf["viur.cache.generationCheckInterval"] seconds. Entries recorded under an older generation
+	are discarded.
+
+	Responses are stored gzip-compressed (at level conf["viur.cache.compressionLevel"]) and served that way to
+	clients accepting it. Payloads larger than conf["viur.cache.chunkSize"] are split across viur-cache-chunk
+	entities, which are fetched with a single batch get.
+
+	The results of sub-requests issued by templates (execRequest with cachetime) are cached as fragments by
+	:func:`cachedFragment` using the same tiers and invalidation (see :class:`FragmentCache`).
+
+	Cached responses carry an ETag (the hash of the body) and Last-Modified (the time the entry has been
+	created), so conditional requests are answered with 304 before the body is loaded. enableCache's
+	cacheControl emits Cache-Control headers, ie. to let CDNs serve them (s-maxage).
+
+	If conf["viur.cache.warming.paths"] is set, the requests to each entry are counted (see :class:`CacheHits`)
+	and that many of the most requested entries are rendered ahead of traffic by :func:`warmCache`, which runs
+	periodically, after deploys and shortly after flushCache.
+
+	To avoid a stampede of requests rebuilding the same entry once it expired or got flushed, enableCache
+	can coordinate them (singleFlight): Only the request holding the render lease of an entry (an in-process
+	event plus a short-lived lease entity in the datastore shared by all instances) renders it, the others
+	wait for its result. With staleWhileRevalidate, the outdated entry is served to everyone else meanwhile.
 """
 
 viurCacheName = "viur-cache"
+viurCacheGenerationName = "viur-cache-generation"
+viurCacheLeaseName = "viur-cache-lease"
+viurCacheChunkName = "viur-cache-chunk"
+viurCacheHitsName = "viur-cache-hits"
+viurCacheWarmingName = "viur-cache-warming"
+
+# Payloads smaller than that (in bytes) aren't worth compressing
+_compressionMinSize = 1024
+
+# The hit counts of cache entries halve after that many seconds without requests
+_hitHalfLife = 24 * 60 * 60
+# How many (of the most requested) entries an instance writes hit counts for at once
+_hitFlushSize = 100
+# Set while warmCache renders an entry, so these renders aren't counted as hits
+_isWarming: ContextVar[bool] = ContextVar("Cache-Warming", default=False)
+
+# Seconds between two reads of the datastore while waiting for an entry rendered by another instance
+_leasePollInterval = 0.25
+
+
+def _pathGenerationName(path: str) -> str:
+	"""
+		Returns the name of the generation counter covering *path* (ie. "path:/page" for "/page/view").
+	"""
+	return "path:/" + path.strip("/").split("/")[0]
+
+
+def _kindOf(entry: Union[db.KeyClass, str]) -> str:
+	"""
+		Returns the kind of an entry of the access log (a key or the name of a kind queried).
+	"""
+	return entry.kind if isinstance(entry, db.KeyClass) else entry
+
+
+def _entryGenerationNames(path: str, accessedEntries: Iterable[Union[db.KeyClass, str]]) -> Set[str]:
+	"""
+		Returns the names of all generation counters a cache entry for *path* depends on.
+	"""
+	res = {"path:*", _pathGenerationName(path)}
+	res.update(["kind:" + _kindOf(x) for x in accessedEntries])
+	return res
+
+
+def _flushGenerationNames(prefix: Union[str, None], key: Union[db.KeyClass, str, None],
+						  kind: Union[str, None]) -> Set[str]:
+	"""
+		Returns the names of the generation counters to increase for a call to :func:`flushCache`.
+	"""
+	res = set()
+	if prefix is not None:
+		path = prefix.rstrip("*")
+		if prefix.endswith("*") and (not path.strip("/") or ("/" not in path.strip("/") and not path.endswith("/"))):
+			# "/*" or a prefix of the first path segment (like "/pa*"): that might match any path
+			res.add("path:*")
+		else:
+			res.add(_pathGenerationName(path))
+	if key is not None:
+		if not isinstance(key, db.KeyClass):
+			key = db.KeyClass.from_legacy_urlsafe(key)
+		res.add("kind:" + key.kind)
+	if kind is not None:
+		res.add("kind:" + kind)
+	return res
+
+
+# A response as kept by the cache: (content-type, payload, encoding, binary, etag, last-modified). The payload is
+# compressed if encoding is set (currently only "gzip"); binary tells if the function returned bytes (or str) before.
+CachedResponse = Tuple[str, Union[str, bytes], Optional[str], bool, Optional[str], datetime]
+
+
+def _packPayload(res: Union[str, bytes]) -> Tuple[Union[str, bytes], Optional[str]]:
+	"""
+		Compresses *res* unless compression is disabled or not worth it.
+
+		:returns: The payload and its encoding ("gzip" or None if it's *res* unchanged)
+	"""
+	level = conf["viur.cache.compressionLevel"]
+	raw = res.encode("UTF-8") if isinstance(res, str) else res
+	if level is None or len(raw) < _compressionMinSize:
+		return res, None
+	compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # Wrapped in a gzip header
+	payload = compressor.compress(raw) + compressor.flush()
+	if len(payload) >= len(raw):
+		return res, None
+	return payload, "gzip"
+
+
+def _unpackPayload(payload: Union[str, bytes], encoding: Optional[str], binary: bool) -> Union[str, bytes]:
+	"""
+		Reverts :func:`_packPayload`.
+	"""
+	if encoding == "gzip":
+		payload = zlib.decompress(payload, 16 + zlib.MAX_WBITS)
+	if not binary and isinstance(payload, bytes):
+		return payload.decode("UTF-8")
+	return payload
+
+
+def _acceptsEncoding(acceptEncoding: str, encoding: str) -> bool:
+	"""
+		Checks if *encoding* is listed (with a non-zero quality) in the Accept-Encoding header *acceptEncoding*.
+	"""
+	for part in acceptEncoding.split(","):
+		name, unused, params = part.partition(";")
+		if name.strip().lower() not in {encoding, "*"}:
+			continue
+		quality = params.strip()
+		if quality.startswith("q="):
+			try:
+				return float(quality[2:]) > 0
+			except ValueError:
+				return False
+		return True
+	return False
+
+
+def _servedEncoding(encoding: Optional[str]) -> Optional[str]:
+	"""
+		Returns *encoding* if a payload in that encoding can be passed through to the client as it is. That's not the
+		case if the client doesn't accept it or we're answering a sub-request (ie. one issued by execRequest).
+	"""
+	currReq = currentRequest.get()
+	if encoding is None or currReq.internalRequest \
+			or not _acceptsEncoding(currReq.request.headers.get("Accept-Encoding", ""), encoding):
+		return None
+	return encoding
+
+
+def _isNotModified(etag: Optional[str], lastModified: datetime, encoding: Optional[str] = None) -> bool:
+	"""
+		Evaluates the If-None-Match and If-Modified-Since headers of the current request against the validators of
+		a cached response, served in the content-encoding *encoding* (see :func:`_setHttpHeaders`).
+	"""
+	currReq = currentRequest.get()
+	if currReq.internalRequest or currReq.isPostRequest:
+		return False
+	ifNoneMatch = currReq.request.headers.get("If-None-Match")
+	if ifNoneMatch:  # Takes precedence over If-Modified-Since
+		if etag is None:
+			return False
+		servedTag = "%s-%s" % (etag, encoding) if encoding else etag
+		for tag in ifNoneMatch.split(","):
+			tag = tag.strip()
+			if tag.startswith("W/"):
+				tag = tag[2:]
+			if tag == "*" or tag.strip('"') == servedTag:
+				return True
+		return False
+	ifModifiedSince = currReq.request.headers.get("If-Modified-Since")
+	if ifModifiedSince:
+		try:
+			ifModifiedSince = parsedate_to_datetime(ifModifiedSince)
+		except (TypeError, ValueError):
+			return False
+		if ifModifiedSince.tzinfo is None:
+			ifModifiedSince = ifModifiedSince.replace(tzinfo=timezone.utc)
+		return lastModified.replace(microsecond=0) <= ifModifiedSince
+	return False
+
+
+def _setHttpHeaders(etag: Optional[str], lastModified: datetime, cacheControl: Optional[str],
+					encoding: Optional[str] = None) -> None:
+	"""
+		Sets the validators (ETag, Last-Modified) and the Cache-Control header of a cached response.
+		Variants served in different content-encodings get different (strong) ETags.
+	"""
+	headers = currentRequest.get().response.headers
+	if etag is not None:
+		headers["ETag"] = '"%s-%s"' % (etag, encoding) if encoding else '"%s"' % etag
+	headers["Last-Modified"] = format_datetime(lastModified.astimezone(timezone.utc), usegmt=True)
+	if cacheControl:
+		headers["Cache-Control"] = cacheControl
+
+
+def _notModified(etag: Optional[str], lastModified: datetime, cacheControl: Optional[str],
+				 encoding: Optional[str] = None) -> bytes:
+	"""
+		Answers the current request with 304 Not Modified.
+	"""
+	currReq = currentRequest.get()
+	currReq.response.status = "304 Not Modified"
+	if encoding is not None:
+		currReq.response.headers["Vary"] = "Accept-Encoding"
+	_setHttpHeaders(etag, lastModified, cacheControl, _servedEncoding(encoding))
+	cacheStats.record("notModified")
+	return b""
+
 
+def _respond(response: CachedResponse, cacheControl: Optional[str] = None, isRoutedCall: bool = True) -> Any:
+	"""
+		Returns a cached response to the client (or 304 if the client's copy is still valid). Compressed payloads
+		are passed through as they are if possible (see :func:`_servedEncoding`).
+		If it's not returned to the client, but to the code calling the cached function (see
+		:func:`_claimRoutedCall`), it's always returned decoded and the validators aren't set.
+	"""
+	contentType, payload, encoding, binary, etag, lastModified = response
+	currReq = currentRequest.get()
+	currReq.response.headers['Content-Type'] = contentType
+	if not isRoutedCall:
+		return _unpackPayload(payload, encoding, binary)
+	if encoding is not None:
+		currReq.response.headers["Vary"] = "Accept-Encoding"
+	servedEncoding = _servedEncoding(encoding)
+	if _isNotModified(etag, lastModified, servedEncoding):
+		return _notModified(etag, lastModified, cacheControl, encoding)
+	_setHttpHeaders(etag, lastModified, cacheControl, servedEncoding)
+	if servedEncoding is not None:
+		currReq.response.headers["Content-Encoding"] = servedEncoding
+		return payload
+	return _unpackPayload(payload, encoding, binary)
+
+
+def _claimRoutedCall(wrapper: Callable) -> bool:
+	"""
+		Checks if the cached function *wrapper* is the one the current request has been routed to, and not just
+		called by other code handling that request. Only that call may pass compressed payloads through, answer
+		with 304 and set the validators of the response. It can be claimed only once per request, so a cached
+		function calling itself doesn't qualify either.
+	"""
+	currReq = currentRequest.get()
+	if currReq.internalRequest or getattr(currReq, "routedCallable", None) is not wrapper:
+		return False
+	currReq.routedCallable = None
+	return True
+
+
+def _chunkKeys(key: str, chunks: int) -> List[db.KeyClass]:
+	return [db.Key(viurCacheChunkName, "%s-%s" % (key, idx)) for idx in range(1, chunks + 1)]
+
+
+def _loadResponse(entity: db.Entity) -> Optional[CachedResponse]:
+	"""
+		Assembles the response stored in the cache entry *entity*, fetching its chunks (if any) with a single
+		batch get.
+
+		:returns: The response or None if chunks are missing or belong to a different version of that entry
+	"""
+	payload = entity["data"]
+	if entity.get("chunks"):
+		chunks = db.Get(_chunkKeys(entity.key.name, entity["chunks"]))
+		if any([x is None or x["token"] != entity["token"] for x in chunks]):
+			return None
+		payload = b"".join([payload] + [x["data"] for x in chunks])
+	return (entity["content-type"], payload, entity.get("encoding"), bool(entity.get("binary")), entity.get("etag"),
+			entity["creationtime"])
+
+
+def _storeResponse(key: str, path: str, res: Any, contentType: str,
+				   accessedEntries: List[Union[db.KeyClass, str]], generations: Dict[str, int],
+				   previous: Optional[db.Entity]) -> Tuple[db.Entity, CachedResponse]:
+	"""
+		Compresses *res* and writes it to the cache entry *key* (and as many chunks as needed).
+		Chunks left over by the *previous* version of that entry are deleted.
+		Results which are neither str nor bytes are stored as they are (without compression, chunks and ETag).
+	"""
+	chunkSize = conf["viur.cache.chunkSize"]
+	if isinstance(res, (str, bytes)):
+		payload, encoding = _packPayload(res)
+		etag = blake2b(res.encode("UTF-8") if isinstance(res, str) else res, digest_size=16).hexdigest()
+		if isinstance(payload, str) and len(payload) > chunkSize // 4:  # Up to four bytes per character
+			payload = payload.encode("UTF-8")
+		chunks = max(0, (len(payload) - 1) // chunkSize)
+	else:
+		payload, encoding, etag, chunks = res, None, None, 0
+	dbEntity = db.Entity(db.Key(viurCacheName, key))
+	dbEntity["data"] = payload[:chunkSize] if chunks else payload
+	dbEntity["chunks"] = chunks
+	dbEntity["token"] = utils.generateRandomString(8)
+	dbEntity["encoding"] = encoding
+	dbEntity["binary"] = isinstance(res, bytes)
+	dbEntity["etag"] = etag
+	dbEntity["creationtime"] = utils.utcNow()
+	dbEntity["path"] = path
+	dbEntity["content-type"] = contentType
+	dbEntity["accessedEntries"] = accessedEntries
+	dbEntity["generations"] = json.dumps(generations)
+	dbEntity.exclude_from_indexes = ["data", "chunks", "token", "encoding", "binary", "etag", "content-type",
+									 "generations"]
+	entities = []
+	for idx, chunkKey in enumerate(_chunkKeys(key, dbEntity["chunks"]), 1):
+		# Chunks repeat path and accessedEntries, so flushCache finds them like their entries
+		chunk = db.Entity(chunkKey)
+		chunk["data"] = payload[idx * chunkSize: (idx + 1) * chunkSize]
+		chunk["token"] = dbEntity["token"]
+		chunk["path"] = path
+		chunk["accessedEntries"] = accessedEntries
+		chunk.exclude_from_indexes = ["data", "token"]
+		entities.append(chunk)
+	entities.append(dbEntity)  # Readers detect chunks of a different version by their token
+	db.Put(entities)
+	if previous is not None and (previous.get("chunks") or 0) > dbEntity["chunks"]:
+		db.Delete(_chunkKeys(key, previous["chunks"])[dbEntity["chunks"]:])
+	return dbEntity, (contentType, payload, encoding, dbEntity["binary"], etag, dbEntity["creationtime"])
+
+
+class CacheGenerations(object):
+	"""
+		Generation counters of parts of the cache, shared by all instances through the datastore.
+		They're read (with a single query) at most every conf["viur.cache.generationCheckInterval"] seconds.
+	"""
+
+	def __init__(self):
+		super(CacheGenerations, self).__init__()
+		self._generations: Dict[str, int] = {}
+		# Bumps done locally, but not yet seen in the datastore: Name -> [(token, generation seen before the bump)]
+		self._pending: Dict[str, List[Tuple[str, int]]] = {}
+		self._lastRefresh: Optional[float] = None
+		self._lock = Lock()
+
+	def current(self) -> Dict[str, int]:
+		"""
+			Returns the generation counters known to this instance, re-reading them if they're outdated.
+		"""
+		with self._lock:
+			lastRefresh = self._lastRefresh
+		if lastRefresh is None or monotonic() - lastRefresh >= conf["viur.cache.generationCheckInterval"]:
+			generations, appliedTokens = {}, {}
+			for entity in db.Query(viurCacheGenerationName).iter():
+				generations[entity.key.name] = entity["generation"]
+				appliedTokens[entity.key.name] = set(entity.get("tokens") or [])
+			with self._lock:
+				# Our bumps still waiting for their deferred task are added on top of the datastore's counters
+				for name, bumps in list(self._pending.items()):
+					generation = generations.get(name, 0)
+					bumps = [(token, base) for token, base in bumps if token not in appliedTokens.get(name, ())
+							 and generation <= base + _maxGenerationTokens]
+					if bumps:
+						self._pending[name] = bumps
+						generations[name] = generation + len(bumps)
+					else:
+						del self._pending[name]
+				self._generations = generations
+				self._lastRefresh = monotonic()
+		return self._generations
+
+	def snapshot(self, names: Iterable[str], generations: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+		"""
+			Returns the generation of each of the counters in *names*, taken from *generations* (defaulting to
+			:func:`current`).
+		"""
+		if generations is None:
+			generations = self.current()
+		return {x: generations.get(x, 0) for x in names}
+
+	def isCurrent(self, snapshot: Dict[str, int]) -> bool:
+		"""
+			Checks if none of the counters in *snapshot* has been increased since that snapshot has been taken.
+		"""
+		generations = self.current()
+		return all([generations.get(k, 0) == v for k, v in snapshot.items()])
+
+	def bump(self, names: Iterable[str]) -> None:
+		"""
+			Increases the given generation counters, invalidating all entries depending on them.
+
+			The counters of this instance are increased immediately. The datastore (and so the other
+			instances) follows in a deferred task, as these counters are written by every edit of a
+			kind and would cause contention (and failing requests) otherwise.
+		"""
+		names = list(names)
+		if not names:
+			return
+		self.current()
+		token = utils.generateRandomString(13)
+		with self._lock:
+			self._generations = dict(self._generations)
+			for name in names:
+				base = self._generations.get(name, 0) - len(self._pending.get(name, []))
+				self._pending.setdefault(name, []).append((token, base))
+				self._generations[name] = self._generations.get(name, 0) + 1
+		_bumpCacheGenerations(names, token)
+
+
+# How many tokens of the latest bumps are kept with each generation counter
+_maxGenerationTokens = 100
+
+
+@tasks.callDeferred
+def _bumpCacheGenerations(names: List[str], token: str) -> None:
+	"""
+		Increases the given generation counters in the datastore. The counters record the *token* of that bump,
+		so the instance which issued it can tell when its bump has arrived. A db.Conflict fails (and so retries)
+		the task.
+	"""
+
+	def txnBump(key: db.KeyClass) -> None:
+		entity = db.Get(key) or db.Entity(key)
+		tokens = entity.get("tokens") or []
+		if token in tokens:  # This bump has already been applied by a previous try of this task
+			return
+		entity["generation"] = (entity.get("generation") or 0) + 1
+		entity["tokens"] = ([token] + tokens)[:_maxGenerationTokens]
+		entity.exclude_from_indexes = ["tokens"]
+		db.Put(entity)
+
+	for name in names:
+		db.RunInTransaction(txnBump, db.Key(viurCacheGenerationName, name))
+
+
+cacheGenerations = CacheGenerations()
+
+
+class LocalCache(object):
+	"""
+		The in-process tier of the cache: a LRU holding up to conf["viur.cache.localMaxBytes"] bytes of responses.
+	"""
+
+	def __init__(self):
+		super(LocalCache, self).__init__()
+		# Maps cache keys to (creationtime, response, generations, size, accessed entries)
+		self._entries: OrderedDict[str, Tuple[datetime, CachedResponse, Dict[str, int], int, Optional[List[Any]]]] \
+			= OrderedDict()
+		self.totalBytes = 0
+		self._lock = Lock()
+
+	def get(self, key: str, maxCacheTime: Optional[int]) -> Optional[CachedResponse]:
+		"""
+			Returns the response stored under *key*, if there's one that's still valid.
+		"""
+		res = self.lookup(key, maxCacheTime)
+		return res[0] if res is not None else None
+
+	def lookup(self, key: str, maxCacheTime: Optional[int]) -> Optional[Tuple[CachedResponse, Optional[List[Any]]]]:
+		"""
+			Like :func:`get`, but also returns the accessed entries stored along with that response (if any).
+		"""
+		with self._lock:
+			entry = self._entries.get(key)
+		if entry is None:
+			return None
+		creationTime, response, generations, size, accessedEntries = entry
+		if (maxCacheTime and creationTime <= utils.utcNow() - timedelta(seconds=maxCacheTime)) \
+				or not cacheGenerations.isCurrent(generations):
+			self._evict(key)
+			return None
+		with self._lock:
+			if key in self._entries:
+				self._entries.move_to_end(key)
+		return response, accessedEntries
 
-def keyFromArgs(f, userSensitive, languageSensitive, evaluatedArgs, path, args, kwargs):
+	def set(self, key: str, creationTime: datetime, response: CachedResponse, generations: Dict[str, int],
+			accessedEntries: Optional[List[Any]] = None) -> None:
+		"""
+			Stores a response, evicting the least recently used ones if the cache grows too large.
+		"""
+		payload = response[1]
+		if isinstance(payload, (str, bytes)):
+			size = len(payload.encode("UTF-8") if isinstance(payload, str) else payload)
+		else:
+			size = len(repr(payload))
+		maxBytes = conf["viur.cache.localMaxBytes"]
+		if not maxBytes or size > maxBytes:
+			return
+		with self._lock:
+			if key in self._entries:
+				self.totalBytes -= self._entries[key][3]
+			self._entries[key] = (creationTime, response, generations, size, accessedEntries)
+			self._entries.move_to_end(key)
+			self.totalBytes += size
+			while self.totalBytes > maxBytes:
+				unused, entry = self._entries.popitem(last=False)
+				self.totalBytes -= entry[3]
+
+	def _evict(self, key: str) -> None:
+		with self._lock:
+			entry = self._entries.pop(key, None)
+			if entry is not None:
+				self.totalBytes -= entry[3]
+
+	def clear(self) -> None:
+		with self._lock:
+			self._entries.clear()
+			self.totalBytes = 0
+
+
+localCache = LocalCache()
+
+
+class RenderLeases(object):
+	"""
+		Ensures only one request at a time renders a given cache entry. Within this process, the requests waiting
+		for the same entry are coordinated by events; across instances by lease entities in the datastore, which
+		expire after conf["viur.cache.leaseTime"] seconds (in case their holder died while rendering).
+	"""
+
+	def __init__(self):
+		super(RenderLeases, self).__init__()
+		self._events: Dict[str, Event] = {}
+		self._remoteLeases: Dict[str, float] = {}  # Cache key -> when the lease held by another instance expires
+		self._tokens: Dict[str, str] = {}  # Cache key -> token of the lease held by this process
+		self._lock = Lock()
+
+	def acquire(self, key: str) -> Tuple[str, Event]:
+		"""
+			Tries to obtain the lease for rendering the entry *key*.
+
+			:returns: The state and the event signaling the end of the render. The state is one of
+				"render" (this request holds the lease and must render the entry), "poll" (another instance renders
+				it; this request is the one of this process waiting for it) or "wait" (another request of this
+				process renders or polls it; wait for the event). Unless the state is "wait", :func:`release` must be
+				called afterwards.
+		"""
+
+		def txnAcquire(leaseKey: db.KeyClass, leaseTime: int, token: str) -> Optional[datetime]:
+			lease = db.Get(leaseKey)
+			if lease is not None and lease["expires"] > utils.utcNow():
+				return lease["expires"]
+			lease = db.Entity(leaseKey)
+			lease["expires"] = utils.utcNow() + timedelta(seconds=leaseTime)
+			lease["token"] = token
+			lease.exclude_from_indexes = ["token"]
+			db.Put(lease)
+			return None
+
+		with self._lock:
+			event = self._events.get(key)
+			if event is not None:
+				return "wait", event
+			event = self._events[key] = Event()
+			remoteLeaseExpires = self._remoteLeases.get(key)
+			if remoteLeaseExpires is not None and remoteLeaseExpires <= monotonic():
+				del self._remoteLeases[key]
+				remoteLeaseExpires = None
+		if remoteLeaseExpires is None:
+			leaseTime = conf["viur.cache.leaseTime"]
+			token = utils.generateRandomString(13)
+			try:
+				heldUntil = db.RunInTransaction(txnAcquire, db.Key(viurCacheLeaseName, key), leaseTime, token)
+			except db.Conflict:  # Another instance acquired it concurrently
+				heldUntil = utils.utcNow() + timedelta(seconds=leaseTime)
+			if heldUntil is None:
+				with self._lock:
+					self._tokens[key] = token
+				return "render", event
+			with self._lock:
+				self._remoteLeases[key] = monotonic() + (heldUntil - utils.utcNow()).total_seconds()
+		return "poll", event
+
+	def release(self, key: str, state: str) -> None:
+		"""
+			Gives up the lease obtained by :func:`acquire` and wakes up the requests waiting for it.
+			If our lease has expired while rendering, it might have been taken over by another instance since;
+			so the lease is only deleted if it's still ours.
+		"""
+
+		def txnRelease(leaseKey: db.KeyClass, token: str) -> None:
+			lease = db.Get(leaseKey)
+			if lease is not None and lease.get("token") == token:
+				db.Delete(leaseKey)
+
+		if state == "render":
+			with self._lock:
+				token = self._tokens.pop(key, None)
+			if token is not None:
+				try:
+					db.RunInTransaction(txnRelease, db.Key(viurCacheLeaseName, key), token)
+				except db.Conflict:  # Someone else is taking it over; ours would expire anyway
+					pass
+		with self._lock:
+			event = self._events.pop(key, None)
+		if event is not None:
+			event.set()
+
+	def remoteLeaseEnded(self, key: str) -> None:
+		with self._lock:
+			self._remoteLeases.pop(key, None)
+
+
+renderLeases = RenderLeases()
+
+
+class CacheStats(object):
+	"""
+		Counts how the requests to cached functions have been served by this instance.
+	"""
+	events = ["hits", "localHits", "misses", "notModified", "coalescedWaits", "staleServes", "waitTimeouts",
+			  "fragmentHits", "fragmentMisses"]
+
+	def __init__(self):
+		super(CacheStats, self).__init__()
+		self._lock = Lock()
+		self.reset()
+
+	def reset(self) -> None:
+		with self._lock:
+			self.counters: Counter[str] = Counter()
+
+	def record(self, event: str) -> None:
+		"""
+			Counts *event*, which is one of
+			"hits" (served from the datastore), "localHits" (served from the in-process tier),
+			"misses" (rendered), "notModified" (answered with 304; in addition to how the entry has been found),
+			"coalescedWaits" (served the result of a render running concurrently),
+			"staleServes" (served an outdated entry while it's being rebuilt) and
+			"waitTimeouts" (rendered after waiting for a concurrent render in vain),
+			"fragmentHits" and "fragmentMisses" (sub-requests served by :func:`cachedFragment` or rendered).
+		"""
+		with self._lock:
+			self.counters[event] += 1
+
+	def snapshot(self) -> Dict[str, Any]:
+		"""
+			Returns a copy of the current counters.
+		"""
+		with self._lock:
+			return {x: self.counters[x] for x in self.events}
+
+
+cacheStats = CacheStats()
+
+
+class CacheHits(object):
+	"""
+		Counts the requests to each cache entry and remembers how to request it again. The counts are kept
+		in-process and added to the viur-cache-hits entities at most every conf["viur.cache.warming.flushInterval"]
+		seconds (by the request that's due). Concurrent flushes by several instances may lose some counts, which
+		is fine for telling the popular entries apart.
+	"""
+
+	def __init__(self):
+		super(CacheHits, self).__init__()
+		# Maps cache keys to [count, path, args, kwargs, language]
+		self._pending: Dict[str, List[Any]] = {}
+		self._lastFlush = monotonic()
+		self._lock = Lock()
+
+	def record(self, key: str, path: str, args: Iterable[Any], kwargs: Dict[str, Any],
+			   language: Optional[str]) -> None:
+		"""
+			Counts a request to the entry *key*, rendered by the function at *path* given *args* and *kwargs*.
+		"""
+		if not conf["viur.cache.warming.paths"]:
+			return
+		with self._lock:
+			if key in self._pending:
+				self._pending[key][0] += 1
+			else:
+				self._pending[key] = [1, path, list(args), kwargs, language]
+			if monotonic() - self._lastFlush < conf["viur.cache.warming.flushInterval"]:
+				return
+			pending, self._pending = self._pending, {}
+			self._lastFlush = monotonic()
+		self._write(pending)
+
+	def _write(self, pending: Dict[str, List[Any]]) -> None:
+		pending = sorted(pending.items(), key=lambda x: x[1][0], reverse=True)[:_hitFlushSize]
+		entities = []
+		now = utils.utcNow()
+		for (key, (count, path, args, kwargs, language)), entity in zip(
+				pending, db.Get([db.Key(viurCacheHitsName, x[0]) for x in pending])):
+			try:
+				args, kwargs = json.dumps(args), json.dumps(kwargs)
+			except TypeError:  # Not called from an url; we can't request that entry again
+				continue
+			if entity is None:
+				entity = db.Entity(db.Key(viurCacheHitsName, key))
+			entity["hits"] = _decayedHits(entity) + count
+			entity["lastHit"] = now
+			entity["path"] = path
+			entity["args"] = args
+			entity["kwargs"] = kwargs
+			entity["language"] = language
+			entity.exclude_from_indexes = ["lastHit", "path", "args", "kwargs", "language"]
+			entities.append(entity)
+		db.Put(entities)
+
+
+cacheHits = CacheHits()
+
+
+def _decayedHits(entity: db.Entity) -> float:
+	if not entity.get("hits"):
+		return 0
+	age = (utils.utcNow() - entity["lastHit"]).total_seconds()
+	return entity["hits"] * 0.5 ** (max(age, 0) / _hitHalfLife)
+
+
+def _entityGenerations(entity: db.Entity) -> Optional[Dict[str, int]]:
+	return json.loads(entity["generations"]) if entity.get("generations") else None
+
+
+def _isFresh(entity: db.Entity, maxCacheTime: Optional[int], previous: Optional[db.Entity] = None) -> bool:
+	"""
+		Checks if the cache entry *entity* may be served, ie. it's neither expired nor flushed.
+		If *previous* (the outdated entry we've been waiting to be replaced) is given, any entry newer
+		than that one is accepted regardless of the generations known to this instance.
+	"""
+	if maxCacheTime and entity["creationtime"] <= utils.utcNow() - timedelta(seconds=maxCacheTime):
+		return False
+	if previous is not None and entity["creationtime"] > previous["creationtime"]:
+		return True
+	generations = _entityGenerations(entity)
+	return generations is None or cacheGenerations.isCurrent(generations)
+
+
+def _readEntry(key: str) -> Tuple[Optional[db.Entity], Optional[db.Entity]]:
+	"""
+		Reads the cache entry *key* and its render lease directly from the datastore. The (per request)
+		identity map would otherwise serve the state of the first read again.
+	"""
+	entry, lease = db.TransactionRunner(readOnly=True).run(
+		db.Get, [db.Key(viurCacheName, key), db.Key(viurCacheLeaseName, key)])
+	return entry, lease
+
+
+def _awaitRender(key: str, state: str, event: Event, maxCacheTime: Optional[int],
+				 previous: Optional[db.Entity]) -> Optional[CachedResponse]:
+	"""
+		Waits up to conf["viur.cache.singleFlightTimeout"] seconds for the entry *key* rendered by another request.
+
+		:param state: "wait" or "poll" as returned by :func:`RenderLeases.acquire`
+		:returns: The response or None if the other request didn't deliver it in time (or failed)
+	"""
+	deadline = monotonic() + conf["viur.cache.singleFlightTimeout"]
+	if state == "wait":
+		event.wait(conf["viur.cache.singleFlightTimeout"])
+		localRes = localCache.get(key, maxCacheTime)
+		if localRes is not None:
+			return localRes
+		entry, lease = _readEntry(key)
+		return _entryResponse(key, entry) if entry is not None and _isFresh(entry, maxCacheTime, previous) else None
+	while monotonic() < deadline:
+		sleep(_leasePollInterval)
+		entry, lease = _readEntry(key)
+		if entry is not None and _isFresh(entry, maxCacheTime, previous):
+			renderLeases.remoteLeaseEnded(key)
+			return _entryResponse(key, entry)
+		if lease is None or lease["expires"] <= utils.utcNow():  # The other instance gave up
+			renderLeases.remoteLeaseEnded(key)
+			return None
+	return None
+
+
+def keyFromArgs(f, userSensitive, languageSensitive, evaluatedArgs, path, args, kwargs,
+				callSignature: Optional[utils.CallSignature] = None):
 	"""
 		Parses args and kwargs according to the information's given
 		by evaluatedArgs and argsOrder. Returns an unique key for this
@@ -43,27 +813,18 @@ def keyFromArgs(f, userSensitive, languageSensitive, evaluatedArgs, path, args,
 		:type evaluatedArgs: list
 		:param path: Path to the function called but without parameters (ie. "/page/view")
 		:type path: str
+		:param callSignature: The signature of f (without self), if already known
 		:returns: The unique key derived
 	"""
-	res = {}
-	argsOrder = list(f.__code__.co_varnames)[1: f.__code__.co_argcount]
-	# Map default values in
-	reversedArgsOrder = argsOrder[:: -1]
-	for defaultValue in list(f.__defaults__ or [])[:: -1]:
-		res[reversedArgsOrder.pop(0)] = defaultValue
-	del reversedArgsOrder
-	# Map args in
-	setArgs = []  # Store a list of args already set by *args
-	for idx in range(0, min(len(args), len(argsOrder))):
-		if argsOrder[idx] in evaluatedArgs:
-			setArgs.append(argsOrder[idx])
-			res[argsOrder[idx]] = args[idx]
-	# Last, we map the kwargs in
-	for k, v in kwargs.items():
-		if k in evaluatedArgs:
-			if k in setArgs:
-				raise AssertionError("Got dupplicate arguments for %s" % k)
-			res[k] = v
+	if callSignature is None:
+		callSignature = utils.getCallSignature(f, True)
+	try:
+		res = callSignature.bind(args, kwargs, evaluatedArgs)
+	except TypeError as e:
+		raise AssertionError(str(e))
+	if res is None:
+		# we have too few parameters for this function; that wont work
+		return None
 	if userSensitive:
 		user = utils.getCurrentUser()
 		if userSensitive == 1 and user:  # We dont cache requests for each user separately
@@ -93,27 +854,35 @@ def keyFromArgs(f, userSensitive, languageSensitive, evaluatedArgs, path, args,
 		logging.error("Could not determine the current application version! Caching might produce unexpected results!")
 		appVersion = ""
 	res["__appVersion"] = appVersion
-	# Last check, that every parameter is satisfied:
-	if not all([x in res.keys() for x in argsOrder]):
-		# we have too few parameters for this function; that wont work
-		return None
-	res = list(res.items())  # flatten our dict to a list
-	res.sort(key=lambda x: x[0])  # sort by keys
-	mysha512 = sha512()
-	mysha512.update(str(res).encode("UTF8"))
-	return mysha512.hexdigest()
+	# Hash a canonical representation: the arguments sorted by their names
+	return blake2b(repr(tuple(sorted(res.items()))).encode("UTF-8"), digest_size=32).hexdigest()
+
+
+def _entryResponse(key: str, entity: db.Entity) -> Optional[CachedResponse]:
+	"""
+		Loads the response stored in the cache entry *entity* and adds it to the in-process tier.
+	"""
+	response = _loadResponse(entity)
+	entryGenerations = _entityGenerations(entity)
+	if response is not None and entryGenerations is not None:
+		localCache.set(key, entity["creationtime"], response, entryGenerations)
+	return response
 
 
 def wrapCallable(f, urls: List[str], userSensitive: int, languageSensitive: bool,
-				 evaluatedArgs: List[str], maxCacheTime: int):
+				 evaluatedArgs: List[str], maxCacheTime: int, singleFlight: bool = False,
+				 staleWhileRevalidate: Optional[int] = None, cacheControl: Union[str, Dict[str, str], None] = None):
 	"""
 		Does the actual work of wrapping a callable.
 		Use the decorator enableCache instead of calling this directly.
 	"""
+	callSignature = utils.CallSignature(f, skipFirst=True)
+	evaluatedArgs = frozenset(evaluatedArgs)
 
 	@wraps(f)
 	def wrapF(self, *args, **kwargs) -> Union[str, bytes]:
 		currReq = currentRequest.get()
+		isRoutedCall = _claimRoutedCall(wrapF)
 		if conf["viur.disableCache"] or currReq.disableCache:
 			# Caching disabled
 			if conf["viur.disableCache"]:
@@ -126,39 +895,94 @@ def wrapCallable(f, urls: List[str], userSensitive: int, languageSensitive: bool
 			# This path (possibly a sub-render) should not be cached
 			logging.debug("Not caching for %s" % path)
 			return f(self, *args, **kwargs)
-		key = keyFromArgs(f, userSensitive, languageSensitive, evaluatedArgs, path, args, kwargs)
+		key = keyFromArgs(f, userSensitive, languageSensitive, evaluatedArgs, path, args, kwargs, callSignature)
 		if not key:
 			# Something is wrong (possibly the parameter-count)
 			# Let's call f, but we knew already that this will clash
 			return f(self, *args, **kwargs)
+		routeCacheControl = cacheControl.get(path) if isinstance(cacheControl, dict) else cacheControl
+		if not currReq.internalRequest and not _isWarming.get() and not userSensitive:
+			# Entries depending on the user aren't warmed, see _warmEntry
+			cacheHits.record(key, path, args, {k: v for k, v in kwargs.items() if k in evaluatedArgs},
+							 currentLanguage.get() if languageSensitive else None)
+		localRes = localCache.get(key, maxCacheTime)
+		if localRes is not None:
+			logging.debug("This request was served from the in-process cache.")
+			cacheStats.record("localHits")
+			return _respond(localRes, routeCacheControl, isRoutedCall)
+		# Snapshot the generations first, so a flush happening while we render invalidates our result
+		generations = dict(cacheGenerations.current())
 		dbRes = db.Get(db.Key(viurCacheName, key))
-		if dbRes is not None:
-			if not maxCacheTime \
-					or dbRes["creationtime"] > utils.utcNow() - timedelta(seconds=maxCacheTime):
-				# We store it unlimited or the cache is fresh enough
+		if dbRes is not None and _isFresh(dbRes, maxCacheTime):
+			# We store it unlimited or the cache is fresh enough
+			if isRoutedCall and _isNotModified(dbRes.get("etag"), dbRes["creationtime"],
+											   _servedEncoding(dbRes.get("encoding"))):
+				# Answer before assembling (and decompressing) the body
+				cacheStats.record("hits")
+				return _notModified(dbRes.get("etag"), dbRes["creationtime"], routeCacheControl, dbRes.get("encoding"))
+			dbResponse = _entryResponse(key, dbRes)
+			if dbResponse is not None:
 				logging.debug("This request was served from cache.")
-				currReq.response.headers['Content-Type'] = dbRes["content-type"]
-				return dbRes["data"]
-		# If we made it this far, the request wasn't cached or too old; we need to rebuild it
-		oldAccessLog = db.startAccessDataLog()
-		res = f(self, *args, **kwargs)
-		accessedEntries = db.popAccessData(oldAccessLog)
-		dbEntity = db.Entity(db.Key(viurCacheName, key))
-		dbEntity["data"] = res
-		dbEntity["creationtime"] = utils.utcNow()
-		dbEntity["path"] = path
-		dbEntity["content-type"] = currReq.response.headers['Content-Type']
-		dbEntity["accessedEntries"] = list(accessedEntries)
-		dbEntity.exclude_from_indexes = ["data", "content-type"]  # We can save 2 DB-Writs :)
-		db.Put(dbEntity)
+				cacheStats.record("hits")
+				return _respond(dbResponse, routeCacheControl, isRoutedCall)
+		# The entry is missing or outdated. Outdated ones may be served while another request rebuilds them
+		staleResponse = None
+		if dbRes is not None and staleWhileRevalidate is not None and (
+				not maxCacheTime
+				or dbRes["creationtime"] > utils.utcNow() - timedelta(seconds=maxCacheTime + staleWhileRevalidate)):
+			staleResponse = _loadResponse(dbRes)
+		canServeStale = staleResponse is not None
+		state = None
+		if singleFlight or canServeStale:
+			state, event = renderLeases.acquire(key)
+			if state != "render":
+				if canServeStale:
+					if state == "poll":
+						renderLeases.release(key, state)
+					logging.debug("This request was served from an outdated cache entry.")
+					cacheStats.record("staleServes")
+					return _respond(staleResponse, routeCacheControl, isRoutedCall)
+				try:
+					awaitedRes = _awaitRender(key, state, event, maxCacheTime, dbRes)
+				finally:
+					if state == "poll":
+						renderLeases.release(key, state)
+				if awaitedRes is not None:
+					logging.debug("This request was served from the result of a concurrent request.")
+					cacheStats.record("coalescedWaits")
+					return _respond(awaitedRes, routeCacheControl, isRoutedCall)
+				logging.debug("Waiting for a concurrent request to build the cache entry timed out.")
+				cacheStats.record("waitTimeouts")
+				state = None
+		try:
+			# If we made it this far, the request wasn't cached or too old; we need to rebuild it
+			cacheStats.record("misses")
+			oldAccessLog = db.startAccessDataLog()
+			res = f(self, *args, **kwargs)
+			accessedEntries = db.popAccessData(oldAccessLog)
+			entryGenerations = cacheGenerations.snapshot(_entryGenerationNames(path, accessedEntries), generations)
+			dbEntity, response = _storeResponse(key, path, res, currReq.response.headers['Content-Type'],
+												list(accessedEntries), entryGenerations, dbRes)
+			localCache.set(key, dbEntity["creationtime"], response, entryGenerations)
+		finally:
+			if state == "render":
+				renderLeases.release(key, state)
 		logging.debug("This request was a cache-miss. Cache has been updated.")
+		if isRoutedCall:
+			etag, lastModified = response[4], response[5]
+			if _isNotModified(etag, lastModified):
+				return _notModified(etag, lastModified, routeCacheControl)
+			_setHttpHeaders(etag, lastModified, routeCacheControl)
 		return res
 
+	wrapF.cacheUserSensitive = userSensitive
 	return wrapF
 
 
 def enableCache(urls: List[str], userSensitive: int = 0, languageSensitive: bool = False,
-				evaluatedArgs: Union[List[str], None] = None, maxCacheTime: Union[int, None] = None):
+				evaluatedArgs: Union[List[str], None] = None, maxCacheTime: Union[int, None] = None,
+				singleFlight: bool = False, staleWhileRevalidate: Union[int, None] = None,
+				cacheControl: Union[str, Dict[str, str], None] = None):
 	"""
 		Decorator to mark a function cacheable.
 		Only functions decorated with enableCache are considered cacheable;
@@ -184,23 +1008,45 @@ def enableCache(urls: List[str], userSensitive: int = 0, languageSensitive: bool
 		:param maxCacheTime: Specifies the maximum time an entry stays in the cache in seconds.
 			Note: Its not erased from the db after that time, but it won't be served anymore.
 			If None, the cache stays valid forever (until manually erased by calling flushCache.
+		:param singleFlight: If true, concurrent requests for an entry that's missing or outdated are coalesced:
+			Only one of them (across all instances) renders it, the others wait up to
+			conf["viur.cache.singleFlightTimeout"] seconds for its result before rendering it themselves.
+		:param staleWhileRevalidate: If set, an outdated entry is still served for up to that many seconds
+			after it expired (or, if flushed, until it has been rebuilt) while one request rebuilds it.
+		:param cacheControl: The Cache-Control header sent along with the responses served by the cache
+			(ie. "public, max-age=60, s-maxage=600" to let CDNs cache them for 10 minutes). Either one header for
+			all urls or a dictionary mapping (some of) the urls to their header.
 	"""
 	if evaluatedArgs is None:
 		evaluatedArgs = []
 	assert not any([x.startswith("_") for x in evaluatedArgs]), "A evaluated Parameter cannot start with an underscore!"
-	return lambda f: wrapCallable(f, urls, userSensitive, languageSensitive, evaluatedArgs, maxCacheTime)
+	assert userSensitive < 2 or not any(["public" in x for x in (
+		cacheControl.values() if isinstance(cacheControl, dict) else [cacheControl or ""])]), \
+		"Responses depending on the user cannot be cached publicly!"
+	return lambda f: wrapCallable(f, urls, userSensitive, languageSensitive, evaluatedArgs, maxCacheTime,
+								  singleFlight, staleWhileRevalidate, cacheControl)
 
 
-@tasks.callDeferred
-def flushCache(prefix: str = None, key: Union[db.KeyClass, None] = None, kind: Union[str, None] = None):
+def flushCache(prefix: str = None, key: Union[db.KeyClass, None] = None, kind: Union[str, None] = None,
+			   lazy: Optional[bool] = None):
 	"""
 		Flushes the cache. Its possible the flush only a part of the cache by specifying
 		the path-prefix.
 
+		The generation counters covering these entries are increased on this instance immediately and
+		in the datastore by a deferred task (after which the in-process caches of all instances drop
+		them within conf["viur.cache.generationCheckInterval"] seconds and the entries in the datastore
+		won't be served anymore). Unless flushing lazily, the entries are also deleted from the datastore
+		in a deferred task.
+
 		:param prefix: Path or prefix that should be flushed.
 		:param key: Flush all cache entries which may contain this key. Also flushes entries
-			which executed a query over that kind.
+			which executed a query over that kind. As the generation counters are kept per kind,
+			this invalidates every entry that accessed any entity of that kind; only the deletion
+			from the datastore is limited to the entries which accessed that key.
 		:param kind: Flush all cache entries which executed a query over that kind.
+		:param lazy: Just increase the generation counters, leaving the outdated entries in the datastore
+			until they're overwritten. Defaults to conf["viur.cache.lazyFlush"].
 
 		Examples:
 			- "/" would flush the main page (and only that),
@@ -209,34 +1055,293 @@ def flushCache(prefix: str = None, key: Union[db.KeyClass, None] = None, kind: U
 	"""
 	if prefix is None and key is None and kind is None:
 		prefix = "/*"
+	if lazy is None:
+		lazy = conf["viur.cache.lazyFlush"]
+	cacheGenerations.bump(_flushGenerationNames(prefix, key, kind))
+	if not lazy:
+		_flushCacheDeferred(prefix, key, kind)
+	_scheduleWarming()
+
+
+@tasks.callDeferred
+def _flushCacheDeferred(prefix: Union[str, None], key: Union[db.KeyClass, None], kind: Union[str, None]):
+	_flushCache(prefix, key, kind)
+
+
+@tasks.callDeferred
+def _deleteCacheEntries(keys: List[db.KeyClass]):
+	db.Delete(keys)
+
+
+def _matchingKeyBatches(query: db.Query) -> Iterator[List[db.KeyClass]]:
+	"""
+		Yields the keys of all entries matched by *query* in batches of up to conf["viur.cache.flushBatchSize"].
+		Works for multi-queries, too.
+	"""
+	while True:
+		keys = query.run(limit=conf["viur.cache.flushBatchSize"], keysOnly=True)
+		if not keys:
+			return
+		yield keys
+		cursor = query.getCursor()
+		if not cursor:
+			return
+		query.setCursor(cursor)
+
+
+def _flushCache(prefix: Union[str, None], key: Union[db.KeyClass, None], kind: Union[str, None]):
+	"""
+		Deletes the matching entries from the datastore. The first batch is deleted directly, the following
+		ones are deleted by parallel deferred tasks.
+	"""
+	queries = []
 	if prefix is not None:
-		items = db.Query(viurCacheName).filter("path =", prefix.rstrip("*")).iter(keysOnly=True)
-		for item in items:
-			db.Delete(item)
-		if prefix.endswith("*"):
-			items = db.Query(viurCacheName) \
-				.filter("path >", prefix.rstrip("*")) \
-				.filter("path <", prefix.rstrip("*") + u"\ufffd") \
-				.iter(keysOnly=True)
-			for item in items:
-				db.Delete(item)
-		logging.debug("Flushing cache succeeded. Everything matching \"%s\" is gone." % prefix)
+		for kindName in (viurCacheName, viurCacheChunkName):
+			if prefix.endswith("*"):
+				queries.append(db.Query(kindName)
+							   .filter("path >=", prefix.rstrip("*"))
+							   .filter("path <", prefix.rstrip("*") + u"\ufffd"))
+			else:
+				queries.append(db.Query(kindName).filter("path =", prefix))
+	accessedEntries = []
 	if key is not None:
-		items = db.Query(viurCacheName).filter("accessedEntries =", key).iter()
-		for item in items:
-			logging.info("Deleted cache entry %s", item["path"])
-			db.Delete(item.key)
 		if not isinstance(key, db.KeyClass):
-			key = db.Key(encoded=key)
-		items = db.Query(viurCacheName).filter("accessedEntries =", key.kind).iter()
-		for item in items:
-			logging.info("Deleted cache entry %s", item["path"])
-			db.Delete(item.key)
-	if kind is not None:
-		items = db.Query(viurCacheName).filter("accessedEntries =", kind).iter()
-		for item in items:
-			logging.info("Deleted cache entry %s", item["path"])
-			db.Delete(item.key())
+			key = db.KeyClass.from_legacy_urlsafe(key)
+		# Also flush entries that executed a query over that kind
+		accessedEntries.extend([key, key.kind])
+	if kind is not None and kind not in accessedEntries:
+		accessedEntries.append(kind)
+	for kindName in (viurCacheName, viurCacheChunkName):
+		if len(accessedEntries) == 1:
+			queries.append(db.Query(kindName).filter("accessedEntries =", accessedEntries[0]))
+		elif accessedEntries:
+			queries.append(db.Query(kindName).filter("accessedEntries IN", accessedEntries))
+	# Collect the keys first, as deleting entries would shift the offsets stored in the cursors of multi-queries
+	keys = []
+	for query in queries:
+		for batch in _matchingKeyBatches(query):
+			keys.extend(batch)
+	keys = list(dict.fromkeys(keys))
+	batchSize = conf["viur.cache.flushBatchSize"]
+	for idx in range(0, len(keys), batchSize):
+		if idx == 0:
+			db.Delete(keys[idx: idx + batchSize])
+		else:
+			_deleteCacheEntries(keys[idx: idx + batchSize])
+	logging.debug("Flushing cache succeeded. %s entries matching prefix %s, key %s or kind %s are gone." % (
+		len(keys), prefix, key, kind))
+
+
+class FragmentCache(object):
+	"""
+		Backend storing the fragments of :func:`cachedFragment`: the in-process tier in front of the viur-cache
+		kind, like responses of enableCache, so fragments are flushed by flushCache alike. Projects can plug in
+		another backend by setting conf["viur.cache.fragmentBackend"] to an object providing get and set.
+	"""
+
+	def get(self, key: str, maxAge: Optional[int]) -> Optional[Tuple[Union[str, bytes], List[Any]]]:
+		"""
+			Returns the fragment stored under *key* and the entries accessed while rendering it, if it's not
+			older than *maxAge* seconds nor flushed.
+		"""
+		localRes = localCache.lookup(key, maxAge)
+		if localRes is not None and localRes[1] is not None:
+			contentType, payload, encoding, binary, etag, lastModified = localRes[0]
+			return _unpackPayload(payload, encoding, binary), localRes[1]
+		dbRes = db.Get(db.Key(viurCacheName, key))
+		if dbRes is None or not _isFresh(dbRes, maxAge):
+			return None
+		response = _loadResponse(dbRes)
+		if response is None:
+			return None
+		accessedEntries = list(dbRes.get("accessedEntries") or [])
+		entryGenerations = _entityGenerations(dbRes)
+		if entryGenerations is not None:
+			localCache.set(key, dbRes["creationtime"], response, entryGenerations, accessedEntries)
+		contentType, payload, encoding, binary, etag, lastModified = response
+		return _unpackPayload(payload, encoding, binary), accessedEntries
+
+	def set(self, key: str, path: str, value: Union[str, bytes], accessedEntries: List[Any],
+			generations: Dict[str, int]) -> None:
+		"""
+			Stores the fragment *value* rendered by the function at *path*, which accessed *accessedEntries*.
+			*generations* are the generation counters it depends on, snapshotted before it has been rendered.
+		"""
+		previous = db.Get(db.Key(viurCacheName, key))
+		dbEntity, response = _storeResponse(key, path, value, "text/html", accessedEntries, generations, previous)
+		localCache.set(key, dbEntity["creationtime"], response, generations, accessedEntries)
+
+
+fragmentCache = FragmentCache()
+
+
+def cachedFragment(key: str, path: str, maxAge: Optional[int], render: Callable[[], Any]) -> Any:
+	"""
+		Returns the fragment cached under *key* or calls *render* to build (and cache) it. Only str and bytes
+		results are cached.
+
+		The entries accessed by *render* are recorded along with the fragment: flushCache invalidates it like
+		entries of enableCache, and if it's served from the cache, they're added to the access log of the current
+		request, so the outer response (if it's cached itself) depends on them, too.
+
+		:param key: The cache key; it must cover everything the fragment depends on
+		:param path: The path of the function rendering it (ie. "/page/list"), matched by the prefix of flushCache
+		:param maxAge: How many seconds the fragment is valid; None caches it until it's flushed
+	"""
+	backend = conf["viur.cache.fragmentBackend"] or fragmentCache
+	cached = backend.get(key, maxAge)
+	if cached is not None:
+		value, accessedEntries = cached
+		accessLog = db.currentDbAccessLog.get()
+		if accessLog is not None:
+			accessLog.update(accessedEntries)
+		cacheStats.record("fragmentHits")
+		return value
+	# Snapshot the generations first, so a flush happening while we render invalidates our result
+	generations = dict(cacheGenerations.current())
+	oldAccessLog = db.startAccessDataLog()
+	try:
+		res = render()
+	finally:
+		accessedEntries = db.popAccessData(oldAccessLog)
+	cacheStats.record("fragmentMisses")
+	if isinstance(res, (str, bytes)):
+		backend.set(key, path, res, list(accessedEntries),
+					cacheGenerations.snapshot(_entryGenerationNames(path, accessedEntries), generations))
+	return res
+
+
+def _resolveRoute(path: str) -> Optional[Any]:
+	"""
+		Returns the exposed function serving *path* (without arguments) like the request router would, or None
+		if there's none (anymore) or a canAccess guard denies it.
+	"""
+	caller = conf["viur.mainResolver"]
+	for segment in [x for x in path.strip("/").split("/") if x]:
+		if not isinstance(caller, dict):
+			return None
+		if "canAccess" in caller and not caller["canAccess"]():
+			return None
+		caller = caller.get(segment.replace("-", "_").replace(".", "_"))
+	if isinstance(caller, dict):
+		caller = caller.get("index")
+	if not callable(caller) or not getattr(caller, "exposed", False):
+		return None
+	return caller
+
+
+def _warmEntry(entity: db.Entity, deadline: float) -> bool:
+	"""
+		Requests the cache entry described by the viur-cache-hits entity *entity*, so it's rendered unless it's
+		cached already. Runs in a context of its own, acting as an internal request of a guest. Entries of
+		functions depending on the user (userSensitive) are skipped.
+
+		:returns: If the entry has been requested
+	"""
+	if monotonic() >= deadline:
+		return False
+	caller = _resolveRoute(entity["path"])
+	if caller is None or getattr(caller, "cacheUserSensitive", 0):
+		return False
+	args, kwargs = json.loads(entity["args"]), json.loads(entity["kwargs"])
+	currReq = copy(currentRequest.get())
+	currReq.pathlist = [x for x in entity["path"].strip("/").split("/") if x] + args
+	currReq.args = args
+	currReq.kwargs = kwargs
+	currReq.internalRequest = True
+	currReq.disableCache = False
+	currReq.response = webob.Response()
+	currentRequest.set(currReq)
+	# Warming runs in deferred or periodic tasks, which carry the user (and session) that triggered them;
+	# render as a guest instead, so no entry contains what only that user may see
+	utils.currentSession.set(None)
+	if entity["language"]:
+		currentLanguage.set(entity["language"])
+	db.currentDbAccessLog.set(set())
+	db.currentDbIdentityMap.set(db.IdentityMap())
+	_isWarming.set(True)
+	caller(*args, **kwargs)
+	return True
+
+
+@tasks.PeriodicTask(60)
+def warmCache() -> None:
+	"""
+		Renders the conf["viur.cache.warming.paths"] most requested cache entries, unless they're cached already.
+		Up to conf["viur.cache.warming.concurrency"] entries are rendered at once; entries not started within
+		conf["viur.cache.warming.timeBudget"] seconds are skipped.
+	"""
+	maxPaths = conf["viur.cache.warming.paths"]
+	if not maxPaths:
+		return
+	if currentRequest.get() is None:
+		logging.warning("Cannot warm the cache outside of a request")
+		return
+	deadline = monotonic() + conf["viur.cache.warming.timeBudget"]
+	candidates = db.Query(viurCacheHitsName).order(("hits", db.SortOrder.Descending)).run(maxPaths * 2)
+	candidates = sorted(candidates, key=_decayedHits, reverse=True)[:maxPaths]
+	warmed = failed = 0
+	with ThreadPoolExecutor(max_workers=max(1, conf["viur.cache.warming.concurrency"])) as executor:
+		futures = [(x, executor.submit(copy_context().run, _warmEntry, x, deadline)) for x in candidates]
+		for entity, future in futures:
+			try:
+				warmed += future.result()
+			except Exception as e:
+				logging.warning("Warming the cache entry for %s failed: %s" % (entity["path"], e))
+				failed += 1
+	logging.debug("Warmed %s of %s cache entries (%s failed)" % (warmed, len(candidates), failed))
+
+
+@tasks.StartupTask
+def warmCacheAfterDeploy() -> None:
+	"""
+		Warms the cache after deploys; cache keys include the application version, so all entries went cold.
+		Startup tasks run whenever an instance starts, so a marker entity per application version ensures only
+		the first instance of a deploy warms the cache.
+	"""
+
+	def txnClaim(markerKey: db.KeyClass) -> bool:
+		if db.Get(markerKey) is not None:
+			return False
+		marker = db.Entity(markerKey)
+		marker["creationtime"] = utils.utcNow()
+		db.Put(marker)
+		return True
+
+	if not conf["viur.cache.warming.paths"]:
+		return
+	try:
+		appVersion = currentRequest.get().request.environ["CURRENT_VERSION_ID"].split('.')[0]
+	except:
+		logging.warning("Could not determine the current application version; not warming the cache")
+		return
+	try:
+		if not db.RunInTransaction(txnClaim, db.Key(viurCacheWarmingName, appVersion)):
+			return
+	except db.Conflict:  # Another instance of this deploy claimed it concurrently
+		return
+	warmCache()
+
+
+@tasks.callDeferred
+def _warmCacheDeferred():
+	warmCache()
+
+
+_lastWarmingScheduled: Optional[float] = None
+
+
+def _scheduleWarming() -> None:
+	"""
+		Warms the cache shortly after a flush; at most once a minute per instance, as flushes come in bursts.
+	"""
+	global _lastWarmingScheduled
+	if not conf["viur.cache.warming.paths"]:
+		return
+	if _lastWarmingScheduled is not None and monotonic() - _lastWarmingScheduled < 60:
+		return
+	_lastWarmingScheduled = monotonic()
+	_warmCacheDeferred(_countdown=30)
 
 
-__all__ = ["enableCache", "flushCache"]
+__all__ = ["enableCache", "flushCache", "cacheStats", "warmCache", "cachedFragment", "FragmentCache"]
@@ -16,6 +16,33 @@ conf = {
 	# If set, this function will be called for each cache-attempt and the result will be included in
 	# the computed cache-key
 	"viur.cacheEnvironmentKey": None,
+	# Upper limit (in bytes of the responses held) of the in-process tier of the cache (@enableCache); 0 disables it
+	"viur.cache.localMaxBytes": 32 * 1024 * 1024,
+	# Maximum age in seconds of the cache generation counters (which invalidate the in-process tier on flushCache)
+	"viur.cache.generationCheckInterval": 5,
+	# If set, flushCache only increases the generation counters instead of deleting the outdated entries
+	"viur.cache.lazyFlush": False,
+	# How many cache entries are deleted at once by flushCache; further batches are deleted by parallel tasks
+	"viur.cache.flushBatchSize": 500,
+	# Seconds after which the lease to render a cache entry (see enableCache(singleFlight=True)) is considered abandoned
+	"viur.cache.leaseTime": 30,
+	# How many seconds requests wait for a cache entry rendered concurrently before rendering it themselves
+	"viur.cache.singleFlightTimeout": 10,
+	# zlib compression level (0-9) of the responses stored by @enableCache; None stores them uncompressed
+	"viur.cache.compressionLevel": 6,
+	# Responses (after compression) larger than that many bytes are split across several entities
+	"viur.cache.chunkSize": 900 * 1000,
+	# How many of the most requested cache entries are rendered ahead of traffic (after deploys, flushes and
+	# periodically); 0 disables warming and counting the requests
+	"viur.cache.warming.paths": 0,
+	# How many entries are rendered concurrently while warming the cache
+	"viur.cache.warming.concurrency": 4,
+	# Seconds after which warming the cache stops starting renders
+	"viur.cache.warming.timeBudget": 60,
+	# Seconds between two writes of the request counts collected by an instance
+	"viur.cache.warming.flushInterval": 60,
+	# Stores the fragments cached by execRequest(cachetime=...); None uses viur.core.cache.FragmentCache
+	"viur.cache.fragmentBackend": None,
 
 	# Extended functionality of the whole System (For module-dependend functionality advertise this in
 	# the module configuration (adminInfo)
@@ -25,7 +52,65 @@ conf = {
 	"viur.contentSecurityPolicy": None,
 
 	# Cache strategy used by the database. 2: Aggressive, 1: Safe, 0: Off
-	"viur.db.caching": 2,
+	# Safe will only cache entities for the duration of the current request, Aggressive will also keep them in
+	# an instance-wide cache for up to viur.db.cacheLifeTime seconds (entities written by other instances might
+	# be served stale during that time)
+	"viur.db.caching": 1,
+	# Kinds that are never held in the instance-wide entity cache (as they must see writes from other instances)
+	"viur.db.cacheExcludedKinds": {"viur-session", "viur-transactionmarker", "viur-cache", "viur-cache-generation",
+								   "viur-cache-lease", "viur-cache-chunk", "viur-cache-hits", "viur-securitykeys"},
+	# Upper limit of entities kept in the identity map of a single request
+	"viur.db.identityMapMaxEntries": 1000,
+	# For how many seconds entities are kept in the instance-wide entity cache
+	"viur.db.cacheLifeTime": 60,
+	# Upper limit of entities kept in the instance-wide entity cache
+	"viur.db.cacheMaxEntries": 5000,
+	# If set, db.Query.run() keeps the keys matched by each query in an instance-wide cache and serves identical
+	# queries from there until an entity of that kind is written on this instance (or viur.db.queryCacheLifeTime
+	# expires, so writes from other instances may be missed during that time)
+	"viur.db.queryCaching": False,
+	# For how many seconds query results are kept in the instance-wide query cache
+	"viur.db.queryCacheLifeTime": 60,
+	# Upper limit of query results kept in the instance-wide query cache
+	"viur.db.queryCacheMaxEntries": 1000,
+	# How long results of db.Query.count(), .sum() and .avg() are cached on this instance (0 disables caching)
+	"viur.db.aggregationCacheLifeTime": 60,
+	# Upper limit for counting the entries of a list (List.listTotal), as counting costs one read per entry
+	# for queries the database can't aggregate natively
+	"viur.db.listTotalLimit": 1000,
+	# If set, the shapes of all queries are recorded to derive the indexes they need, see indexadvisor.py
+	"viur.db.indexAdvisor": False,
+	# Share of requests (0.0 - 1.0) whose datastore operations are profiled in detail, see dbprofiler.py
+	"viur.db.profiler.sampleRate": 0.0,
+	# Datastore operations taking longer than this (in seconds) are logged and kept in the slow operation log.
+	# Measured for all requests regardless of sampling; None disables this check
+	"viur.db.profiler.slowThreshold": None,
+	# How many slow operations are kept in the slow operation log
+	"viur.db.profiler.slowLogSize": 100,
+	# For how many routes (the least recently requested ones are dropped first) statistics are kept
+	"viur.db.profiler.maxRoutes": 250,
+	# Factory (usually a class) creating the driver used to talk to the database. None uses
+	# google.cloud.datastore.Client; see db.DatabaseDriver and dbmemory.MemoryDatastore
+	"viur.db.driver": None,
+	# If set, db.Query.iter() fetches the next page of results in the background while the current one is processed
+	"viur.db.iterPrefetch": True,
+	# Page size db.Query.iter() starts with. Each following page doubles in size up to viur.db.iterMaxPageSize
+	"viur.db.iterMinPageSize": 20,
+	# Upper limit for the page size used by db.Query.iter()
+	"viur.db.iterMaxPageSize": 500,
+	# How many sub-queries of a single multi-query (IN-filters, spatialBone, ..) may run concurrently. 1 disables it
+	"viur.db.multiQueryConcurrency": 4,
+	# Size of the threadpool shared by all requests of this instance to run sub-queries of multi-queries
+	"viur.db.queryThreadPoolSize": 16,
+	# How often db.RunInTransaction() retries a transaction that failed due to contention (db.Conflict)
+	"viur.db.transactionRetries": 3,
+	# Upper bound of the delay (in seconds) before the first retry of a transaction. It doubles with each retry
+	# (up to viur.db.transactionMaxBackoff); the actual delay is picked randomly below that bound
+	"viur.db.transactionBackoff": 0.05,
+	# Upper limit for the delay between two attempts of a transaction
+	"viur.db.transactionMaxBackoff": 2.0,
+	# If set, no further attempt of a transaction is started after that many seconds
+	"viur.db.transactionDeadline": None,
 
 	# If enabled, user-generated exceptions from the server.errors module won't be caught and handled
 	"viur.debug.traceExceptions": False,
@@ -33,7 +118,7 @@ conf = {
 	"viur.debug.traceExternalCallRouting": False,
 	# If enabled, ViUR will log which (internal-exposed) function are called from templates with what arguments
 	"viur.debug.traceInternalCallRouting": False,
-	# If enabled, we log all datastore queries performed
+	# If enabled, every datastore operation is profiled and logged (see viur.db.profiler.* and dbprofiler.py)
 	"viur.debug.traceQueries": False,
 
 	# Unless overridden by the Project: Use english as default language
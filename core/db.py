@@ -2,17 +2,32 @@
 from __future__ import annotations
 from viur.core.config import conf
 from viur.core import utils
+from viur.core.dbprofiler import profiler
+from viur.core.indexadvisor import indexAdvisor
 import logging
-from typing import Union, Tuple, List, Dict, Any, Callable, Set, Optional
+from typing import Union, Tuple, List, Dict, Any, AsyncIterator, Awaitable, Callable, Set, Optional
 from functools import partial
 from itertools import zip_longest
-from copy import deepcopy
+from copy import copy, deepcopy
 from google.cloud import datastore, exceptions
 from enum import Enum
+from abc import ABC, abstractmethod
 from datetime import datetime, date, time
+import asyncio
 import binascii
-from dataclasses import dataclass, field
-from contextvars import ContextVar
+import hashlib
+import heapq
+import json
+import operator
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from dataclasses import dataclass, field, replace
+from contextvars import ContextVar, copy_context
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from threading import Lock, local
+from collections import OrderedDict
+from time import monotonic, sleep
+from collections import Counter
+import random
 
 """
 	Tiny wrapper around *google.appengine.api.datastore*.
@@ -23,12 +38,36 @@ from contextvars import ContextVar
 	requests from cache.
 """
 
-__client__ = datastore.Client()
+# The driver (usually a google.cloud.datastore.Client) used to talk to the database. Created on first use by
+# getDriver(), so the project can choose another one by setting conf["viur.db.driver"] first
+__client__: Optional[DatabaseDriver] = None
+__clientLock__ = Lock()
 # The DB-Module will keep track of accessed kinds/keys in the accessLog so we can selectively flush our caches
 currentDbAccessLog: ContextVar[Optional[Set[Union[KeyClass, str]]]] = ContextVar("Database-Accesslog", default=None)
+# The identity map of the current request (if viur.db.caching is enabled), so each key is fetched at most once.
+# Not set for requests running tasks, as these tend to touch a lot of entities just once
+currentDbIdentityMap: ContextVar[Optional[IdentityMap]] = ContextVar("Database-Identitymap", default=None)
+# Keys written inside the current transaction; they're evicted again from the caches after it has been committed
+currentDbTransactionWrites: ContextVar[Optional[Set[KeyClass]]] = ContextVar("Database-Transactionwrites",
+																			  default=None)
+# Keys read inside the current transaction; used to find the kinds involved if that transaction fails
+currentDbTransactionReads: ContextVar[Optional[Set[KeyClass]]] = ContextVar("Database-Transactionreads",
+																			default=None)
+# The WriteBuffer collecting our Puts and Deletes (if any)
+currentDbWriteBuffer: ContextVar[Optional[WriteBuffer]] = ContextVar("Database-Writebuffer", default=None)
+# Threadpool used to run the sub-queries of multi-queries in parallel. It's created on first use, so that
+# the project has a chance to set conf["viur.db.queryThreadPoolSize"] first
+__queryExecutor__: Optional[ThreadPoolExecutor] = None
+__queryExecutorLock__ = Lock()
+# Marks the threads of that threadpool. Work running there must not wait on the threadpool itself, as it would
+# deadlock once all of its threads are waiting
+__queryExecutorThread__ = local()
 
 # Consts
 KEY_SPECIAL_PROPERTY = "__key__"
+MAX_KEYS_PER_GET = 1000  # The datastore won't accept more keys in a single lookup
+GET_DEFERRED_RETRIES = 3  # How often we'll retry keys the datastore deferred before giving up
+MAX_ENTITIES_PER_WRITE = 500  # The datastore won't accept more mutations in a single commit
 DATASTORE_BASE_TYPES = Union[None, str, int, float, bool, datetime, date, time, datastore.Key]
 
 
@@ -49,15 +88,138 @@ class QueryDefinition:
 	startCursor: Union[None, str] = None
 	endCursor: Union[None, str] = None
 	currentCursor: Union[None, str] = None
+	keysOnly: bool = False  # Fetch only the keys of the matching entities
+	projection: Union[None, List[str]] = None  # Fetch only these properties of the matching entities
+	# The filters as compiled by _compileFilterPredicate, together with the filters it has been compiled from
+	compiledFilters: Union[None, Tuple[List[Tuple[str, Any]], Callable[[Entity], bool]]] = \
+		field(default=None, compare=False, repr=False)
+
+
+class DatabaseDriver(ABC):
+	"""
+		Interface of the client this module uses to talk to the database.
+
+		It's the subset of :class:`google.cloud.datastore.Client` we rely on, so that client is the default driver.
+		Other drivers (like :class:`viur.core.dbmemory.MemoryDatastore`) must implement these methods with the same
+		semantics and represent entities and keys by :class:`Entity` and :class:`KeyClass`.
+		The driver used is created from conf["viur.db.driver"] or can be replaced by :func:`setDriver`.
+	"""
+
+	@abstractmethod
+	def key(self, *pathArgs, **kwargs) -> KeyClass:
+		"""
+			Creates a new (partial) key from the given kind / id_or_name pairs.
+		"""
+		...
+
+	@abstractmethod
+	def allocate_ids(self, incomplete_key: KeyClass, num_ids: int) -> List[KeyClass]:
+		"""
+			Reserves *num_ids* ids for the partial key given and returns the completed keys.
+		"""
+		...
+
+	@abstractmethod
+	def get(self, key: KeyClass, missing: Optional[List[Entity]] = None,
+			deferred: Optional[List[KeyClass]] = None) -> Optional[Entity]:
+		...
+
+	@abstractmethod
+	def get_multi(self, keys: List[KeyClass], missing: Optional[List[Entity]] = None,
+				  deferred: Optional[List[KeyClass]] = None) -> List[Entity]:
+		"""
+			Fetches the given keys. Keys not found are appended as empty entities to *missing*, keys that could
+			not be fetched in time to *deferred* (both if given).
+		"""
+		...
+
+	@abstractmethod
+	def put_multi(self, entities: List[Entity]) -> None:
+		"""
+			Writes the given entities. Partial keys are completed in place.
+		"""
+		...
+
+	@abstractmethod
+	def delete_multi(self, keys: List[KeyClass]) -> None:
+		...
+
+	@abstractmethod
+	def query(self, **kwargs):
+		"""
+			Creates a new query. The object returned must support add_filter(), keys_only() and the attributes
+			order, projection, distinct_on and ancestor. Its fetch(limit, offset, start_cursor, end_cursor)
+			must return an iterator providing pages and the next_page_token (None if there are no more results).
+		"""
+		...
+
+	@abstractmethod
+	def transaction(self, **kwargs):
+		"""
+			Returns a context manager running a new transaction that's bound to the current thread. It commits
+			when the block is left (raising :class:`Conflict` on contention) and rolls back on exceptions.
+		"""
+		...
+
+	@property
+	@abstractmethod
+	def current_transaction(self):
+		"""
+			The transaction running in the current thread or None.
+		"""
+		...
+
+
+DatabaseDriver.register(datastore.Client)
+
+
+def getDriver() -> DatabaseDriver:
+	"""
+		Returns the driver used to talk to the database, creating it on first use.
+	"""
+	global __client__
+	if __client__ is None:
+		with __clientLock__:
+			if __client__ is None:
+				__client__ = (conf["viur.db.driver"] or datastore.Client)()
+	return __client__
+
+
+def setDriver(driver: DatabaseDriver) -> None:
+	"""
+		Replaces the driver used to talk to the database (e.g. with a :class:`viur.core.dbmemory.MemoryDatastore`
+		in tests and benchmarks). As the contents of our instance-wide caches belong to the old driver, they're
+		cleared.
+	"""
+	global __client__
+	assert isinstance(driver, DatabaseDriver), "Drivers must implement db.DatabaseDriver"
+	with __clientLock__:
+		__client__ = driver
+	entityCache.clear()
+	queryCache.clear()
 
 
 # Proxied Function / Classed
 Entity = datastore.Entity
-Key = __client__.key  # Proxy-Function
 KeyClass = datastore.Key  # Expose the class also
-# Get = __client__.get
-# Delete = __client__.delete
-AllocateIds = __client__.allocate_ids
+# Get = getDriver().get
+# Delete = getDriver().delete
+
+
+def Key(*pathArgs, **kwargs) -> KeyClass:
+	"""
+		Creates a new key; proxies the key() method of the current driver.
+	"""
+	return getDriver().key(*pathArgs, **kwargs)
+
+
+def AllocateIds(incompleteKey: KeyClass, numIds: int) -> List[KeyClass]:
+	"""
+		Reserves *numIds* ids for *incompleteKey*; proxies the allocate_ids() method of the current driver.
+	"""
+	return getDriver().allocate_ids(incompleteKey, numIds)
+
+
 Conflict = exceptions.Conflict
 Error = exceptions.GoogleCloudError
 
@@ -123,25 +285,465 @@ def popAccessData(outerAccessLog: Optional[Set[Union[KeyClass, str]]] = None) ->
 	return res
 
 
-def Get(keys: Union[KeyClass, List[KeyClass]]) -> Union[List[Entity], Entity, None]:
+class IdentityMap(object):
+	"""
+		Keeps track of the entities loaded (or written) in the current request, so that each key has to be fetched
+		at most once. It's stored in :attr:`currentDbIdentityMap` and discarded at the end of the request.
+		It also records how many fetches it saved, so these savings can be monitored per route.
+		It holds at most conf["viur.db.identityMapMaxEntries"] keys (the oldest ones are dropped first) and is
+		safe to use from the threads of our query threadpool, which inherit it from the request.
+	"""
+
+	def __init__(self):
+		super(IdentityMap, self).__init__()
+		self.entities: Dict[KeyClass, Optional[Entity]] = {}  # Maps keys to their entity, None if it's missing
+		self.lookups = 0  # How many keys have been requested from db.Get
+		self.savedFetches = 0  # How many of these have been served from this map
+		self._lock = Lock()
+
+	def get(self, key: KeyClass) -> Tuple[bool, Optional[Entity]]:
+		"""
+			Looks up *key*. Returns a tuple of (True, entity) if that key is known (entity is None if it's
+			known to be missing) or (False, None) otherwise.
+		"""
+		with self._lock:
+			self.lookups += 1
+			if key in self.entities:
+				self.savedFetches += 1
+				return True, self.entities[key]
+			return False, None
+
+	def set(self, key: KeyClass, entity: Optional[Entity]) -> None:
+		"""
+			Records the current state of *key*. The entity must not be modified afterwards.
+		"""
+		with self._lock:
+			self.entities.pop(key, None)  # Re-insert it, so it's the newest one
+			self.entities[key] = entity
+			while len(self.entities) > conf["viur.db.identityMapMaxEntries"]:
+				del self.entities[next(iter(self.entities))]
+
+	def evict(self, keys: List[KeyClass]) -> None:
+		with self._lock:
+			for key in keys:
+				self.entities.pop(key, None)
+
+
+class EntityCache(object):
+	"""
+		Instance-wide LRU cache for entities used by :func:`Get` if conf["viur.db.caching"] is set to 2.
+		Entities are kept for at most conf["viur.db.cacheLifeTime"] seconds and evicted as soon as they're
+		written or deleted on this instance. It's safe to use from multiple threads.
+	"""
+
+	def __init__(self):
+		super(EntityCache, self).__init__()
+		self._entries: OrderedDict[KeyClass, Tuple[float, Entity]] = OrderedDict()
+		self._lock = Lock()
+
+	def get(self, key: KeyClass) -> Optional[Entity]:
+		"""
+			Returns the cached entity for *key* or None if it's not cached (or has expired).
+		"""
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None:
+				return None
+			if entry[0] < monotonic():
+				del self._entries[key]
+				return None
+			self._entries.move_to_end(key)
+			return entry[1]
+
+	def set(self, entity: Entity) -> None:
+		"""
+			Stores *entity* in the cache, evicting the least recently used entities if it's full.
+		"""
+		if entity.key.kind in conf["viur.db.cacheExcludedKinds"]:
+			return
+		with self._lock:
+			self._entries[entity.key] = (monotonic() + conf["viur.db.cacheLifeTime"], entity)
+			self._entries.move_to_end(entity.key)
+			while len(self._entries) > conf["viur.db.cacheMaxEntries"]:
+				self._entries.popitem(last=False)
+
+	def evict(self, keys: List[KeyClass]) -> None:
+		"""
+			Removes the given keys from the cache.
+		"""
+		with self._lock:
+			for key in keys:
+				self._entries.pop(key, None)
+
+	def clear(self) -> None:
+		with self._lock:
+			self._entries.clear()
+
+
+entityCache = EntityCache()
+
+
+class QueryCache(object):
+	"""
+		Instance-wide LRU cache for the results of :func:`Query.run` used if conf["viur.db.queryCaching"] is set
+		and for the results of aggregations (see :func:`Query.count`).
+
+		Only the keys matched (and the cursor pointing behind them) are stored, the entities are hydrated
+		through :func:`Get` and therefore usually served from the entity cache. Each kind has a generation
+		counter which is increased whenever an entity of that kind is written or deleted on this instance;
+		results recorded under an older generation are discarded.
+	"""
+
+	def __init__(self):
+		super(QueryCache, self).__init__()
+		# Maps the hash of a query to (expiry, generations of the kinds involved, result)
+		self._entries: OrderedDict[str, Tuple[float, Dict[str, int], Any]] = OrderedDict()
+		self._generations: Dict[str, int] = {}
+		self._lock = Lock()
+
+	def generations(self, kinds: Set[str]) -> Dict[str, int]:
+		"""
+			Returns the current generation of each of the given kinds. Must be called *before* the query is run,
+			so a write happening while the query is running invalidates its result.
+		"""
+		with self._lock:
+			return {kind: self._generations.get(kind, 0) for kind in kinds}
+
+	def get(self, cacheKey: str) -> Optional[Any]:
+		"""
+			Returns the result stored for *cacheKey* or None if there's no (valid) result cached.
+		"""
+		with self._lock:
+			entry = self._entries.get(cacheKey)
+			if entry is None:
+				return None
+			expiry, generations, result = entry
+			if expiry < monotonic() or any([self._generations.get(k, 0) != v for k, v in generations.items()]):
+				del self._entries[cacheKey]
+				return None
+			self._entries.move_to_end(cacheKey)
+			return result
+
+	def set(self, cacheKey: str, generations: Dict[str, int], result: Any, lifeTime: Optional[int] = None) -> None:
+		"""
+			Stores the result of a query, evicting the least recently used results if the cache is full.
+			The result expires after *lifeTime* seconds, defaulting to conf["viur.db.queryCacheLifeTime"].
+		"""
+		if lifeTime is None:
+			lifeTime = conf["viur.db.queryCacheLifeTime"]
+		with self._lock:
+			self._entries[cacheKey] = (monotonic() + lifeTime, generations, result)
+			self._entries.move_to_end(cacheKey)
+			while len(self._entries) > conf["viur.db.queryCacheMaxEntries"]:
+				self._entries.popitem(last=False)
+
+	def invalidate(self, kinds: Set[str]) -> None:
+		"""
+			Invalidates all results of queries on the given kinds.
+		"""
+		with self._lock:
+			for kind in kinds:
+				self._generations[kind] = self._generations.get(kind, 0) + 1
+
+	def clear(self) -> None:
+		with self._lock:
+			self._entries.clear()
+
+
+queryCache = QueryCache()
+
+
+def _cacheLookup(keys: List[KeyClass], useEntityCache: bool = True) -> Dict[KeyClass, Optional[Entity]]:
+	"""
+		Looks up the given keys in the identity map of the current request and the instance-wide entity cache.
+		:param useEntityCache: If False, only the identity map of the current request is consulted.
+		:return: Dictionary of the keys found. Maps to None if that entity is known to be missing.
+	"""
+	res = {}
+	identityMap = currentDbIdentityMap.get()
+	for key in keys:
+		if identityMap is not None:
+			isKnown, entity = identityMap.get(key)
+			if isKnown:
+				res[key] = entity
+				continue
+		if useEntityCache and conf["viur.db.caching"] >= 2:
+			entity = entityCache.get(key)
+			if entity is not None:
+				res[key] = entity
+				if identityMap is not None:
+					identityMap.set(key, entity)
+	return res
+
+
+def _cacheStore(keys: List[KeyClass], entities: List[Entity]) -> None:
+	"""
+		Stores the entities fetched for *keys* in our caches. Keys without a matching entity are
+		remembered as missing for the rest of the current request.
+	"""
+	identityMap = currentDbIdentityMap.get()
+	if identityMap is not None:
+		for key in keys:
+			identityMap.set(key, None)
+	for entity in entities:
+		entity = deepcopy(entity)  # The caller might modify the entity we've returned
+		if identityMap is not None:
+			identityMap.set(entity.key, entity)
+		if conf["viur.db.caching"] >= 2:
+			entityCache.set(entity)
+
+
+def _cacheEvict(keys: List[KeyClass]) -> None:
+	"""
+		Removes the given keys from our caches, as they're about to be written or deleted.
+		Partial keys just invalidate the cached query results of their kind.
+	"""
+	identityMap = currentDbIdentityMap.get()
+	if identityMap is not None:
+		identityMap.evict(keys)
+	entityCache.evict(keys)
+	queryCache.invalidate({key.kind for key in keys})
+	transactionWrites = currentDbTransactionWrites.get()
+	if transactionWrites is not None:
+		transactionWrites.update(keys)
+
+
+def _getMultiChunk(keys: List[KeyClass]) -> Dict[KeyClass, Entity]:
+	"""
+		Fetches up to MAX_KEYS_PER_GET keys from the datastore. Keys the datastore deferred (as it couldn't
+		fetch them within the current request) are requested again.
+		:return: Dictionary of key -> entity of the entities found
+	"""
+	res = {}
+	startTime = monotonic()
+	requestedKeys = keys
+	for unused in range(0, GET_DEFERRED_RETRIES):
+		deferred = []
+		for entity in getDriver().get_multi(keys, missing=[], deferred=deferred):
+			res[entity.key] = entity
+		if not deferred:
+			break
+		keys = deferred
+	else:
+		# Still not done, let the client library retry the remaining keys until it succeeds
+		for entity in getDriver().get_multi(keys):
+			res[entity.key] = entity
+	profiler.record("get", startTime, keys=requestedKeys, entities=res.values())
+	return res
+
+
+def _getSingle(key: KeyClass) -> Optional[Entity]:
+	"""
+		Fetches a single entity from the datastore.
+	"""
+	startTime = monotonic()
+	entity = getDriver().get(key)
+	profiler.record("get", startTime, keys=[key], entities=[entity] if entity is not None else [])
+	return entity
+
+
+def _getMulti(keys: List[KeyClass]) -> Dict[KeyClass, Entity]:
+	"""
+		Fetches the given (unique) keys from the datastore. Requests larger than MAX_KEYS_PER_GET are split into
+		chunks which are fetched in parallel (unless we're inside a transaction or on a thread of the query
+		threadpool).
+		:return: Dictionary of key -> entity of the entities found
+	"""
+	if len(keys) <= MAX_KEYS_PER_GET:
+		return _getMultiChunk(keys)
+	chunks = [keys[x: x + MAX_KEYS_PER_GET] for x in range(0, len(keys), MAX_KEYS_PER_GET)]
+	res = {}
+	if not _canUseQueryExecutor():
+		for chunk in chunks:
+			res.update(_getMultiChunk(chunk))
+	else:
+		executor = _getQueryExecutor()
+		for future in [executor.submit(copy_context().run, _getMultiChunk, chunk) for chunk in chunks]:
+			res.update(future.result())
+	return res
+
+
+def Get(keys: Union[KeyClass, List[KeyClass]],
+		useEntityCache: bool = True) -> Union[List[Optional[Entity]], Entity, None]:
+	"""
+		Fetches one or more entities from the datastore.
+
+		Unless disabled by conf["viur.db.caching"], entities are served from our caches if possible.
+		Inside transactions the caches are bypassed.
+
+		:param keys: A single key or a list of keys to fetch.
+		:param useEntityCache: If False, the instance-wide entity cache isn't used to serve these keys (as it might
+			be stale). Use this if the entities are about to be modified and written back.
+		:returns: The entity (or None if it does not exist) if a single key has been given. Otherwise a list
+			with one entry for each key given (in the same order), which is None if that key does not exist.
+	"""
 	dataLog = currentDbAccessLog.get(set())
+	isInTransaction = IsInTransaction()
+	if isInTransaction:
+		transactionReads = currentDbTransactionReads.get()
+		if transactionReads is not None:
+			transactionReads.update(keys if isinstance(keys, list) else [keys])
+	useCache = conf["viur.db.caching"] and not isInTransaction
+	writeBuffer = currentDbWriteBuffer.get() if not isInTransaction else None
 	if isinstance(keys, list):
 		for key in keys:
 			if not key.kind.startswith("viur"):
 				dataLog.add(key)
-		# GetMulti does not obey orderings - results can be returned in any order. We'll need to fix this here
-		resList = list(__client__.get_multi(keys))
-		resList.sort(key=lambda x: keys.index(x.key) if x else -1)
-		return resList
+		bufferedEntities = {}
+		if writeBuffer is not None:
+			for key in keys:
+				isPending, entity = writeBuffer.lookup(key)
+				if isPending:
+					bufferedEntities[key] = entity
+		cachedEntities = _cacheLookup([x for x in keys if x not in bufferedEntities], useEntityCache) \
+			if useCache else {}
+		cachedEntities.update(bufferedEntities)
+		missingKeys = list(dict.fromkeys([x for x in keys if x not in cachedEntities]))
+		fetchedEntities = _getMulti(missingKeys) if missingKeys else {}
+		if useCache and missingKeys:
+			_cacheStore(missingKeys, list(fetchedEntities.values()))
+		res = []
+		for key in keys:
+			if key in fetchedEntities:
+				res.append(fetchedEntities[key])
+			else:  # The caller might modify the entity we return, so we must not return our cached version
+				entity = cachedEntities.get(key)
+				res.append(deepcopy(entity) if entity is not None else None)
+		return res
 	if not keys.kind.startswith("viur"):
 		dataLog.add(keys)
-	return __client__.get(keys)
+	if writeBuffer is not None:
+		isPending, entity = writeBuffer.lookup(keys)
+		if isPending:
+			return deepcopy(entity)
+	if not useCache:
+		return _getSingle(keys)
+	cachedEntities = _cacheLookup([keys], useEntityCache)
+	if keys in cachedEntities:
+		return deepcopy(cachedEntities[keys])
+	entity = _getSingle(keys)
+	_cacheStore([keys], [entity] if entity is not None else [])
+	return entity
+
+
+class WriteBuffer(object):
+	"""
+		Collects the entities written by :func:`Put` and the keys deleted by :func:`Delete` and writes them in
+		batches once the scope of this buffer is left. Multiple writes to the same key are collapsed, so only the
+		last Put (or Delete) of that key will reach the datastore.
+
+		.. code-block:: python
+
+			with db.WriteBuffer():
+				for key in keysToDelete:
+					db.Delete(key)
+
+		The access log is updated immediately on each call, so viur.core.cache isn't affected.
+		Gets issued inside that scope will see the pending writes, queries won't. Writes inside
+		transactions aren't buffered, and the buffer is flushed before a transaction is started.
+		Entities must not be modified after they've been passed to Put; entities with an incomplete key
+		get their key assigned when the buffer is flushed. Nested buffers are merged into the outermost one.
+	"""
+	maxPending = 10 * MAX_ENTITIES_PER_WRITE  # Flush early if that many writes are pending to bound our memory usage
+
+	def __init__(self):
+		super(WriteBuffer, self).__init__()
+		self._pending: Dict[KeyClass, Optional[Entity]] = {}  # Key -> Entity to write or None to delete
+		self._pendingPartial: List[Entity] = []  # Entities with incomplete keys
+		self._token = None
+
+	def __enter__(self) -> WriteBuffer:
+		if currentDbWriteBuffer.get() is None:
+			self._token = currentDbWriteBuffer.set(self)
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+		if self._token is not None:
+			currentDbWriteBuffer.reset(self._token)
+			self._token = None
+			self.flush()
+		return False
+
+	def __len__(self) -> int:
+		return len(self._pending) + len(self._pendingPartial)
+
+	def put(self, entities: List[Entity]) -> None:
+		for entity in entities:
+			if entity.key.is_partial:
+				self._pendingPartial.append(entity)
+			else:
+				self._pending.pop(entity.key, None)  # Keep the order of our writes
+				self._pending[entity.key] = entity
+		if len(self) >= self.maxPending:
+			self.flush()
+
+	def delete(self, keys: List[KeyClass]) -> None:
+		for key in keys:
+			self._pending.pop(key, None)
+			self._pending[key] = None
+		if len(self) >= self.maxPending:
+			self.flush()
+
+	def lookup(self, key: KeyClass) -> Tuple[bool, Optional[Entity]]:
+		"""
+			Returns (True, entity) if there's a pending write for *key* (entity is None if it will be deleted),
+			(False, None) otherwise.
+		"""
+		if key in self._pending:
+			return True, self._pending[key]
+		return False, None
+
+	def flush(self) -> None:
+		"""
+			Writes all pending Puts and Deletes to the datastore.
+		"""
+		puts = self._pendingPartial + [x for x in self._pending.values() if x is not None]
+		deletes = [k for k, v in self._pending.items() if v is None]
+		self._pending = {}
+		self._pendingPartial = []
+		if puts:
+			_putMulti(puts)
+		if deletes:
+			_deleteMulti(deletes)
+
+
+def _putMulti(entities: List[Entity]) -> None:
+	"""
+		Writes the given entities in batches of MAX_ENTITIES_PER_WRITE and updates our caches.
+	"""
+	_cacheEvict([e.key for e in entities])
+	for idx in range(0, len(entities), MAX_ENTITIES_PER_WRITE):
+		startTime = monotonic()
+		getDriver().put_multi(entities=entities[idx: idx + MAX_ENTITIES_PER_WRITE])
+		profiler.record("put", startTime, entities=entities[idx: idx + MAX_ENTITIES_PER_WRITE])
+	identityMap = currentDbIdentityMap.get()
+	if identityMap is not None and conf["viur.db.caching"] and not IsInTransaction():
+		# Our keys are complete now; subsequent Gets for these entities in this request can be served from here
+		for e in entities:
+			identityMap.set(e.key, deepcopy(e))
+
+
+def _deleteMulti(keys: List[KeyClass]) -> None:
+	"""
+		Deletes the given keys in batches of MAX_ENTITIES_PER_WRITE and updates our caches.
+	"""
+	_cacheEvict(keys)
+	for idx in range(0, len(keys), MAX_ENTITIES_PER_WRITE):
+		startTime = monotonic()
+		getDriver().delete_multi(keys[idx: idx + MAX_ENTITIES_PER_WRITE])
+		profiler.record("delete", startTime, keys=keys[idx: idx + MAX_ENTITIES_PER_WRITE],
+						entities=keys[idx: idx + MAX_ENTITIES_PER_WRITE])
+	identityMap = currentDbIdentityMap.get()
+	if identityMap is not None and conf["viur.db.caching"] and not IsInTransaction():
+		for key in keys:
+			identityMap.set(key, None)
 
 
 def Put(entity: Union[Entity, List[Entity]]):
 	"""
 		Save an entity in the Cloud Datastore.
 		Also ensures that no string-key with an digit-only name can be used.
+		If a :class:`WriteBuffer` is active, the write is deferred until that buffer is flushed.
 		:param entity: The entity to be saved to the datastore.
 	"""
 	dataLog = currentDbAccessLog.get(set())
@@ -157,26 +759,99 @@ def Put(entity: Union[Entity, List[Entity]]):
 			if not e.key.kind.startswith("viur"):
 				dataLog.add(e.key.kind)
 	# fixUnindexableProperties(e)
-	return __client__.put_multi(entities=entity)
+	writeBuffer = currentDbWriteBuffer.get()
+	if writeBuffer is not None and not IsInTransaction():
+		# Ensure no stale versions of these entities are served until the buffer is flushed
+		_cacheEvict([e.key for e in entity])
+		writeBuffer.put(entity)
+	else:
+		_putMulti(entity)
 
 
 def Delete(keys: Union[Entity, List[Entity], KeyClass, List[KeyClass]]):
+	"""
+		Deletes one or more entities from the Cloud Datastore.
+		If a :class:`WriteBuffer` is active, the delete is deferred until that buffer is flushed.
+		:param keys: The entities or keys to delete.
+	"""
 	dataLog = currentDbAccessLog.get(set())
-	if isinstance(keys, list):
-		keys = [(x if isinstance(x, KeyClass) else x.key) for x in keys]
-		for key in keys:
-			if not key.kind.startswith("viur"):
-				dataLog.add(key)
-		return __client__.delete_multi(keys)
+	if not isinstance(keys, list):
+		keys = [keys]
+	keys = [(x if isinstance(x, KeyClass) else x.key) for x in keys]
+	for key in keys:
+		if not key.kind.startswith("viur"):
+			dataLog.add(key)
+	writeBuffer = currentDbWriteBuffer.get()
+	if writeBuffer is not None and not IsInTransaction():
+		_cacheEvict(keys)
+		writeBuffer.delete(keys)
 	else:
-		if isinstance(keys, KeyClass):
-			if not keys.kind.startswith("viur"):
-				dataLog.add(keys)
-			return __client__.delete(keys)
-		else:
-			if not keys.key.kind.startswith("viur"):
-				dataLog.add(keys.key)
-			return __client__.delete(keys.key)
+		_deleteMulti(keys)
+
+
+async def _runInExecutor(func: Callable, *args, **kwargs) -> Any:
+	"""
+		Runs the blocking *func* on the shared threadpool inside a copy of the current context, so it can see the
+		ContextVars of the current request. Inside transactions it's called directly, as the transaction is bound
+		to the current thread, and so it is on the threads of that pool (see _canUseQueryExecutor).
+	"""
+	if not _canUseQueryExecutor():
+		return func(*args, **kwargs)
+	loop = asyncio.get_running_loop()
+	return await loop.run_in_executor(_getQueryExecutor(), partial(copy_context().run, func, *args, **kwargs))
+
+
+async def GetAsync(keys: Union[KeyClass, List[KeyClass]]) -> Union[List[Optional[Entity]], Entity, None]:
+	"""
+		Like :func:`Get`, but can be awaited together with other database operations.
+	"""
+	return await _runInExecutor(Get, keys)
+
+
+async def PutAsync(entity: Union[Entity, List[Entity]]) -> None:
+	"""
+		Like :func:`Put`, but can be awaited together with other database operations.
+		If a :class:`WriteBuffer` is active, the entities are just added to it (which doesn't block).
+	"""
+	if currentDbWriteBuffer.get() is not None:
+		return Put(entity)
+	return await _runInExecutor(Put, entity)
+
+
+async def DeleteAsync(keys: Union[Entity, List[Entity], KeyClass, List[KeyClass]]) -> None:
+	"""
+		Like :func:`Delete`, but can be awaited together with other database operations.
+		If a :class:`WriteBuffer` is active, the keys are just added to it (which doesn't block).
+	"""
+	if currentDbWriteBuffer.get() is not None:
+		return Delete(keys)
+	return await _runInExecutor(Delete, keys)
+
+
+def runConcurrently(*awaitables: Awaitable) -> List[Any]:
+	"""
+		Runs the given awaitables (like those returned by :func:`GetAsync` or :func:`Query.runAsync`) concurrently
+		and returns their results in the same order. This allows synchronous code (like the functions exposed to
+		jinja) to fetch data from several independent sources in parallel::
+
+			entries, skelList, entity = db.runConcurrently(qry1.runAsync(10), qry2.fetchAsync(5), db.GetAsync(key))
+
+		It must not be called from inside a running event loop - use asyncio.gather() there.
+	"""
+	try:
+		asyncio.get_running_loop()
+	except RuntimeError:  # No loop running in this thread, so we can start our own
+		pass
+	else:
+		for awaitable in awaitables:
+			if asyncio.iscoroutine(awaitable):
+				awaitable.close()  # Avoid warnings about coroutines never awaited
+		raise RuntimeError("runConcurrently() cannot be called from a running event loop, await asyncio.gather()")
+
+	async def gatherAll():
+		return await asyncio.gather(*awaitables)
+
+	return asyncio.run(gatherAll())
 
 
 def fixUnindexableProperties(entry: Entity):
@@ -203,28 +878,289 @@ def fixUnindexableProperties(entry: Entity):
 	return entry
 
 
-def _entryMatchesQuery(entry: Entity, singleFilter: dict) -> bool:
-	def doesMatch(entryValue, requestedValue, opcode):
-		if isinstance(entryValue, list):
-			return any([doesMatch(x, requestedValue, opcode) for x in entryValue])
-		if opcode == "=" and entryValue == requestedValue:
-			return True
-		elif opcode == "<" and entryValue < requestedValue:
-			return True
-		elif opcode == ">" and entryValue > requestedValue:
-			return True
-		elif opcode == "<=" and entryValue <= requestedValue:
-			return True
-		elif opcode == ">=" and entryValue >= requestedValue:
-			return True
-		return False
+# Maps the operators usable in filters to functions testing (entryValue, filterValue)
+_filterOperators: Dict[str, Callable[[Any, Any], bool]] = {
+	"=": operator.eq,
+	"!=": operator.ne,
+	"<": operator.lt,
+	"<=": operator.le,
+	">": operator.gt,
+	">=": operator.ge,
+	"IN": lambda entryValue, filterValue: entryValue in filterValue,
+}
 
-	for filterStr, filterValue in singleFilter.items():
+
+def _compileFilterPredicate(filters: Dict[str, DATASTORE_BASE_TYPES]) -> Callable[[Entity], bool]:
+	"""
+		Compiles the filters of a query definition into a function testing if an entity matches all of them.
+
+		Filters on dotted paths (like "dest.name") descend into embedded entities. List properties match if any of
+		their values matches, values that can't be compared with the filter value (like None < 3) don't match.
+	"""
+	tests = []
+	for filterStr, filterValue in filters.items():
 		field, opcode = filterStr.split(" ")
-		entryValue = entry.get(field)
-		if not doesMatch(entryValue, filterValue, opcode):
+		compare = _filterOperators.get(opcode.upper())
+		if compare is None:
+			raise ValueError("Unsupported filter operator %s" % opcode)
+		if opcode.upper() == "IN":
+			filterValue = list(filterValue)
+		if "." in field:
+			getValue = partial(_getPropertyValue, path=field)
+		else:
+			getValue = partial(lambda entry, field: entry.get(field), field=field)
+		tests.append((getValue, compare, filterValue))
+
+	def matches(compare: Callable[[Any, Any], bool], entryValue: Any, filterValue: Any) -> bool:
+		try:
+			return compare(entryValue, filterValue)
+		except TypeError:  # Incomparable types
 			return False
-	return True
+
+	def predicate(entry: Entity) -> bool:
+		for getValue, compare, filterValue in tests:
+			entryValue = getValue(entry)
+			if isinstance(entryValue, list):
+				if not any([matches(compare, x, filterValue) for x in entryValue]):
+					return False
+			elif not matches(compare, entryValue, filterValue):
+				return False
+		return True
+
+	return predicate
+
+
+def _entryMatchesQuery(entry: Entity, singleFilter: dict) -> bool:
+	"""
+		Tests if *entry* matches all filters in *singleFilter*. Compile the filters with
+		:func:`_compileFilterPredicate` instead when testing more than one entity.
+	"""
+	return _compileFilterPredicate(singleFilter)(entry)
+
+
+class _InvertedSortValue(object):
+	"""
+		Wraps a value so that it sorts in reverse order. Used to express descending sort orders in the sort-keys
+		used when merging the results of multi-queries (as heapq only provides a min-heap).
+	"""
+	__slots__ = ["value"]
+
+	def __init__(self, value: Any):
+		self.value = value
+
+	def __lt__(self, other: _InvertedSortValue) -> bool:
+		return other.value < self.value
+
+	def __eq__(self, other: _InvertedSortValue) -> bool:
+		return self.value == other.value
+
+
+def _keySortTuple(key: KeyClass) -> Tuple:
+	"""
+		Returns a tuple that sorts the same way the datastore sorts keys (ancestors first, ids before names)
+	"""
+	res = ()
+	while key is not None:
+		idOrName = key.id_or_name
+		res = ((key.kind, (0, idOrName) if isinstance(idOrName, int) else (1, idOrName or "")),) + res
+		key = key.parent
+	return res
+
+
+def _getPropertyValue(entity: Entity, path: str) -> Any:
+	"""
+		Returns the value of the property *path* from *entity*. Dotted paths (like "dest.name") descend into
+		embedded entities; lists of embedded entities yield the list of their values.
+	"""
+	if path in entity:
+		return entity[path]
+	value = entity
+	for part in path.split("."):
+		if isinstance(value, dict):
+			value = value.get(part)
+		elif isinstance(value, list):
+			value = [x.get(part) for x in value if isinstance(x, dict)]
+		else:
+			return None
+	return value
+
+
+def _sortValue(value: Any, direction: SortOrder) -> Tuple[int, Any]:
+	"""
+		Converts *value* into something that's comparable with any other value, even if they're of different
+		types. Values are grouped by their type first (similar to the datastore), then sorted within that type.
+	"""
+	if isinstance(value, list):
+		# Lists are sorted by their smallest (or largest if sorting descending) value
+		if not value:
+			value = None
+		else:
+			try:
+				value = min(value) if direction == SortOrder.Ascending else max(value)
+			except TypeError:
+				# It's a list of dicts or the like for which no useful sort-order is specified
+				value = value[0] if direction == SortOrder.Ascending else value[-1]
+	if value is None:
+		return 0, 0
+	elif isinstance(value, bool):  # Must be checked before int, as bool is a subclass of int
+		return 3, value
+	elif isinstance(value, int):
+		return 1, value
+	elif isinstance(value, datetime):
+		return 2, value
+	elif isinstance(value, bytes):
+		return 4, value
+	elif isinstance(value, str):
+		return 5, value
+	elif isinstance(value, float):
+		return 6, value
+	elif isinstance(value, KeyClass):
+		return 7, _keySortTuple(value)
+	return 8, str(value)
+
+
+def _entitySortKey(entity: Entity, orders: List[Tuple[str, SortOrder]]) -> Tuple:
+	"""
+		Computes the key used to sort *entity* according to *orders*.
+		This does not modify the entity (list properties are left untouched).
+	"""
+	res = []
+	for orderField, direction in orders:
+		if orderField == KEY_SPECIAL_PROPERTY:
+			val = (7, _keySortTuple(entity.key))
+		else:
+			val = _sortValue(_getPropertyValue(entity, orderField), direction)
+		res.append(val if direction == SortOrder.Ascending else _InvertedSortValue(val))
+	return tuple(res)
+
+
+def _canonicalQueryValue(value: Any) -> Any:
+	"""
+		Converts a filter value into a JSON-serializable representation that's equal for equal values (and
+		distinct for values of different types), so it can be used to build the key of a cached query.
+	"""
+	if isinstance(value, KeyClass):
+		return ["key", value.namespace, list(value.flat_path)]
+	elif isinstance(value, (datetime, date, time)):
+		return [type(value).__name__, value.isoformat()]
+	elif isinstance(value, (list, tuple)):
+		return [type(value).__name__, [_canonicalQueryValue(x) for x in value]]
+	elif isinstance(value, bytes):
+		return ["bytes", value.hex()]
+	elif isinstance(value, dict):
+		return ["dict", sorted([[k, _canonicalQueryValue(v)] for k, v in value.items()], key=lambda x: x[0])]
+	return [type(value).__name__, value]
+
+
+def _encodeMultiQueryCursor(positions: List[Union[None, Tuple[Union[None, str], int]]]) -> str:
+	"""
+		Encodes the position of each sub-query of a multi-query into a single cursor.
+		Each position is either None (that sub-query is exhausted) or a tuple of a datastore cursor and an offset
+		that must be skipped behind that cursor.
+	"""
+	return urlsafe_b64encode(json.dumps(positions).encode("UTF-8")).decode("ASCII")
+
+
+def _decodeMultiQueryCursor(cursor: str) -> List[Union[None, Tuple[Union[None, str], int]]]:
+	"""
+		Inverse of :func:`_encodeMultiQueryCursor`. Raises ValueError if the cursor is malformed.
+	"""
+	try:
+		positions = json.loads(urlsafe_b64decode(cursor.encode("ASCII")).decode("UTF-8"))
+	except (binascii.Error, UnicodeError, json.JSONDecodeError):
+		raise ValueError("Invalid cursor")
+	if not isinstance(positions, list):
+		raise ValueError("Invalid cursor")
+	res = []
+	for position in positions:
+		if position is None:
+			res.append(None)
+		elif isinstance(position, list) and len(position) == 2 and isinstance(position[1], int) \
+				and position[1] >= 0 and (position[0] is None or isinstance(position[0], str)):
+			res.append((position[0], position[1]))
+		else:
+			raise ValueError("Invalid cursor")
+	return res
+
+
+class _MultiQueryMergeSource(object):
+	"""
+		Keeps track of our position inside the results of one sub-query while merging a multi-query.
+		If the results fetched so far are consumed, the next page of that sub-query is fetched on demand.
+	"""
+	__slots__ = ["query", "queryDefinition", "entries", "pos", "pageCursor", "pageOffset", "limit"]
+
+	def __init__(self, query: Query, queryDefinition: QueryDefinition, entries: List[Entity], offset: int,
+				 limit: int):
+		self.query = query
+		self.queryDefinition = queryDefinition
+		self.entries = entries
+		self.pos = 0  # How many entries from entries have been consumed
+		self.pageCursor = queryDefinition.startCursor  # Cursor and offset entries[0] has been fetched from
+		self.pageOffset = offset
+		self.limit = limit
+
+	def peek(self) -> Union[None, Entity]:
+		"""
+			Returns the next unconsumed entry of that sub-query or None if it's exhausted.
+		"""
+		if self.pos >= len(self.entries):
+			if not self.queryDefinition.currentCursor:
+				return None
+			# Continue that sub-query behind the page we have already consumed
+			self.queryDefinition = replace(self.queryDefinition, startCursor=self.queryDefinition.currentCursor)
+			self.pageCursor = self.queryDefinition.startCursor
+			self.pageOffset = 0
+			self.entries = self.query._runSingleFilterQuery(self.queryDefinition, self.limit)
+			self.pos = 0
+			if not self.entries:
+				return None
+		return self.entries[self.pos]
+
+	def position(self) -> Union[None, Tuple[Union[None, str], int]]:
+		"""
+			Returns the position directly behind the last consumed entry as (cursor, offset) or None if this
+			sub-query is exhausted.
+		"""
+		if self.pos >= len(self.entries):
+			if not self.queryDefinition.currentCursor:
+				return None
+			return self._cursorToStr(self.queryDefinition.currentCursor), 0
+		return self._cursorToStr(self.pageCursor), self.pageOffset + self.pos
+
+	@staticmethod
+	def _cursorToStr(cursor: Union[None, str, bytes]) -> Union[None, str]:
+		return cursor.decode("ASCII") if isinstance(cursor, bytes) else cursor
+
+
+def _markQueryExecutorThread() -> None:
+	__queryExecutorThread__.isQueryExecutor = True
+
+
+def _canUseQueryExecutor() -> bool:
+	"""
+		Returns False if the current thread must not hand work to the threadpool and wait for it: Inside
+		transactions (which are bound to the current thread) and on the threads of that pool itself.
+	"""
+	return not IsInTransaction() and not getattr(__queryExecutorThread__, "isQueryExecutor", False)
+
+
+def _getQueryExecutor() -> ThreadPoolExecutor:
+	"""
+		Returns the threadpool shared by all requests of this instance, creating it if necessary.
+	"""
+	global __queryExecutor__
+	# Guards against code paths waiting on the pool from one of its own threads, which would deadlock once it's
+	# saturated. Check _canUseQueryExecutor() first and run the work inline instead.
+	assert not getattr(__queryExecutorThread__, "isQueryExecutor", False), \
+		"The query threadpool must not be used from one of its own threads"
+	if __queryExecutor__ is None:
+		with __queryExecutorLock__:
+			if __queryExecutor__ is None:
+				__queryExecutor__ = ThreadPoolExecutor(max_workers=conf["viur.db.queryThreadPoolSize"],
+													   thread_name_prefix="viur-db-query",
+													   initializer=_markQueryExecutorThread)
+	return __queryExecutor__
 
 
 def GetOrInsert(key: Key, **kwargs):
@@ -287,6 +1223,10 @@ class Query(object):
 		self._lastEntry = None
 		self._fulltextQueryString: Union[None, str] = None
 		self.lastCursor = None
+		# Offsets to skip behind the startCursor of each sub-query of a multi-query (None if it's exhausted)
+		self._multiQueryOffsets: Union[None, List[Union[None, int]]] = None
+		# The combined cursor of all sub-queries after the last run of a multi-query
+		self._multiQueryCursor: Union[None, str] = None
 		if not kind.startswith("viur") and not kwargs.get("_excludeFromAccessLog"):
 			currentDbAccessLog.get(set()).add(kind)
 
@@ -528,7 +1468,31 @@ class Query(object):
 			:returns: Returns the query itself for chaining.
 			:rtype: server.db.Query
 		"""
-		assert isinstance(self.queries, QueryDefinition)
+		if self.queries is None:  # This query is unsatisfiable, there's no point in continuing it
+			return self
+		if isinstance(self.queries, list):
+			# We got a combined cursor for all sub-queries, as returned by getCursor() after a multi-query
+			self._multiQueryOffsets = None
+			for query in self.queries:
+				query.startCursor = None
+			if not startCursor:
+				return self
+			try:
+				positions = _decodeMultiQueryCursor(startCursor)
+				if len(positions) != len(self.queries):
+					raise ValueError("Cursor does not match this query")
+			except ValueError as e:
+				logging.warning("Got an invalid cursor for a multi-query on %s: %s" % (self.kind, e))
+				self.queries = None
+				return self
+			self._multiQueryOffsets = []
+			for query, position in zip(self.queries, positions):
+				if position is None:
+					self._multiQueryOffsets.append(None)
+				else:
+					query.startCursor, offset = position
+					self._multiQueryOffsets.append(offset)
+			return self
 		self.queries.startCursor = startCursor
 		self.queries.endCursor = endCursor
 		#if isinstance(startCursor, str) and startCursor.startswith("h-"):
@@ -591,14 +1555,63 @@ class Query(object):
 		self._distinct = keyList
 		return self
 
+	def setKeysOnly(self, keysOnly: bool = True) -> Query:
+		"""
+			Configures this query to return only the keys of the matching entities.
+
+			:func:`server.db.Query.run` and :func:`server.db.Query.iter` will then yield db.Keys instead of
+			db.Entities. This saves transferring (and deserializing) entities whose content isn't needed anyway.
+
+			:param keysOnly: If this query should fetch keys only
+			:returns: Returns the query itself for chaining.
+		"""
+		if isinstance(self.queries, QueryDefinition):
+			self.queries.keysOnly = keysOnly
+		elif isinstance(self.queries, list):
+			for query in self.queries:
+				query.keysOnly = keysOnly
+		return self
+
+	def setProjection(self, properties: Union[None, List[str]]) -> Query:
+		"""
+			Configures this query to fetch only the given properties of the matching entities.
+
+			Entities returned by :func:`server.db.Query.run` will only contain these properties, skeletons
+			returned by :func:`server.db.Query.fetch` will load their other bones on first access.
+			Note that all properties listed here must be indexed and cannot be used in an equality filter.
+
+			:param properties: The names of the properties to fetch, None to fetch whole entities again
+			:returns: Returns the query itself for chaining.
+		"""
+		properties = list(properties) if properties else None
+		if isinstance(self.queries, QueryDefinition):
+			self.queries.projection = properties
+		elif isinstance(self.queries, list):
+			for query in self.queries:
+				query.projection = properties
+		return self
+
 	def isKeysOnly(self):
 		"""
 			Returns True if this query is configured as *keys only*, False otherwise.
 
 			:rtype: bool
 		"""
-		raise NotImplementedError()
-		return self.datastoreQuery.IsKeysOnly()
+		if isinstance(self.queries, QueryDefinition):
+			return self.queries.keysOnly
+		elif isinstance(self.queries, list):
+			return self.queries[0].keysOnly
+		return False
+
+	def getProjection(self) -> Union[None, List[str]]:
+		"""
+			Returns the list of properties this query is limited to or None if it fetches whole entities.
+		"""
+		if isinstance(self.queries, QueryDefinition):
+			return self.queries.projection
+		elif isinstance(self.queries, list):
+			return self.queries[0].projection
+		return None
 
 	def getQueryOptions(self):
 		"""
@@ -680,7 +1693,9 @@ class Query(object):
 		if isinstance(self.queries, QueryDefinition):
 			q = self.queries
 		elif isinstance(self.queries, list):
-			q = self.queries[0]
+			return self._multiQueryCursor
+		else:
+			return None
 		return q.currentCursor.decode("ASCII") if q.currentCursor else None
 		return self.lastCursor.decode("ASCII") if self.lastCursor else None
 
@@ -703,8 +1718,15 @@ class Query(object):
 			return
 		self.datastoreQuery.__kind = newKind
 
-	def _runSingleFilterQuery(self, query, limit):
-		qry = __client__.query(kind=query.kind)
+	def _buildDatastoreQuery(self, query: QueryDefinition, keysOnly: bool, projection: Union[None, List[str]]):
+		"""
+			Creates the query object of the database driver for the given query definition.
+		"""
+		qry = getDriver().query(kind=query.kind)
+		if keysOnly:
+			qry.keys_only()
+		elif projection:
+			qry.projection = projection
 		for k, v in query.filters.items():
 			key, op = k.split(" ")
 			qry.add_filter(key, op, v)
@@ -739,57 +1761,230 @@ class Query(object):
 			qry.order = [x[0] if x[1] == SortOrder.Ascending else "-" + x[0] for x in newSortOrder]
 		else:
 			qry.order = [x[0] if x[1] == SortOrder.Ascending else "-" + x[0] for x in query.orders]
-		qryRes = qry.fetch(limit=limit, start_cursor=query.startCursor, end_cursor=query.endCursor)
-		res = next(qryRes.pages)
+		indexAdvisor.recordQuery(query.kind, query.filters.keys(), qry.order, projection if not keysOnly else None)
+		return qry
+
+	def _runSingleFilterQuery(self, query: QueryDefinition, limit: int, offset: int = 0,
+							  keysOnly: Union[None, bool] = None,
+							  projection: Union[None, List[str]] = None) -> List[Union[Entity, KeyClass]]:
+		"""
+			Runs the given query definition once.
+
+			:param query: The QueryDefinition to run. Its currentCursor will be set to the cursor of the next page.
+			:param limit: The amount of entities to fetch
+			:param offset: How many entities should be skipped
+			:param keysOnly: Return only the keys of the matching entities. Defaults to the setting of that query.
+			:param projection: Fetch only these properties. Defaults to the setting of that query, an empty list
+				fetches whole entities.
+		:return: The entities (or keys) matched
+		"""
+		if keysOnly is None:
+			keysOnly = query.keysOnly
+		if projection is None:
+			projection = query.projection
+		startTime = monotonic()
+		qry = self._buildDatastoreQuery(query, keysOnly, projection)
+		qryRes = qry.fetch(limit=limit, offset=offset or None, start_cursor=query.startCursor,
+						   end_cursor=query.endCursor)
+		res = list(next(qryRes.pages))
 		query.currentCursor = qryRes.next_page_token
+		profiler.record("query", startTime, entities=res, query=query, limit=limit)
+		if keysOnly:
+			return [x.key for x in res]
 		return res
 
-	def _mergeMultiQueryResults(self, inputRes: List[List[Entity]]) -> List[Entity]:
+	def _runMultipleFilterQueries(self, queries: List[QueryDefinition], limit: int) -> List[List[Entity]]:
 		"""
-			Merge the lists of entries into a single list; removing duplicates and restoring sort-order
+			Runs each of the given queries and returns their results in the same order.
+
+			Unless disabled by conf["viur.db.multiQueryConcurrency"], the queries are issued concurrently using
+			the shared threadpool; at most conf["viur.db.multiQueryConcurrency"] of them will be in flight at once.
+			Inside transactions they're always run one after another, as the transaction is bound to the
+			current thread. Sub-queries that have been exhausted according to the cursor set are skipped.
+		:param queries: The QueryDefinitions to run
+		:param limit: The amount of entities to fetch for each query, -1 to use the limit of that query
+		:return: List of results, one for each query
+		"""
+		offsets = self._multiQueryOffsets or [0] * len(queries)
+
+		def runQuery(query: QueryDefinition, offset: Union[None, int]) -> List[Entity]:
+			if offset is None:  # There are no more results for that query
+				query.currentCursor = None
+				return []
+			return self._runSingleFilterQuery(query, limit if limit != -1 else query.limit, offset)
+
+		maxConcurrency = conf["viur.db.multiQueryConcurrency"] or 1
+		if maxConcurrency < 2 or len(queries) < 2 or not _canUseQueryExecutor():
+			return [runQuery(query, offset) for query, offset in zip(queries, offsets)]
+		executor = _getQueryExecutor()
+		futures = {}  # Future -> Index of the query in queries
+		pending = set()
+		for idx, (query, offset) in enumerate(zip(queries, offsets)):
+			if len(pending) >= maxConcurrency:
+				_, pending = wait(pending, return_when=FIRST_COMPLETED)
+			# Each query runs in a copy of our context, so it can see the ContextVars of the current request
+			future = executor.submit(copy_context().run, runQuery, query, offset)
+			futures[future] = idx
+			pending.add(future)
+		res = [None] * len(queries)
+		for future, idx in futures.items():
+			res[idx] = future.result()  # Will re-raise any exception thrown in that thread
+		return res
+
+	def _mergeQueryDefinition(self, query: QueryDefinition, keysOnly: bool,
+							  projection: Union[None, List[str]]) -> QueryDefinition:
+		"""
+			Returns a copy of the sub-query *query* that fetches just enough of each entity to merge its results.
+
+			Merging needs the values of all properties we sort by, so a keys-only multi-query fetches these
+			properties using a projection (or just the keys if there is no sort order). If one of them is also
+			used in an equality filter (which the datastore refuses to project), whole entities are fetched.
+		"""
+		if not (keysOnly or projection):
+			return replace(query, keysOnly=False, projection=None)
+		properties = [] if keysOnly else list(projection)
+		properties.extend([x[0] for x in query.orders if x[0] != "__key__" and x[0] not in properties])
+		equalityFilters = {x.split(" ")[0] for x in query.filters.keys() if x.endswith(" =")}
+		if any([x in equalityFilters for x in properties]):
+			return replace(query, keysOnly=False, projection=None)
+		return replace(query, keysOnly=False, projection=properties or ["__key__"])
+
+	def _mergeMultiQueryResults(self, inputRes: List[List[Entity]], targetAmount: int,
+								queries: Union[None, List[QueryDefinition]] = None) -> List[Entity]:
+		"""
+			Merge the lists of entries into a single list; removing duplicates and restoring sort-order.
+
+			As each sub-query already returns its results sorted, this is a lazy k-way merge which stops as soon as
+			targetAmount entries have been collected. Sub-queries running dry before that are continued behind
+			their cursor. Afterwards, the combined cursor returned by getCursor() points directly behind the last
+			entry consumed from each sub-query.
 		:param inputRes: Nested Lists of Entries returned by each individual query run
+		:param targetAmount: How many entries should be returned
+		:param queries: The QueryDefinitions inputRes has been fetched with, defaults to self.queries
 		:return: Sorted & deduplicated list of entries
 		"""
+		queries = queries or self.queries
+		# Fixme: What about filters that mix different inequality filters - we'll now simply ignore any implicit sortorder
+		orders = queries[0].orders
+		offsets = self._multiQueryOffsets or [0] * len(queries)
+		sources = [_MultiQueryMergeSource(self, query, entries, offset or 0, targetAmount)
+				   for query, entries, offset in zip(queries, inputRes, offsets)]
+		heap = []
+
+		def pushNext(sourceIdx: int) -> None:
+			entry = sources[sourceIdx].peek()
+			if entry is not None:
+				# The key is used as tie-breaker, so duplicates from different sub-queries will be popped in a row
+				heapq.heappush(heap, (_entitySortKey(entry, orders), _keySortTuple(entry.key), sourceIdx, entry))
+
+		for idx in range(0, len(sources)):
+			pushNext(idx)
 		seenKeys = set()
 		res = []
-		for subList in inputRes:
-			for entry in subList:
-				key = entry.key
-				if key in seenKeys:
-					continue
+		while heap and len(res) < targetAmount:
+			_, _, idx, entry = heapq.heappop(heap)
+			sources[idx].pos += 1
+			key = self._resultKey(entry)
+			if key not in seenKeys:
 				seenKeys.add(key)
 				res.append(entry)
-		# Fixme: What about filters that mix different inequality filters - we'll now simply ignore any implicit sortorder
-		return self._resortResult(res, {}, self.queries[0].orders)
+			if len(res) < targetAmount:
+				pushNext(idx)
+		# Consume duplicates of the entries we're about to return, so they won't reappear on the next page
+		while heap and self._resultKey(heap[0][3]) in seenKeys:
+			_, _, idx, _ = heapq.heappop(heap)
+			sources[idx].pos += 1
+		positions = [x.position() for x in sources]
+		if any([x is not None for x in positions]):
+			self._multiQueryCursor = _encodeMultiQueryCursor(positions)
+		return res
 
-	def _resortResult(self, entities: List[Entity], filters: Dict[str, DATASTORE_BASE_TYPES],
-					  orders: List[Tuple[str, SortOrder]]) -> List[Entity]:
+	def _resultKey(self, entry: Entity) -> KeyClass:
+		"""
+			Returns the key of the entity that will be returned for *entry* (see :func:`_fixKind`).
+		"""
+		key = entry.key
+		if key.kind != self.origKind and key.parent and key.parent.kind == self.origKind:
+			return key.parent
+		return key
 
-		def getVal(src: Entity, fieldVars: Union[str, Tuple[str]], direction: SortOrder) -> Any:
-			# Descent into the target until we reach the property we're looking for
-			if isinstance(fieldVars, tuple):
-				for fv in fieldVars:
-					if not fv in src:
-						return None
-					src = src[fv]
-			else:
-				if not fieldVars in src:
-					return (str(type(None)), 0)
-				src = src[fieldVars]
-			# Lists are handled differently, here the smallest or largest value determines it's position in the result
-			if isinstance(src, list) and len(src):
-				try:
-					src.sort()
-				except TypeError:
-					# It's a list of dicts or the like for which no useful sort-order is specified
-					pass
-				if direction == SortOrder.Ascending:
-					src = src[0]
-				else:
-					src = src[-1]
-			# We must return this tuple because inter-type comparison isn't possible in Python3 anymore
-			return str(type(src)), src if src is not None else 0
+	def _queryCacheKey(self, limit: int, keysOnly: bool, projection: Union[None, List[str]]) -> Union[None, str]:
+		"""
+			Returns the key under which the result of the current run of this query is stored in the query cache,
+			or None if that result must not be cached.
+
+			The key is a hash over everything affecting the result: the kinds queried, the filters, orders,
+			distinct-settings, limits and cursors of each (sub-)query and the requested limit.
+		"""
+		if not conf["viur.db.queryCaching"] or IsInTransaction():
+			return None
+		if self._fulltextQueryString or projection or self._customMultiQueryMerge \
+				or self._calculateInternalMultiQueryLimit:
+			# Projections cannot be hydrated from keys and we don't know what custom merges depend on
+			return None
+		if self.kind in conf["viur.db.cacheExcludedKinds"] or self.origKind in conf["viur.db.cacheExcludedKinds"]:
+			return None
+		queryDescr = [limit, bool(keysOnly), self._multiQueryOffsets, self._describeQueries(True)]
+		return hashlib.sha256(json.dumps(queryDescr, default=repr).encode("UTF-8")).hexdigest()
+
+	def _describeQueries(self, withCursors: bool) -> List[Any]:
+		"""
+			Returns a canonical, json-serializable description of the kinds queried and the filters, orders and
+			distinct-settings of each (sub-)query. Limits and cursors are only included if *withCursors* is set.
+		"""
+		queries = self.queries if isinstance(self.queries, list) else [self.queries]
+		cursorToStr = _MultiQueryMergeSource._cursorToStr
+		res = [self.kind, self.origKind]
+		for query in queries:
+			queryDescr = [
+				query.kind,
+				sorted([[k, _canonicalQueryValue(v)] for k, v in query.filters.items()], key=lambda x: x[0]),
+				[[prop, order.value] for prop, order in query.orders],
+				query.distinct
+			]
+			if withCursors:
+				queryDescr.extend([query.limit, cursorToStr(query.startCursor), cursorToStr(query.endCursor)])
+			res.append(queryDescr)
+		return res
 
+	def _hydrateCachedResult(self, keys: List[KeyClass], cursor: Union[None, str],
+							 keysOnly: bool) -> List[Union[Entity, KeyClass]]:
+		"""
+			Restores the state of this query from a result found in the query cache and fetches its entities.
+			Entities deleted in the meantime are skipped.
+		"""
+		if isinstance(self.queries, list):
+			self._multiQueryCursor = cursor
+		else:  # Cursors of single queries are kept as returned by the datastore
+			self.queries.currentCursor = cursor.encode("ASCII") if cursor else None
+		if keysOnly:
+			return list(keys)
+		return [x for x in Get(list(keys)) if x is not None] if keys else []
+
+	def _filterPredicate(self, query: QueryDefinition) -> Callable[[Entity], bool]:
+		"""
+			Returns the filters of *query* compiled by :func:`_compileFilterPredicate`. The result is cached on
+			that query definition until its filters are changed.
+		"""
+		filters = list(query.filters.items())
+		if query.compiledFilters is None or query.compiledFilters[0] != filters:
+			query.compiledFilters = (filters, _compileFilterPredicate(query.filters))
+		return query.compiledFilters[1]
+
+	def _filterEntries(self, entries: List[Entity]) -> List[Entity]:
+		"""
+			Returns the entries matching the filters of this query, that is, of at least one of its sub-queries.
+		"""
+		if self.queries is None:
+			return []
+		predicates = [self._filterPredicate(x)
+					  for x in (self.queries if isinstance(self.queries, list) else [self.queries])]
+		if len(predicates) == 1:
+			return list(filter(predicates[0], entries))
+		return [x for x in entries if any([predicate(x) for predicate in predicates])]
+
+	def _resortResult(self, entities: List[Entity], filters: Dict[str, DATASTORE_BASE_TYPES],
+					  orders: List[Tuple[str, SortOrder]]) -> List[Entity]:
 		# Check if we have an inequality filter which implies an sortorder
 		ineqFilter = None
 		for k, _ in filters.items():
@@ -799,33 +1994,33 @@ class Query(object):
 				break
 		if ineqFilter and (not orders or not orders[0][0] == ineqFilter):
 			orders = [(ineqFilter, SortOrder.Ascending)] + (orders or [])
-
-		for orderField, direction in orders[::-1]:
-			if orderField == KEY_SPECIAL_PROPERTY:
-				pass  # FIXME !!
-			# entities.sort(key=lambda x: x.key, reverse=direction == SortOrder.Descending)
-			else:
-				try:
-					entities.sort(key=partial(getVal, fieldVars=orderField, direction=direction),
-								  reverse=direction == SortOrder.Descending)
-				except TypeError:
-					# We hit some incomparable types
-					pass
+		try:
+			entities.sort(key=partial(_entitySortKey, orders=orders))
+		except TypeError:
+			# We hit some incomparable types
+			pass
 		return entities
 
 	def _fixKind(self, resultList):
 		"""
 			Jump to parentKind if nessesary (used in realtions)
-		:param resultList:
+		:param resultList: The entities or keys returned by the query
 		:return:
 		"""
 		resultList = list(resultList)
-		if resultList and resultList[0].key.kind != self.origKind and resultList[0].key.parent and \
-				resultList[0].key.parent.kind == self.origKind:
-			return list(Get([x.key.parent for x in resultList]))
+		if not resultList:
+			return resultList
+		keysOnly = isinstance(resultList[0], KeyClass)
+		firstKey = resultList[0] if keysOnly else resultList[0].key
+		if firstKey.kind != self.origKind and firstKey.parent and firstKey.parent.kind == self.origKind:
+			if keysOnly:
+				return [x.parent for x in resultList]
+			# Entries whose parent has been deleted in the meantime are skipped
+			return [x for x in Get([x.key.parent for x in resultList]) if x is not None]
 		return resultList
 
-	def run(self, limit=-1, **kwargs):
+	def run(self, limit=-1, keysOnly: Union[None, bool] = None, projection: Union[None, List[str]] = None,
+			**kwargs):
 		"""
 			Run this query.
 
@@ -837,6 +2032,10 @@ class Query(object):
 			:param limit: Limits the query to the defined maximum entities.
 			:type limit: int
 
+			:param keysOnly: Return only the keys of the matching entities. Defaults to :func:`isKeysOnly`.
+			:param projection: Fetch only these properties of the matching entities. Defaults to
+				:func:`getProjection`. Ignored for queries on relations, as their parents are always fetched whole.
+
 			:param kwargs: Any keyword arguments accepted by datastore_query.QueryOptions().
 
 			:returns: An iterator that provides access to the query results iterator
@@ -849,50 +2048,84 @@ class Query(object):
 		"""
 		if self.queries is None:
 			return None
-
-		if self._fulltextQueryString:
+		if keysOnly is None:
+			keysOnly = self.isKeysOnly()
+		if projection is None:
+			projection = self.getProjection()
+		if self.kind != self.origKind:
+			projection = []  # We'll fetch the parents of these relations anyway
+		queryCacheKey = self._queryCacheKey(limit, keysOnly, projection)
+		cachedResult = None
+		if queryCacheKey:
+			# Snapshot the generations first, so writes happening while the query runs invalidate its result
+			cacheGenerations = queryCache.generations({self.kind, self.origKind})
+			cachedResult = queryCache.get(queryCacheKey)
+		if cachedResult is not None:
+			res = self._hydrateCachedResult(*cachedResult, keysOnly)
+		elif self._fulltextQueryString:
 			if IsInTransaction():
-				raise InvalidStateError("Can't run fulltextSearch inside transactions!")
+				raise RuntimeError("Can't run fulltextSearch inside transactions!")
 			qryStr = self._fulltextQueryString
 			self._fulltextQueryString = None  # Reset, so the adapter can still work with this query
 			res = self.srcSkel.customDatabaseAdapter.fulltextSearch(qryStr, self)
 			if not self.srcSkel.customDatabaseAdapter.fulltextSearchGuaranteesQueryConstrains:
 				# Search might yield results that are not included in the listfilter
-				if isinstance(self.queries, dict):  # Just one
-					res = [x for x in res if _entryMatchesQuery(x, self.queries)]
-				else:  # Multi-Query, must match at least one
-					res = [x for x in res if any([_entryMatchesQuery(x, y) for y in self.queries])]
+				res = self._filterEntries(res)
+			if keysOnly:
+				res = [x.key for x in res]
 		elif isinstance(self.queries, list):
 			# We have more than one query to run
+			targetAmount = limit if limit != -1 else self.queries[0].limit
+			self._multiQueryCursor = None
 			if self._calculateInternalMultiQueryLimit:
 				limit = self._calculateInternalMultiQueryLimit(self, limit if limit != -1 else self.queries[0].limit)
-			res = []
-			# We run all queries first (preventing multiple round-trips to the server)
-			for singleQuery in self.queries:
-				res.append(self._runSingleFilterQuery(singleQuery, limit if limit != -1 else singleQuery.limit))
-			# Wait for the actual results to arrive and convert the protobuffs to Entries
-			res = [self._fixKind(x) for x in res]
+			indexAdvisor.recordMerge(
+				self.kind, self.queries[0].filters.keys(),
+				[x[0] if x[1] == SortOrder.Ascending else "-" + x[0] for x in self.queries[0].orders],
+				"custom merge" if self._customMultiQueryMerge else "merge of %s sub-queries" % len(self.queries))
 			if self._customMultiQueryMerge:
-				# We have a custom merge function, use that
-				res = self._customMultiQueryMerge(self, res, limit if limit != -1 else self.queries[0].limit)
+				# We have a custom merge function, use that. As we cannot know which properties it needs, we'll
+				# always fetch full entities here.
+				queries = [self._mergeQueryDefinition(x, False, None) for x in self.queries]
+				res = self._runMultipleFilterQueries(queries, limit)
+				res = [self._fixKind(x) for x in res]
+				res = self._customMultiQueryMerge(self, res, targetAmount)
+				if keysOnly:
+					res = [x.key for x in res]
 			else:
+				# We run all queries first (in parallel, preventing multiple round-trips to the server)
+				queries = [self._mergeQueryDefinition(x, keysOnly, projection) for x in self.queries]
+				res = self._runMultipleFilterQueries(queries, limit)
 				# We must merge (and sort) the results ourself
-				res = self._mergeMultiQueryResults(res)
+				res = self._mergeMultiQueryResults(res, targetAmount, queries)
+				res = self._fixKind([x.key for x in res] if keysOnly else res)
 		else:  # We have just one single query
-			res = self._fixKind(self._runSingleFilterQuery(self.queries, limit if limit != -1 else self.queries.limit))
-		if conf["viur.debug.traceQueries"]:
-			#orders = self.queries.orders
-			filters = self.queries
-			distinctOn = "" # "" distinct on %s" % str(self._distinct) if self._distinct else ""
-			if self.kind != self.origKind:
-				logging.debug("Queried %s via %s with filter %s and orders %s. Returned %s results" % (self.origKind, self.kind, filters, distinctOn, len(res)))
+			res = self._fixKind(self._runSingleFilterQuery(self.queries, limit if limit != -1 else self.queries.limit,
+														   keysOnly=keysOnly, projection=projection))
+		if queryCacheKey and cachedResult is None:
+			if isinstance(self.queries, list):
+				nextCursor = self._multiQueryCursor
 			else:
-				logging.debug("Queried %s with filter %s and orders %s. Returned %s results" % (self.kind, filters, distinctOn, len(res)))
+				nextCursor = _MultiQueryMergeSource._cursorToStr(self.queries.currentCursor)
+			queryCache.set(queryCacheKey, cacheGenerations, (res if keysOnly else [x.key for x in res], nextCursor))
 		if res:
 			self._lastEntry = res[-1]
 		return res
 
-	def fetch(self, limit=-1, **kwargs):
+	async def runAsync(self, limit=-1, keysOnly: Union[None, bool] = None, projection: Union[None, List[str]] = None,
+					   **kwargs) -> Union[None, List[Union[Entity, KeyClass]]]:
+		"""
+			Like :func:`server.db.Query.run`, but can be awaited together with other database operations.
+		"""
+		return await _runInExecutor(self.run, limit, keysOnly, projection, **kwargs)
+
+	async def fetchAsync(self, limit=-1, projection: Union[None, List[str]] = None, **kwargs):
+		"""
+			Like :func:`server.db.Query.fetch`, but can be awaited together with other database operations.
+		"""
+		return await _runInExecutor(self.fetch, limit, projection, **kwargs)
+
+	def fetch(self, limit=-1, projection: Union[None, List[str]] = None, **kwargs):
 		"""
 			Run this query and fetch results as :class:`server.skeleton.SkelList`.
 
@@ -908,6 +2141,10 @@ class Query(object):
 			A maxiumum value of 99 entries can be fetched at once.
 			:type limit: int
 
+			:param projection: Fetch only the properties needed for these bones. Defaults to
+				:func:`getProjection`. All other bones of the skeletons returned are marked lazy and
+				will be loaded on first access.
+
 			:raises: :exc:`BadFilterError` if a filter string is invalid
 			:raises: :exc:`BadValueError` if a filter value is invalid.
 			:raises: :exc:`BadQueryError` if an IN filter in combination with a sort order on\
@@ -920,18 +2157,31 @@ class Query(object):
 			logging.error(("Limit", limit))
 			raise NotImplementedError(
 				"This query is not limited! You must specify an upper bound using limit() between 1 and 100")
-		dbRes = self.run(limit)
+		if projection is None:
+			projection = self.getProjection()
+		if self.kind != self.origKind:
+			projection = None  # run() will return the whole parent entities
+		dbRes = self.run(limit, keysOnly=False, projection=projection or [])
 		if dbRes is None:
 			return None
+		lazyBones = None
+		if projection:
+			# Every bone not backed by a projected property will be loaded on first access
+			lazyBones = {boneName for boneName in self.srcSkel.keys()
+						 if boneName != "key" and not any([x == boneName or x.startswith(boneName + ".")
+														   for x in projection])}
 		res = SkelListRef(self.srcSkel)
 		for e in dbRes:
 			skelInstance = SkeletonInstanceRef(self.srcSkel.skeletonCls, clonedBoneMap=self.srcSkel.boneMap)
 			skelInstance.dbEntity = e
+			skelInstance.lazyBones = lazyBones
 			res.append(skelInstance)
 		res.getCursor = lambda: self.getCursor()
+		res.customQueryInfo = self.customQueryInfo
 		return res
 
-	def iter(self, keysOnly=False):
+	def iter(self, keysOnly: Union[None, bool] = None, projection: Union[None, List[str]] = None,
+			 prefetch: Union[None, bool] = None) -> QueryIterator:
 		"""
 			Run this query and return an iterator for the results.
 
@@ -947,19 +2197,178 @@ class Query(object):
 			Otherwise, it might not return all results as the AppEngine doesn't maintain the view \
 			for a query for more than ~30 seconds.
 
-			:param keysOnly: If the query should be used to retrieve entity keys only.
+			:param keysOnly: If the query should be used to retrieve entity keys only. Defaults to
+				:func:`isKeysOnly`.
 			:type keysOnly: bool
+			:param projection: If set, only these properties are fetched from the datastore. Defaults to
+				:func:`getProjection`.
+			:param prefetch: If the next page should be fetched in background while the current one is
+				processed. Defaults to conf["viur.db.iterPrefetch"].
+			:returns: An iterator over the entities (or keys) matched. It also keeps track how many entities and
+				pages have been fetched so far.
 		"""
-		if self.queries is None:  # Noting to pull here
-			raise StopIteration()
-		elif isinstance(self.queries, list):
+		if isinstance(self.queries, list):
 			raise ValueError("No iter on Multiqueries")
+		if prefetch is None:
+			prefetch = conf["viur.db.iterPrefetch"]
+		if keysOnly is None:
+			keysOnly = self.isKeysOnly()
+		if projection is None:
+			projection = self.getProjection()
+		return QueryIterator(self, keysOnly=keysOnly, projection=projection, prefetch=prefetch)
+
+	async def iterAsync(self, keysOnly: Union[None, bool] = None, projection: Union[None, List[str]] = None,
+						prefetch: Union[None, bool] = None) -> AsyncIterator[Union[Entity, KeyClass]]:
+		"""
+			Like :func:`server.db.Query.iter`, but returns an asynchronous iterator that fetches each page without
+			blocking the event loop. If prefetching is enabled, the next page is requested before the entries of the
+			current one are handed out.
+		"""
+		if prefetch is None:
+			prefetch = conf["viur.db.iterPrefetch"]
+		iterator = self.iter(keysOnly=keysOnly, projection=projection, prefetch=False)
+		nextPage = asyncio.ensure_future(_runInExecutor(iterator.nextPage))
 		while True:
-			qryRes = self._runSingleFilterQuery(self.queries, 20)
-			yield from qryRes
-			if not self.queries.currentCursor:  # We reached the end of that query
+			page = await nextPage
+			if page is None:
+				break
+			if prefetch:
+				nextPage = asyncio.ensure_future(_runInExecutor(iterator.nextPage))
+			for entry in page:
+				yield entry
+			if not prefetch:
+				nextPage = asyncio.ensure_future(_runInExecutor(iterator.nextPage))
+
+	def count(self, upTo: Optional[int] = None) -> int:
+		"""
+			Returns the amount of entities matching this query.
+
+			Native aggregation queries are used if the database driver supports them, otherwise the keys of all
+			matching entities are streamed and counted. Cursors and limits set on this query are ignored.
+			Results are cached per query definition for conf["viur.db.aggregationCacheLifeTime"] seconds.
+
+			:param upTo: Stop counting after that many entities. Useful for displaying "more than 1000 entries".
+			:raises: :exc:`NotImplementedError` if this query can't be aggregated (fulltext searches and
+				custom multi-query merges).
+		"""
+		return self._aggregate("count", None, upTo)
+
+	def sum(self, prop: str) -> Union[int, float]:
+		"""
+			Returns the sum of the numeric values of property *prop* of all entities matching this query.
+			Entities without a numeric value for *prop* are ignored. See :func:`count`.
+		"""
+		return self._aggregate("sum", prop, None)
+
+	def avg(self, prop: str) -> Union[None, float]:
+		"""
+			Returns the average of the numeric values of property *prop* of all entities matching this query, or None
+			if there are no such values. Entities without a numeric value for *prop* are ignored. See :func:`count`.
+		"""
+		return self._aggregate("avg", prop, None)
+
+	def _aggregate(self, aggregation: str, prop: Union[None, str], upTo: Union[None, int]) -> Any:
+		"""
+			Runs the aggregation *aggregation* ("count", "sum" or "avg") over property *prop* and caches its result.
+		"""
+		if self.queries is None:
+			return None if aggregation == "avg" else 0
+		if self._fulltextQueryString or self._customMultiQueryMerge:
+			raise NotImplementedError("Can't aggregate over fulltext searches or queries with a custom merge")
+		cacheKey = None
+		if conf["viur.db.aggregationCacheLifeTime"] and not IsInTransaction() \
+				and self.kind not in conf["viur.db.cacheExcludedKinds"] \
+				and self.origKind not in conf["viur.db.cacheExcludedKinds"]:
+			queryDescr = [aggregation, prop, upTo, self._describeQueries(False)]
+			cacheKey = hashlib.sha256(json.dumps(queryDescr, default=repr).encode("UTF-8")).hexdigest()
+			cacheGenerations = queryCache.generations({self.kind, self.origKind})
+			res = queryCache.get(cacheKey)
+			if res is not None:
+				return res[0]
+		if not isinstance(self.queries, list) and self.kind == self.origKind and not self.queries.distinct \
+				and hasattr(getDriver(), "aggregation_query"):
+			res = self._runNativeAggregation(aggregation, prop, upTo)
+		else:
+			res = self._runStreamingAggregation(aggregation, prop, upTo)
+		if cacheKey:
+			queryCache.set(cacheKey, cacheGenerations, (res,), conf["viur.db.aggregationCacheLifeTime"])
+		return res
+
+	def _runNativeAggregation(self, aggregation: str, prop: Union[None, str], upTo: Union[None, int]) -> Any:
+		"""
+			Runs the aggregation as aggregation query on the datastore. Only possible for single queries.
+		"""
+		startTime = monotonic()
+		aggregationQuery = getDriver().aggregation_query(self._buildDatastoreQuery(self.queries, False, None))
+		if aggregation == "count":
+			aggregationQuery.count(alias="res")
+		else:
+			getattr(aggregationQuery, aggregation)(prop, alias="res")
+		res = None
+		for batch in aggregationQuery.fetch(limit=upTo):
+			for aggregationResult in batch:
+				if aggregationResult.alias == "res":
+					res = aggregationResult.value
+		profiler.record("aggregation", startTime, query=self.queries, limit=upTo)
+		if res is None and aggregation != "avg":
+			res = 0
+		return res
+
+	def _runStreamingAggregation(self, aggregation: str, prop: Union[None, str], upTo: Union[None, int]) -> Any:
+		"""
+			Computes the aggregation by iterating over all entities matched by each (sub-)query.
+
+			For counting, only keys are fetched. Entities matched by more than one sub-query (or by several of their
+			relations) are only taken into account once.
+		"""
+		seenKeys = set()
+		pendingKeys = []  # Keys of entities we still have to fetch to read prop from
+		values = []
+
+		def addValue(entity: Union[None, Entity]) -> None:
+			if entity is None:
+				return
+			value = _getPropertyValue(entity, prop)
+			if isinstance(value, (int, float)) and not isinstance(value, bool):
+				values.append(value)
+
+		# Without a property, keys are sufficient. Relations must be resolved to their parents in any case.
+		keysOnly = not prop or self.kind != self.origKind
+		for queryDefinition in (self.queries if isinstance(self.queries, list) else [self.queries]):
+			subQuery = copy(self)
+			subQuery.queries = replace(queryDefinition, startCursor=None, endCursor=None, currentCursor=None)
+			if keysOnly and queryDefinition.distinct:
+				# Distinct queries need a projection containing these properties
+				iterator = QueryIterator(subQuery, keysOnly=False, projection=list(queryDefinition.distinct),
+										 prefetch=conf["viur.db.iterPrefetch"])
+				iterator = (x.key for x in iterator)
+			else:
+				iterator = QueryIterator(subQuery, keysOnly=keysOnly, projection=[],
+										 prefetch=conf["viur.db.iterPrefetch"])
+			for entry in iterator:
+				key = entry if isinstance(entry, KeyClass) else entry.key
+				if key.kind != self.origKind and key.parent and key.parent.kind == self.origKind:
+					key = key.parent
+				if key in seenKeys:
+					continue
+				seenKeys.add(key)
+				if prop:
+					if isinstance(entry, KeyClass) or entry.key != key:
+						pendingKeys.append(key)
+					else:
+						addValue(entry)
+				if upTo and len(seenKeys) >= upTo:
+					break
+			if upTo and len(seenKeys) >= upTo:
 				break
-			self.queries.startCursor = self.queries.currentCursor
+		for i in range(0, len(pendingKeys), 100):
+			for entity in Get(pendingKeys[i:i + 100]):
+				addValue(entity)
+		if aggregation == "count":
+			return len(seenKeys)
+		elif aggregation == "sum":
+			return sum(values)
+		return sum(values) / len(values) if values else None
 
 	def getEntry(self) -> Union[None, Entity]:
 		"""
@@ -1019,15 +2428,95 @@ class Query(object):
 		res.customQueryInfo = self.customQueryInfo
 		res.origKind = self.origKind
 		res._fulltextQueryString = self._fulltextQueryString
+		res._multiQueryOffsets = deepcopy(self._multiQueryOffsets)
 		#res._distinct = self._distinct
+		if keysOnly is not None:
+			res.setKeysOnly(keysOnly)
 		return res
 
 	def __repr__(self):
 		return "<db.Query on %s with queries %s>" % (self.kind, self.queries)
 
 
+class QueryIterator(object):
+	"""
+		Iterator over all results of a (single) query as returned by :func:`Query.iter`.
+
+		Results are fetched in pages. The first page is fetched with conf["viur.db.iterMinPageSize"] entities,
+		each following page doubles in size up to conf["viur.db.iterMaxPageSize"]. If prefetching is enabled (and
+		we're not inside a transaction), the next page is fetched on a worker thread while the current page is
+		consumed.
+	"""
+
+	def __init__(self, query: Query, keysOnly: bool = False, projection: Union[None, List[str]] = None,
+				 prefetch: bool = True):
+		super(QueryIterator, self).__init__()
+		self.query = query
+		self.keysOnly = keysOnly
+		self.projection = projection
+		self.prefetch = prefetch
+		self.pageSize = conf["viur.db.iterMinPageSize"]
+		self.entitiesFetched = 0  # How many entities (or keys) have been fetched from the datastore so far
+		self.pagesFetched = 0  # How many pages (round-trips) this took
+		self._iterator = self._iterate()
+		self._exhausted = False
+
+	def __iter__(self) -> QueryIterator:
+		return self
+
+	def __next__(self) -> Union[Entity, KeyClass]:
+		return next(self._iterator)
+
+	def _fetchPage(self, queryDefinition: QueryDefinition, pageSize: int) -> List[Union[Entity, KeyClass]]:
+		res = self.query._runSingleFilterQuery(queryDefinition, pageSize, keysOnly=self.keysOnly,
+											   projection=self.projection)
+		self.entitiesFetched += len(res)
+		self.pagesFetched += 1
+		return res
+
+	def _nextPageSize(self) -> int:
+		self.pageSize = min(self.pageSize * 2, conf["viur.db.iterMaxPageSize"])
+		return self.pageSize
+
+	def nextPage(self) -> Optional[List[Union[Entity, KeyClass]]]:
+		"""
+			Fetches the next page of results, bypassing prefetching. Returns None once the query is exhausted.
+			Used by :func:`Query.iterAsync`; don't mix it with iterating over this object.
+		"""
+		queryDefinition = self.query.queries
+		if queryDefinition is None or self._exhausted:
+			return None
+		if not self.pagesFetched:
+			return self._fetchPage(queryDefinition, self.pageSize)
+		if not queryDefinition.currentCursor:  # We reached the end of that query
+			self._exhausted = True
+			return None
+		queryDefinition.startCursor = queryDefinition.currentCursor
+		return self._fetchPage(queryDefinition, self._nextPageSize())
+
+	def _iterate(self):
+		queryDefinition = self.query.queries
+		if queryDefinition is None:  # Nothing to pull here
+			return
+		prefetch = self.prefetch and _canUseQueryExecutor()
+		page = self._fetchPage(queryDefinition, self.pageSize)
+		while True:
+			if not queryDefinition.currentCursor:  # We reached the end of that query
+				yield from page
+				break
+			queryDefinition.startCursor = queryDefinition.currentCursor
+			if prefetch:
+				nextPage = _getQueryExecutor().submit(copy_context().run, self._fetchPage, queryDefinition,
+													  self._nextPageSize())
+				yield from page
+				page = nextPage.result()
+			else:
+				yield from page
+				page = self._fetchPage(queryDefinition, self._nextPageSize())
+
+
 def IsInTransaction():
-	return __client__.current_transaction is not None
+	return getDriver().current_transaction is not None
 
 
 def acquireTransactionSuccessMarker() -> str:
@@ -1037,7 +2526,7 @@ def acquireTransactionSuccessMarker() -> str:
 		or if the transaction it was created in failed.
 	:return: Name of the entry in viur-transactionmarker
 	"""
-	txn = __client__.current_transaction
+	txn = getDriver().current_transaction
 	assert txn, "acquireTransactionSuccessMarker cannot be called outside an transaction"
 	marker = binascii.b2a_hex(txn.id).decode("ASCII")
 	if not "viurTxnMarkerSet" in dir(txn):
@@ -1048,12 +2537,156 @@ def acquireTransactionSuccessMarker() -> str:
 	return marker
 
 
+class TransactionStats(object):
+	"""
+		Counts the transactions run by :class:`TransactionRunner` on this instance and the conflicts they ran into,
+		grouped by the kinds involved and by the function run (the call site). Use :func:`snapshot` to find the
+		entities that are hotspots.
+	"""
+
+	def __init__(self):
+		super(TransactionStats, self).__init__()
+		self._lock = Lock()
+		self.reset()
+
+	def reset(self) -> None:
+		with self._lock:
+			self.commits = 0  # Transactions committed successfully
+			self.retries = 0  # Attempts that have been repeated due to contention
+			self.failures = 0  # Transactions given up due to contention
+			self.conflictsByKind: Counter[str] = Counter()
+			self.conflictsByCallSite: Counter[str] = Counter()
+
+	def recordCommit(self) -> None:
+		with self._lock:
+			self.commits += 1
+
+	def recordConflict(self, kinds: Set[str], callSite: str, willRetry: bool) -> None:
+		with self._lock:
+			for kind in kinds:
+				self.conflictsByKind[kind] += 1
+			self.conflictsByCallSite[callSite] += 1
+			if willRetry:
+				self.retries += 1
+			else:
+				self.failures += 1
+
+	def snapshot(self) -> Dict[str, Any]:
+		"""
+			Returns a copy of the current counters.
+		"""
+		with self._lock:
+			return {
+				"commits": self.commits,
+				"retries": self.retries,
+				"failures": self.failures,
+				"conflictsByKind": dict(self.conflictsByKind),
+				"conflictsByCallSite": dict(self.conflictsByCallSite),
+			}
+
+
+transactionStats = TransactionStats()
+
+
+class TransactionRunner(object):
+	"""
+		Runs functions inside a transaction, retrying them if the transaction fails due to contention.
+
+		Between two attempts it waits for a random delay (full jitter) below an exponentially growing bound.
+		Options not given are taken from conf["viur.db.transactionRetries"], conf["viur.db.transactionBackoff"],
+		conf["viur.db.transactionMaxBackoff"] and conf["viur.db.transactionDeadline"].
+		If called inside a transaction, the function just joins it.
+
+		Example::
+
+			db.TransactionRunner(retries=10, deadline=5).run(updateCounterTxn, key)
+			entity = db.TransactionRunner(readOnly=True).run(db.Get, key)
+
+		:param retries: How often a conflicting transaction is repeated before :class:`Conflict` is re-raised
+		:param backoff: Upper bound of the delay (in seconds) before the first retry; doubles with each retry
+		:param maxBackoff: Upper limit for that bound
+		:param readOnly: Run a read-only transaction. These don't lock the entities read
+		:param deadline: Don't start another attempt after that many seconds
+	"""
+
+	def __init__(self, retries: Optional[int] = None, backoff: Optional[float] = None,
+				 maxBackoff: Optional[float] = None, readOnly: bool = False, deadline: Optional[float] = None):
+		super(TransactionRunner, self).__init__()
+		self.retries = retries if retries is not None else conf["viur.db.transactionRetries"]
+		self.backoff = backoff if backoff is not None else conf["viur.db.transactionBackoff"]
+		self.maxBackoff = maxBackoff if maxBackoff is not None else conf["viur.db.transactionMaxBackoff"]
+		self.readOnly = readOnly
+		self.deadline = deadline if deadline is not None else conf["viur.db.transactionDeadline"]
+
+	def backoffDelay(self, attempt: int) -> float:
+		"""
+			Returns a random delay to wait before the retry following the *attempt*-th attempt (starting at 1).
+		"""
+		return random.uniform(0, min(self.maxBackoff, self.backoff * 2 ** (attempt - 1)))
+
+	@staticmethod
+	def _callSite(callee: Callable) -> str:
+		callee = getattr(callee, "func", callee)  # Unwrap functools.partial
+		return "%s.%s" % (getattr(callee, "__module__", None), getattr(callee, "__qualname__", repr(callee)))
+
+	def run(self, callee: Callable, *args, **kwargs) -> Any:
+		"""
+			Runs callee(*args, **kwargs) inside a transaction and returns its result.
+		"""
+		if IsInTransaction():  # Join the outer transaction, it will retry as a whole
+			return callee(*args, **kwargs)
+		writeBuffer = currentDbWriteBuffer.get()
+		if writeBuffer is not None:
+			# The transaction must see everything we've written so far
+			writeBuffer.flush()
+		deadline = monotonic() + self.deadline if self.deadline else None
+		attempt = 0
+		while True:
+			attempt += 1
+			transactionReads = set()
+			transactionWrites = set()
+			readsToken = currentDbTransactionReads.set(transactionReads)
+			writesToken = currentDbTransactionWrites.set(transactionWrites)
+			startTime = monotonic()
+			try:
+				with getDriver().transaction(read_only=self.readOnly):
+					res = callee(*args, **kwargs)
+			except Conflict:
+				delay = self.backoffDelay(attempt)
+				willRetry = attempt <= self.retries and (deadline is None or monotonic() + delay < deadline)
+				kinds = {x.kind for x in (transactionWrites or transactionReads)}
+				callSite = self._callSite(callee)
+				transactionStats.recordConflict(kinds, callSite, willRetry)
+				if not willRetry:
+					logging.warning("Transaction %s on %s failed after %s attempts due to contention" % (
+						callSite, ", ".join(sorted(kinds)) or "unknown kinds", attempt))
+					raise
+				logging.debug("Transaction %s on %s collided, retrying in %.3fs" % (
+					callSite, ", ".join(sorted(kinds)), delay))
+				sleep(delay)
+				continue
+			finally:
+				currentDbTransactionReads.reset(readsToken)
+				currentDbTransactionWrites.reset(writesToken)
+				# Another request might have re-read the old version of these entities before the transaction
+				# has been committed, so we'll have to evict them again
+				_cacheEvict(list(transactionWrites))
+				profiler.record("transaction", startTime, keys=transactionWrites or transactionReads,
+								entities=transactionWrites)
+			transactionStats.recordCommit()
+			return res
+
+
 def RunInTransaction(callee, *args, **kwargs):
-	with __client__.transaction():
-		res = callee(*args, **kwargs)
-	return res
+	"""
+		Runs callee(*args, **kwargs) inside a transaction and returns its result. Transactions failing due to
+		contention are retried as configured in conf["viur.db.transactionRetries"] and the related settings,
+		see :class:`TransactionRunner`.
+	"""
+	return TransactionRunner().run(callee, *args, **kwargs)
 
 
 __all__ = [KEY_SPECIAL_PROPERTY, DATASTORE_BASE_TYPES, SortOrder, Entity, Key, KeyClass, Put, Get, Delete, AllocateIds,
 		   Conflict, Error, keyHelper, fixUnindexableProperties, GetOrInsert, Query, IsInTransaction,
-		   acquireTransactionSuccessMarker, RunInTransaction]
+		   acquireTransactionSuccessMarker, RunInTransaction, WriteBuffer, QueryIterator, DatabaseDriver, getDriver,
+		   setDriver, GetAsync, PutAsync, DeleteAsync, runConcurrently, TransactionRunner, TransactionStats]
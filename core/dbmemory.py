@@ -0,0 +1,496 @@
+# -*- coding: utf-8 -*-
+"""
+	In-memory implementation of :class:`viur.core.db.DatabaseDriver`.
+
+	It keeps all entities in the memory of the current process and needs neither network access nor credentials,
+	so whole request paths can be run (and benchmarked reproducibly) on a laptop or a CI box. Install it before
+	the first database access::
+
+		from viur.core import db, dbmemory
+		db.setDriver(dbmemory.MemoryDatastore(latency=0.005))
+
+	or point conf["viur.db.driver"] to it. It supports filters (including dotted paths into embedded entities and
+	list properties), orders, cursors, offsets, projections, distinct-on, ancestor queries and transactions with
+	optimistic conflict detection. Latency can be injected for each call to simulate the round-trips to the real
+	datastore.
+
+	Index definitions and the limits the datastore imposes on queries are *not* enforced, so a query working here
+	may still need an index (or be rejected) in production. Projections on list properties return the whole list
+	instead of one result per value.
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from copy import deepcopy
+from datetime import datetime
+from itertools import count
+from threading import RLock, local
+from time import sleep
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
+
+from viur.core import db
+from viur.core.db import Entity, KeyClass, KEY_SPECIAL_PROPERTY, SortOrder
+
+__missing__ = object()  # Marks properties that don't exist on an entity
+
+# Fixed delay in seconds, or a callable returning the delay for the operation passed
+# ("get", "put", "delete", "query", "allocate", "begin" or "commit")
+LatencyType = Union[float, Callable[[str], float]]
+
+
+def _lookupProperty(entity: Entity, path: str) -> Any:
+	"""
+		Returns the value of property *path* from *entity* or __missing__ if it doesn't exist. Dotted paths descend
+		into embedded entities; lists of embedded entities yield the (flattened) list of their values.
+	"""
+	if path == KEY_SPECIAL_PROPERTY:
+		return entity.key
+	if path in entity:
+		return entity[path]
+	value = entity
+	for part in path.split("."):
+		if isinstance(value, dict):
+			if part not in value:
+				return __missing__
+			value = value[part]
+		elif isinstance(value, list):
+			values = []
+			for item in value:
+				if isinstance(item, dict) and part in item:
+					if isinstance(item[part], list):
+						values.extend(item[part])
+					else:
+						values.append(item[part])
+			if not values:
+				return __missing__
+			value = values
+		else:
+			return __missing__
+	return value
+
+
+def _compareValue(value: Any) -> Tuple[int, Any]:
+	"""
+		Converts *value* into a (type-rank, value) tuple comparable with all other values, just like the datastore
+		groups values by their type first.
+	"""
+	return db._sortValue(value, SortOrder.Ascending)
+
+
+def _testFilter(value: Any, op: str, filterValue: Any) -> bool:
+	"""
+		Checks a single (non-list) value against a filter.
+	"""
+	compareValue = _compareValue(value)
+	op = op.upper()
+	if op == "=":
+		return compareValue == _compareValue(filterValue)
+	elif op == "!=":
+		return compareValue != _compareValue(filterValue)
+	elif op == "IN":
+		return any([compareValue == _compareValue(x) for x in filterValue])
+	elif op == "NOT_IN":
+		return all([compareValue != _compareValue(x) for x in filterValue])
+	filterValue = _compareValue(filterValue)
+	if compareValue[0] != filterValue[0]:  # Inequality filters only match values of the same type
+		return False
+	if op == "<":
+		return compareValue < filterValue
+	elif op == "<=":
+		return compareValue <= filterValue
+	elif op == ">":
+		return compareValue > filterValue
+	elif op == ">=":
+		return compareValue >= filterValue
+	raise ValueError("Unsupported filter operator %s" % op)
+
+
+def _encodeSortValue(value: Tuple[int, Any]) -> List[Any]:
+	"""
+		Converts a (type-rank, value) tuple into something JSON-serializable, so it can be stored in a cursor.
+	"""
+	rank, innerValue = value
+	if isinstance(innerValue, datetime):
+		return [rank, "dt", innerValue.isoformat()]
+	elif isinstance(innerValue, bytes):
+		return [rank, "b", innerValue.hex()]
+	return [rank, "v", innerValue]
+
+
+def _decodeSortValue(value: List[Any]) -> Tuple[int, Any]:
+	"""
+		Inverse of :func:`_encodeSortValue`.
+	"""
+	def toTuple(x):
+		return tuple([toTuple(y) for y in x]) if isinstance(x, list) else x
+
+	rank, valueType, innerValue = value
+	if valueType == "dt":
+		return rank, datetime.fromisoformat(innerValue)
+	elif valueType == "b":
+		return rank, bytes.fromhex(innerValue)
+	return rank, toTuple(innerValue)  # Key-sort tuples have been converted into lists by json
+
+
+class MemoryQuery(object):
+	"""
+		A query against a :class:`MemoryDatastore`, mimicking :class:`google.cloud.datastore.query.Query`.
+	"""
+
+	def __init__(self, client: "MemoryDatastore", kind: Optional[str] = None, namespace: Optional[str] = None,
+				 ancestor: Optional[KeyClass] = None, filters: Tuple = (), projection: Tuple = (),
+				 order: Tuple = (), distinct_on: Tuple = (), **kwargs):
+		super(MemoryQuery, self).__init__()
+		self._client = client
+		self.kind = kind
+		self.namespace = namespace if namespace is not None else client.namespace
+		self.ancestor = ancestor
+		self.filters: List[Tuple[str, str, Any]] = list(filters)
+		self.projection = list(projection)
+		self.order = list(order)
+		self.distinct_on = list(distinct_on)
+
+	def add_filter(self, property_name: Optional[str] = None, operator: Optional[str] = None, value: Any = None,
+				   *, filter=None) -> "MemoryQuery":
+		if filter is not None:
+			property_name, operator, value = filter.property_name, filter.operator, filter.value
+		self.filters.append((property_name, operator, value))
+		return self
+
+	def keys_only(self) -> None:
+		self.projection = [KEY_SPECIAL_PROPERTY]
+
+	def fetch(self, limit: Optional[int] = None, offset: Optional[int] = None,
+			  start_cursor: Union[None, str, bytes] = None, end_cursor: Union[None, str, bytes] = None,
+			  **kwargs) -> "MemoryQueryIterator":
+		return MemoryQueryIterator(self, limit, offset, start_cursor, end_cursor)
+
+	def _orders(self) -> List[Tuple[str, SortOrder]]:
+		orders = [self.order] if isinstance(self.order, str) else self.order
+		return [(x[1:], SortOrder.Descending) if x.startswith("-") else (x, SortOrder.Ascending) for x in orders]
+
+	def _matches(self, entity: Entity) -> bool:
+		key = entity.key
+		if self.kind and key.kind != self.kind:
+			return False
+		if key.namespace != self.namespace:
+			return False
+		if self.ancestor is not None and key.flat_path[:len(self.ancestor.flat_path)] != self.ancestor.flat_path:
+			return False
+		filtersByProperty: Dict[str, List[Tuple[str, Any]]] = {}
+		for propertyName, op, filterValue in self.filters:
+			filtersByProperty.setdefault(propertyName, []).append((op, filterValue))
+		for propertyName, filters in filtersByProperty.items():
+			value = _lookupProperty(entity, propertyName)
+			if value is __missing__:
+				return False
+			values = value if isinstance(value, list) else [value]
+			if not values:  # Empty lists are not indexed
+				return False
+			# Each equality filter may be satisfied by any value of a list property, but all inequality
+			# filters on that property must be satisfied by the same value
+			inequalityFilters = [(op, x) for op, x in filters if op in {"<", "<=", ">", ">="}]
+			for op, filterValue in filters:
+				if op not in {"<", "<=", ">", ">="} and not any([_testFilter(x, op, filterValue) for x in values]):
+					return False
+			if inequalityFilters and not any([all([_testFilter(x, op, filterValue) for op, filterValue
+												   in inequalityFilters]) for x in values]):
+				return False
+		return True
+
+	def _position(self, entity: Entity, orders: List[Tuple[str, SortOrder]]) -> Optional[List[Tuple[int, Any]]]:
+		"""
+			Returns the (type-rank, value) tuples *entity* is sorted by, followed by its key as tie-breaker.
+			Returns None if the entity lacks one of these properties (as orders imply an existence filter).
+		"""
+		res = []
+		for propertyName, direction in orders:
+			value = _lookupProperty(entity, propertyName)
+			if value is __missing__ or value == []:
+				return None
+			if isinstance(value, list):  # Lists are sorted by their smallest (or largest if descending) value
+				value = (min if direction == SortOrder.Ascending else max)(value, key=_compareValue)
+			res.append(_compareValue(value))
+		res.append(_compareValue(entity.key))
+		return res
+
+	@staticmethod
+	def _sortKey(position: List[Tuple[int, Any]], orders: List[Tuple[str, SortOrder]]) -> Tuple:
+		res = [x if direction == SortOrder.Ascending else db._InvertedSortValue(x)
+			   for x, (_, direction) in zip(position, orders)]
+		res.extend(position[len(orders):])
+		return tuple(res)
+
+	@staticmethod
+	def _encodeCursor(position: List[Tuple[int, Any]]) -> bytes:
+		return urlsafe_b64encode(json.dumps([_encodeSortValue(x) for x in position]).encode("UTF-8"))
+
+	@staticmethod
+	def _decodeCursor(cursor: Union[str, bytes]) -> List[Tuple[int, Any]]:
+		if isinstance(cursor, str):
+			cursor = cursor.encode("ASCII")
+		try:
+			return [_decodeSortValue(x) for x in json.loads(urlsafe_b64decode(cursor).decode("UTF-8"))]
+		except ValueError:
+			raise db.Error("Invalid cursor")
+
+	def _project(self, entity: Entity) -> Entity:
+		if not self.projection:
+			return deepcopy(entity)
+		res = Entity(entity.key)
+		for propertyName in self.projection:
+			if propertyName == KEY_SPECIAL_PROPERTY:
+				continue
+			value = _lookupProperty(entity, propertyName)
+			if value is not __missing__:
+				res[propertyName] = deepcopy(value)
+		return res
+
+	def _run(self, limit: Optional[int], offset: Optional[int], startCursor: Union[None, str, bytes],
+			 endCursor: Union[None, str, bytes]) -> Tuple[List[Entity], Optional[bytes]]:
+		"""
+			Runs this query against the committed state of the datastore.
+			:return: The entities matched and the cursor pointing behind them (None if there are no more results)
+		"""
+		orders = self._orders()
+		with self._client._lock:
+			candidates = [(self._position(x, orders), x) for x in self._client._entities.values() if self._matches(x)]
+		candidates = [(position, entity) for position, entity in candidates if position is not None]
+		candidates.sort(key=lambda x: self._sortKey(x[0], orders))
+		if self.distinct_on:
+			seen = set()
+			distinctCandidates = []
+			for position, entity in candidates:
+				distinctValue = json.dumps([db._canonicalQueryValue(_lookupProperty(entity, x))
+											if _lookupProperty(entity, x) is not __missing__ else None
+											for x in self.distinct_on], default=repr)
+				if distinctValue not in seen:
+					seen.add(distinctValue)
+					distinctCandidates.append((position, entity))
+			candidates = distinctCandidates
+		if startCursor:
+			startKey = self._sortKey(self._decodeCursor(startCursor), orders)
+			candidates = [x for x in candidates if startKey < self._sortKey(x[0], orders)]
+		if endCursor:
+			endKey = self._sortKey(self._decodeCursor(endCursor), orders)
+			candidates = [x for x in candidates if not endKey < self._sortKey(x[0], orders)]
+		consumed = candidates[:(offset or 0) + limit] if limit is not None else candidates
+		res = [self._project(entity) for _, entity in consumed[offset or 0:]]
+		if consumed and len(consumed) < len(candidates):
+			nextCursor = self._encodeCursor(consumed[-1][0])
+		else:
+			nextCursor = None
+		return res, nextCursor
+
+
+class MemoryQueryIterator(object):
+	"""
+		The result of :meth:`MemoryQuery.fetch`. All results are returned as a single page.
+	"""
+
+	def __init__(self, query: MemoryQuery, limit: Optional[int], offset: Optional[int],
+				 startCursor: Union[None, str, bytes], endCursor: Union[None, str, bytes]):
+		super(MemoryQueryIterator, self).__init__()
+		self.query = query
+		self.limit = limit
+		self.offset = offset
+		self.startCursor = startCursor
+		self.endCursor = endCursor
+		self.next_page_token: Optional[bytes] = None
+
+	@property
+	def pages(self) -> Iterator[List[Entity]]:
+		self.query._client._simulateLatency("query")
+		res, self.next_page_token = self.query._run(self.limit, self.offset, self.startCursor, self.endCursor)
+		yield res
+
+	def __iter__(self) -> Iterator[Entity]:
+		for page in self.pages:
+			yield from page
+
+
+class MemoryTransaction(object):
+	"""
+		A transaction on a :class:`MemoryDatastore`.
+
+		Writes are buffered until it's committed. The commit fails with :class:`viur.core.db.Conflict` if any entity
+		read or written inside this transaction has been changed by another commit after this transaction began.
+	"""
+
+	def __init__(self, client: "MemoryDatastore", read_only: bool = False, **kwargs):
+		super(MemoryTransaction, self).__init__()
+		self._client = client
+		self.read_only = read_only
+		self.id: Optional[bytes] = None  # Opaque bytes, like the ids of real transactions
+		self._startSequence: Optional[int] = None
+		self._reads: Set[KeyClass] = set()
+		self._mutations: Dict[KeyClass, Optional[Entity]] = {}  # None marks deletions
+
+	def begin(self) -> None:
+		self._client._simulateLatency("begin")
+		with self._client._lock:
+			self._startSequence = self._client._sequence
+			self.id = ("memory-txn-%d" % next(self._client._transactionIds)).encode("ASCII")
+
+	def commit(self) -> None:
+		self._client._simulateLatency("commit")
+		if self.read_only and self._mutations:
+			raise db.Error("Cannot write inside a read-only transaction")
+		with self._client._lock:
+			for key in self._reads | set(self._mutations.keys()):
+				if self._client._versions.get(key, 0) > self._startSequence:
+					self._client.conflicts += 1
+					raise db.Conflict("Too much contention on these datastore entities. Please try again. "
+									  "Entity: %s" % key)
+			if self._mutations:
+				self._client._commit(self._mutations)
+		self._mutations = {}
+
+	def rollback(self) -> None:
+		self._mutations = {}
+
+	def __enter__(self) -> "MemoryTransaction":
+		self.begin()
+		self._client._pushTransaction(self)
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		try:
+			if exc_type is None:
+				self.commit()
+			else:
+				self.rollback()
+		finally:
+			self._client._popTransaction()
+
+
+class MemoryDatastore(db.DatabaseDriver):
+	"""
+		Stores all entities in a dictionary. It's safe to use from multiple threads; transactions are bound to the
+		thread that started them (just like with the real client).
+
+		:param project: The project the keys created belong to
+		:param namespace: The default namespace for keys and queries
+		:param latency: Seconds to sleep on each call (or a callable returning the delay for each operation) to
+			simulate the round-trip to the real datastore. Pass a callable using a seeded random.Random to add
+			reproducible jitter.
+	"""
+
+	def __init__(self, project: str = "viur-memory", namespace: Optional[str] = None, latency: LatencyType = 0.0):
+		super(MemoryDatastore, self).__init__()
+		self.project = project
+		self.namespace = namespace
+		self.latency = latency
+		self.operations: Dict[str, int] = {}  # How often each operation has been called
+		self.conflicts = 0  # How many commits failed due to contention
+		self._entities: Dict[KeyClass, Entity] = {}
+		self._versions: Dict[KeyClass, int] = {}  # The sequence number of the last commit that changed this key
+		self._sequence = 0
+		self._ids = count(1)
+		self._transactionIds = count(1)
+		self._lock = RLock()
+		self._local = local()
+
+	def _simulateLatency(self, operation: str) -> None:
+		with self._lock:
+			self.operations[operation] = self.operations.get(operation, 0) + 1
+		delay = self.latency(operation) if callable(self.latency) else self.latency
+		if delay and delay > 0:
+			sleep(delay)
+
+	def _commit(self, mutations: Dict[KeyClass, Optional[Entity]]) -> None:
+		with self._lock:
+			self._sequence += 1
+			for key, entity in mutations.items():
+				if entity is None:
+					self._entities.pop(key, None)
+				else:
+					self._entities[key] = entity
+				self._versions[key] = self._sequence
+
+	def _allocateKey(self, incompleteKey: KeyClass) -> KeyClass:
+		with self._lock:
+			while True:
+				key = incompleteKey.completed_key(next(self._ids))
+				if key not in self._entities:
+					return key
+
+	def _pushTransaction(self, transaction: MemoryTransaction) -> None:
+		if not hasattr(self._local, "transactions"):
+			self._local.transactions = []
+		self._local.transactions.append(transaction)
+
+	def _popTransaction(self) -> None:
+		self._local.transactions.pop()
+
+	@property
+	def current_transaction(self) -> Optional[MemoryTransaction]:
+		transactions = getattr(self._local, "transactions", None)
+		return transactions[-1] if transactions else None
+
+	def key(self, *path_args, **kwargs) -> KeyClass:
+		kwargs.setdefault("project", self.project)
+		if "parent" not in kwargs:
+			kwargs.setdefault("namespace", self.namespace)
+		return KeyClass(*path_args, **kwargs)
+
+	def allocate_ids(self, incomplete_key: KeyClass, num_ids: int) -> List[KeyClass]:
+		self._simulateLatency("allocate")
+		return [self._allocateKey(incomplete_key) for _ in range(num_ids)]
+
+	def get(self, key: KeyClass, missing: Optional[List[Entity]] = None, deferred: Optional[List[KeyClass]] = None,
+			**kwargs) -> Optional[Entity]:
+		res = self.get_multi([key], missing=missing, deferred=deferred)
+		return res[0] if res else None
+
+	def get_multi(self, keys: List[KeyClass], missing: Optional[List[Entity]] = None,
+				  deferred: Optional[List[KeyClass]] = None, **kwargs) -> List[Entity]:
+		self._simulateLatency("get")
+		transaction = self.current_transaction
+		res = []
+		with self._lock:
+			for key in keys:
+				if transaction is not None:
+					transaction._reads.add(key)
+				entity = self._entities.get(key)
+				if entity is not None:
+					res.append(deepcopy(entity))
+				elif missing is not None:
+					missing.append(Entity(key))
+		return res
+
+	def put_multi(self, entities: List[Entity], **kwargs) -> None:
+		self._simulateLatency("put")
+		for entity in entities:
+			if entity.key.is_partial:
+				entity.key = self._allocateKey(entity.key)
+		mutations = {entity.key: deepcopy(entity) for entity in entities}
+		transaction = self.current_transaction
+		if transaction is not None:
+			transaction._mutations.update(mutations)
+		else:
+			self._commit(mutations)
+
+	def delete_multi(self, keys: List[KeyClass], **kwargs) -> None:
+		self._simulateLatency("delete")
+		mutations = {key: None for key in keys}
+		transaction = self.current_transaction
+		if transaction is not None:
+			transaction._mutations.update(mutations)
+		else:
+			self._commit(mutations)
+
+	def query(self, **kwargs) -> MemoryQuery:
+		return MemoryQuery(self, **kwargs)
+
+	def transaction(self, **kwargs) -> MemoryTransaction:
+		return MemoryTransaction(self, **kwargs)
+
+	def clear(self) -> None:
+		"""
+			Removes all entities and resets the statistics.
+		"""
+		with self._lock:
+			self._entities.clear()
+			self._versions.clear()
+			self.operations.clear()
+			self.conflicts = 0
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+	Profiler for the datastore operations issued by :mod:`viur.core.db`.
+
+	Every round-trip to the datastore (gets, puts, deletes, queries, aggregations and transactions) is reported to
+	:data:`profiler`, which records its kind, filters, orders, limit, the amount of entities transferred, their
+	(estimated) size and its latency. Operations are aggregated per request and per route (see
+	:func:`DatabaseProfiler.snapshot`, which is exposed as *dbProfile* by the vi and admin renders).
+
+	To keep its overhead low enough for production, only a share of the requests (conf["viur.db.profiler.sampleRate"])
+	is profiled in detail. Operations slower than conf["viur.db.profiler.slowThreshold"] are logged and kept in a ring
+	buffer regardless of sampling. If conf["viur.debug.traceQueries"] is set, every operation is profiled and logged.
+"""
+from viur.core.config import conf
+from viur.core import utils
+import logging
+import random
+from collections import deque, OrderedDict
+from contextvars import ContextVar
+from dataclasses import dataclass, asdict
+from datetime import date, datetime, time
+from threading import Lock
+from time import monotonic
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+@dataclass
+class DatabaseOperation:
+	operation: str  # "get", "put", "delete", "query", "aggregation" or "transaction"
+	kind: str  # The kind(s) involved, comma separated
+	latency: float  # In seconds
+	entities: int = 0  # Amount of entities (or keys) transferred
+	bytes: Optional[int] = None  # Estimated size of these entities; only determined for sampled requests
+	filters: Optional[Dict[str, Any]] = None
+	orders: Optional[List[Tuple[str, str]]] = None
+	limit: Optional[int] = None
+	route: Optional[str] = None  # The route of the request this operation has been issued from
+	timestamp: Optional[datetime] = None
+
+	def describe(self) -> str:
+		res = "%s on %s took %.1fms for %s entities" % (self.operation, self.kind, self.latency * 1000, self.entities)
+		if self.bytes is not None:
+			res += " (%s bytes)" % self.bytes
+		if self.filters:
+			res += " filtered by %s" % self.filters
+		if self.orders:
+			res += " ordered by %s" % ", ".join(["%s %s" % x for x in self.orders])
+		if self.limit is not None:
+			res += " limited to %s" % self.limit
+		return res
+
+
+class OperationStats(object):
+	"""
+		Aggregated numbers of one type of operation.
+	"""
+	__slots__ = ["count", "entities", "bytes", "latency", "maxLatency"]
+
+	def __init__(self):
+		super(OperationStats, self).__init__()
+		self.count = 0
+		self.entities = 0
+		self.bytes = 0
+		self.latency = 0.0
+		self.maxLatency = 0.0
+
+	def add(self, operation: DatabaseOperation) -> None:
+		self.count += 1
+		self.entities += operation.entities
+		self.bytes += operation.bytes or 0
+		self.latency += operation.latency
+		self.maxLatency = max(self.maxLatency, operation.latency)
+
+	def merge(self, other: "OperationStats") -> None:
+		self.count += other.count
+		self.entities += other.entities
+		self.bytes += other.bytes
+		self.latency += other.latency
+		self.maxLatency = max(self.maxLatency, other.maxLatency)
+
+	def toDict(self) -> Dict[str, Any]:
+		return {
+			"count": self.count,
+			"entities": self.entities,
+			"bytes": self.bytes,
+			"latency": round(self.latency, 6),
+			"maxLatency": round(self.maxLatency, 6),
+		}
+
+
+class RequestProfile(object):
+	"""
+		The operations of a single request. Operations might be reported from worker threads, so they're guarded
+		by a lock.
+	"""
+
+	def __init__(self, sampled: bool):
+		super(RequestProfile, self).__init__()
+		self.sampled = sampled
+		self.operations: Dict[str, OperationStats] = {}
+		self._lock = Lock()
+
+	def add(self, operation: DatabaseOperation) -> None:
+		with self._lock:
+			if operation.operation not in self.operations:
+				self.operations[operation.operation] = OperationStats()
+			self.operations[operation.operation].add(operation)
+
+	def toDict(self) -> Dict[str, Any]:
+		with self._lock:
+			return {k: v.toDict() for k, v in self.operations.items()}
+
+
+currentDbProfile: ContextVar[Optional[RequestProfile]] = ContextVar("Database profile of the current request",
+																	default=None)
+
+
+def _estimateSize(value: Any) -> int:
+	"""
+		Roughly estimates how many bytes *value* occupies on the wire. Much cheaper than serializing it.
+	"""
+	if isinstance(value, (str, bytes)):
+		return len(value)
+	elif isinstance(value, dict):  # Includes entities
+		res = sum([len(k) + _estimateSize(v) for k, v in value.items()])
+		key = getattr(value, "key", None)
+		return res + _estimateSize(key) if key is not None else res
+	elif isinstance(value, (list, tuple)):
+		return sum([_estimateSize(x) for x in value])
+	elif isinstance(value, (bool, int, float, datetime, date, time)) or value is None:
+		return 8
+	flatPath = getattr(value, "flat_path", None)  # Keys
+	if flatPath is not None:
+		return sum([_estimateSize(x) for x in flatPath])
+	return 8
+
+
+class DatabaseProfiler(object):
+	"""
+		Collects the operations reported by :mod:`viur.core.db`, see the description of this module.
+	"""
+
+	def __init__(self):
+		super(DatabaseProfiler, self).__init__()
+		self.slowOperations: deque = deque(maxlen=conf["viur.db.profiler.slowLogSize"])
+		self._routes: OrderedDict[str, Dict[str, OperationStats]] = OrderedDict()
+		self._routeRequests: Dict[str, int] = {}
+		self._lock = Lock()
+
+	def isEnabled(self) -> bool:
+		return bool(conf["viur.db.profiler.sampleRate"] or conf["viur.db.profiler.slowThreshold"] is not None
+					or conf["viur.debug.traceQueries"])
+
+	def startRequest(self) -> Optional[RequestProfile]:
+		"""
+			Decides if the current request is sampled and starts its profile.
+		"""
+		if not self.isEnabled():
+			currentDbProfile.set(None)
+			return None
+		profile = RequestProfile(conf["viur.debug.traceQueries"]
+								 or random.random() < conf["viur.db.profiler.sampleRate"])
+		currentDbProfile.set(profile)
+		return profile
+
+	def endRequest(self, route: str) -> Optional[RequestProfile]:
+		"""
+			Ends the profile of the current request and adds it to the statistics of *route*.
+			:returns: The profile of the request if it has been sampled
+		"""
+		profile = currentDbProfile.get()
+		currentDbProfile.set(None)
+		if profile is None or not profile.sampled:
+			return None
+		with self._lock:
+			if route not in self._routes:
+				self._routes[route] = {}
+				self._routeRequests[route] = 0
+				while len(self._routes) > conf["viur.db.profiler.maxRoutes"]:
+					oldRoute, unused = self._routes.popitem(last=False)
+					del self._routeRequests[oldRoute]
+			self._routes.move_to_end(route)
+			self._routeRequests[route] += 1
+			routeStats = self._routes[route]
+			for operation, stats in profile.operations.items():
+				if operation not in routeStats:
+					routeStats[operation] = OperationStats()
+				routeStats[operation].merge(stats)
+		if conf["viur.debug.traceQueries"] and profile.operations:
+			logging.debug("Datastore profile of %s: %s" % (route, profile.toDict()))
+		return profile
+
+	def record(self, operation: str, startTime: float, keys: Optional[Iterable[Any]] = None,
+			   entities: Optional[Iterable[Any]] = None, query: Any = None, limit: Optional[int] = None) -> None:
+		"""
+			Reports an operation that started at *startTime* (as returned by :func:`time.monotonic`) and just ended.
+
+			:param operation: "get", "put", "delete", "query", "aggregation" or "transaction"
+			:param keys: The keys the operation has been issued for; used to determine the kinds involved
+			:param entities: The entities (or keys) transferred
+			:param query: The QueryDefinition run; provides the kind, filters and orders
+			:param limit: The limit of that query
+		"""
+		latency = monotonic() - startTime
+		profile = currentDbProfile.get()
+		if profile is None:  # Outside of requests, each operation is sampled on its own
+			if not self.isEnabled():
+				return
+			sampled = conf["viur.debug.traceQueries"] or random.random() < conf["viur.db.profiler.sampleRate"]
+		else:
+			sampled = profile.sampled
+		slowThreshold = conf["viur.db.profiler.slowThreshold"]
+		isSlow = slowThreshold is not None and latency >= slowThreshold
+		if not sampled and not isSlow:
+			return
+		entities = list(entities) if entities is not None else []
+		if query is not None:
+			kind = query.kind
+		else:
+			kinds = {x.kind for x in (keys if keys is not None else [getattr(x, "key", x) for x in entities])}
+			kind = ", ".join(sorted(kinds))
+		op = DatabaseOperation(
+			operation=operation,
+			kind=kind,
+			latency=latency,
+			entities=len(entities),
+			bytes=_estimateSize(entities) if sampled else None,
+			filters=dict(query.filters) if query is not None else None,
+			orders=[(prop, order.name) for prop, order in query.orders] if query is not None else None,
+			limit=limit,
+		)
+		if profile is not None and sampled:
+			profile.add(op)
+		if isSlow:
+			op.timestamp = datetime.now()
+			op.route = getattr(utils.currentRequest.get(), "routePath", None)
+			with self._lock:
+				if self.slowOperations.maxlen != conf["viur.db.profiler.slowLogSize"]:
+					self.slowOperations = deque(self.slowOperations, maxlen=conf["viur.db.profiler.slowLogSize"])
+				self.slowOperations.append(op)
+			logging.warning("Slow datastore operation: %s" % op.describe())
+		elif conf["viur.debug.traceQueries"]:
+			logging.debug(op.describe())
+
+	def snapshot(self) -> Dict[str, Any]:
+		"""
+			Returns the statistics of each route and the recent slow operations as json-serializable dictionary.
+		"""
+		with self._lock:
+			routes = {
+				route: {
+					"requests": self._routeRequests[route],
+					"operations": {k: v.toDict() for k, v in stats.items()}
+				} for route, stats in self._routes.items()
+			}
+			slowOperations = [asdict(x) for x in self.slowOperations]
+		for op in slowOperations:
+			op["filters"] = {k: repr(v) for k, v in op["filters"].items()} if op["filters"] else op["filters"]
+			op["timestamp"] = op["timestamp"].isoformat() if op["timestamp"] else None
+		return {"routes": routes, "slowOperations": slowOperations}
+
+	def reset(self) -> None:
+		with self._lock:
+			self._routes.clear()
+			self._routeRequests.clear()
+			self.slowOperations.clear()
+
+
+profiler = DatabaseProfiler()
+
+__all__ = [DatabaseOperation, DatabaseProfiler, RequestProfile, profiler]
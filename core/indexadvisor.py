@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+	Derives the composite indexes needed by the queries issued through :class:`viur.core.db.Query`.
+
+	If conf["viur.db.indexAdvisor"] is set, the shape (kind, filtered properties and operators, sort orders and
+	projection) of every query sent to the datastore is recorded, including the sub-queries issued for IN/!= filters,
+	spatialBone, relational queries (rewritten by relationalBone._rewriteQuery) and the *.idx* filters of
+	stringBone. Enable it on a development or staging instance, click through all list views and filters, and
+	fetch the report (exposed as *dbIndexReport* by the vi and admin renders)::
+
+		from viur.core.indexadvisor import indexAdvisor
+		open("index.yaml", "w").write(indexAdvisor.toYaml())
+		indexAdvisor.report(open("index.yaml").read())
+
+	The index.yaml emitted contains only the composite indexes not served by the built-in single property indexes.
+	Indexes that are a prefix of another index are dropped, as the longer one serves their queries too. Given the
+	currently deployed index.yaml, the report also lists the indexes no recorded query needed (each of them costs
+	writes on every put to that kind), query shapes the datastore can't serve at all and multi-queries whose results
+	have to be merged and re-sorted in memory.
+"""
+from viur.core.config import conf
+from collections import Counter
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+_inequalityOperators = {"<", "<=", ">", ">="}
+
+# A composite index: The kind and the list of (property, "asc" / "desc")
+IndexDefinition = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+# A normalized query shape: (kind, equality filtered properties, inequality filtered properties,
+# orders as (property, "asc" / "desc"), projected properties)
+QueryShape = Tuple[str, Tuple[str, ...], Tuple[str, ...], Tuple[Tuple[str, str], ...], Tuple[str, ...]]
+
+
+def normalizeShape(kind: str, filters: Iterable[str], orders: Iterable[str],
+				   projection: Optional[Iterable[str]] = None) -> QueryShape:
+	"""
+		Builds the normalized shape of a query.
+
+		:param kind: The kind queried
+		:param filters: The filter strings ("name =", "age >=", ...)
+		:param orders: The sort orders as passed to the datastore ("name" or "-name" for descending)
+		:param projection: The properties projected, if any
+	"""
+	equalities, inequalities = set(), set()
+	for filterStr in filters:
+		prop, op = filterStr.split(" ")
+		if op in _inequalityOperators:
+			inequalities.add(prop)
+		else:
+			equalities.add(prop)
+	normalizedOrders = []
+	for order in orders:
+		prop, direction = (order[1:], "desc") if order.startswith("-") else (order, "asc")
+		# Orders on properties filtered by equality are meaningless and dropped by the datastore
+		if prop not in equalities and prop not in [x[0] for x in normalizedOrders]:
+			normalizedOrders.append((prop, direction))
+	if normalizedOrders and normalizedOrders[-1] == ("__key__", "asc"):
+		normalizedOrders.pop()  # Implicitly the last sort order of every index
+	return (kind, tuple(sorted(equalities)), tuple(sorted(inequalities)), tuple(normalizedOrders),
+			tuple(sorted(projection or [])))
+
+
+def requiredIndex(shape: QueryShape) -> Optional[IndexDefinition]:
+	"""
+		Returns the composite index needed to serve a query of that shape, or None if the built-in indexes
+		suffice. Shapes the datastore can't serve (see :func:`shapeProblem`) yield None as well.
+	"""
+	kind, equalities, inequalities, orders, projection = shape
+	if shapeProblem(shape):
+		return None
+	properties = [(x, "asc") for x in equalities]
+	if inequalities and (not orders or orders[0][0] != inequalities[0]):
+		orders = ((inequalities[0], "asc"),) + orders
+	properties.extend(orders)
+	properties.extend([(x, "asc") for x in projection if x != "__key__" and x not in [y[0] for y in properties]])
+	if not properties:
+		return None  # Kind-only query
+	if len({x[0] for x in properties}) == 1 and not (equalities and orders):
+		return None  # Single property; served by the built-in indexes
+	if not orders and not inequalities and not [x for x in projection if x not in equalities]:
+		return None  # Equality filters only; served by merge-joining the built-in indexes
+	return kind, tuple(properties)
+
+
+def shapeProblem(shape: QueryShape) -> Optional[str]:
+	"""
+		Returns why the datastore will reject queries of that shape, or None if it can serve them.
+	"""
+	kind, equalities, inequalities, orders, projection = shape
+	if len(inequalities) > 1:
+		return "Inequality filters on more than one property (%s)" % ", ".join(inequalities)
+	if inequalities and orders and orders[0][0] != inequalities[0]:
+		return "The first sort order must be on the property filtered by inequality (%s)" % inequalities[0]
+	if set(projection) & set(equalities):
+		return "Properties filtered by equality can't be projected (%s)" % ", ".join(set(projection) & set(equalities))
+	return None
+
+
+def _isPrefix(index: IndexDefinition, other: IndexDefinition) -> bool:
+	return index[0] == other[0] and len(index[1]) <= len(other[1]) and other[1][:len(index[1])] == index[1]
+
+
+def parseIndexYaml(text: str) -> List[IndexDefinition]:
+	"""
+		Parses the composite indexes from the content of an index.yaml. Understands the (block) format written
+		by :func:`IndexAdvisor.toYaml` and the gcloud tools; ancestor indexes are skipped.
+	"""
+	res = []
+	kind, ancestor, properties = None, False, []
+
+	def finishIndex():
+		if kind and not ancestor:
+			res.append((kind, tuple(properties)))
+
+	for line in text.splitlines():
+		line = line.split("#")[0].rstrip()
+		stripped = line.strip()
+		if not stripped:
+			continue
+		if stripped.startswith("- kind:"):
+			finishIndex()
+			kind, ancestor, properties = stripped[len("- kind:"):].strip(), False, []
+		elif stripped.startswith("ancestor:"):
+			ancestor = stripped[len("ancestor:"):].strip().lower() in {"yes", "true"}
+		elif stripped.startswith("- name:"):
+			properties.append((stripped[len("- name:"):].strip(), "asc"))
+		elif stripped.startswith("direction:") and properties:
+			direction = stripped[len("direction:"):].strip().lower()
+			properties[-1] = (properties[-1][0], "desc" if direction.startswith("desc") else "asc")
+	finishIndex()
+	return res
+
+
+class IndexAdvisor(object):
+	"""
+		Records the shapes of the queries issued and derives the indexes they need, see the description of this
+		module.
+	"""
+
+	def __init__(self):
+		super(IndexAdvisor, self).__init__()
+		self.shapes: Counter = Counter()  # QueryShape -> How often a query of that shape has been run
+		self.mergedShapes: Counter = Counter()  # (QueryShape of the first sub-query, reason) -> How often
+		self._lock = Lock()
+
+	def recordQuery(self, kind: str, filters: Iterable[str], orders: Iterable[str],
+					projection: Optional[Iterable[str]] = None) -> None:
+		"""
+			Records a query sent to the datastore. See :func:`normalizeShape` for the parameters.
+		"""
+		if not conf["viur.db.indexAdvisor"]:
+			return
+		shape = normalizeShape(kind, filters, orders, projection)
+		with self._lock:
+			self.shapes[shape] += 1
+
+	def recordMerge(self, kind: str, filters: Iterable[str], orders: Iterable[str], reason: str) -> None:
+		"""
+			Records a multi-query whose results are merged and sorted in memory.
+		"""
+		if not conf["viur.db.indexAdvisor"]:
+			return
+		shape = normalizeShape(kind, filters, orders)
+		with self._lock:
+			self.mergedShapes[(shape, reason)] += 1
+
+	def requiredIndexes(self) -> List[IndexDefinition]:
+		"""
+			Returns the minimal list of composite indexes serving all queries recorded.
+		"""
+		with self._lock:
+			shapes = list(self.shapes.keys())
+		indexes = {requiredIndex(x) for x in shapes} - {None}
+		# An index that is a prefix of another one is redundant, as the longer one serves its queries too
+		res = [x for x in indexes if not any([y != x and _isPrefix(x, y) for y in indexes])]
+		return sorted(res)
+
+	def unusedIndexes(self, existingIndexes: List[IndexDefinition]) -> List[IndexDefinition]:
+		"""
+			Returns the indexes from *existingIndexes* not needed by any of the queries recorded.
+		"""
+		with self._lock:
+			shapes = list(self.shapes.keys())
+		needed = {requiredIndex(x) for x in shapes} - {None}
+		return [x for x in existingIndexes if not any([_isPrefix(y, x) for y in needed])]
+
+	def toYaml(self, indexes: Optional[List[IndexDefinition]] = None) -> str:
+		"""
+			Renders *indexes* (defaulting to :func:`requiredIndexes`) in the format of index.yaml.
+		"""
+		if indexes is None:
+			indexes = self.requiredIndexes()
+		lines = ["indexes:", ""]
+		for kind, properties in indexes:
+			lines.extend(["- kind: %s" % kind, "  ancestor: no", "  properties:"])
+			for prop, direction in properties:
+				lines.append("  - name: %s" % prop)
+				if direction == "desc":
+					lines.append("    direction: desc")
+			lines.append("")
+		return "\n".join(lines)
+
+	def report(self, existingIndexYaml: Optional[str] = None) -> Dict[str, Any]:
+		"""
+			Returns the findings as json-serializable dictionary.
+
+			:param existingIndexYaml: Content of the index.yaml currently deployed. If given, the report lists the
+				indexes missing in that file and the ones no recorded query needs.
+		"""
+		with self._lock:
+			shapes = dict(self.shapes)
+			mergedShapes = dict(self.mergedShapes)
+
+		def describe(shape: QueryShape) -> Dict[str, Any]:
+			kind, equalities, inequalities, orders, projection = shape
+			return {
+				"kind": kind,
+				"equalities": list(equalities),
+				"inequalities": list(inequalities),
+				"orders": ["%s %s" % x for x in orders],
+				"projection": list(projection),
+			}
+
+		def indexToDict(index: IndexDefinition) -> Dict[str, Any]:
+			return {"kind": index[0], "properties": ["%s %s" % x for x in index[1]]}
+
+		requiredIndexes = self.requiredIndexes()
+		res = {
+			"queries": sum(shapes.values()),
+			"shapes": len(shapes),
+			"requiredIndexes": [indexToDict(x) for x in requiredIndexes],
+			"indexYaml": self.toYaml(requiredIndexes),
+			"invalidShapes": [dict(describe(shape), problem=shapeProblem(shape), count=count)
+							  for shape, count in shapes.items() if shapeProblem(shape)],
+			"inMemoryMerges": [dict(describe(shape), reason=reason, count=count)
+							   for (shape, reason), count in mergedShapes.items()],
+		}
+		if existingIndexYaml is not None:
+			existingIndexes = parseIndexYaml(existingIndexYaml)
+			res["missingIndexes"] = [indexToDict(x) for x in requiredIndexes
+									 if not any([_isPrefix(x, y) for y in existingIndexes])]
+			res["unusedIndexes"] = [indexToDict(x) for x in self.unusedIndexes(existingIndexes)]
+		return res
+
+	def reset(self) -> None:
+		with self._lock:
+			self.shapes.clear()
+			self.mergedShapes.clear()
+
+
+indexAdvisor = IndexAdvisor()
+
+__all__ = [IndexAdvisor, indexAdvisor, normalizeShape, requiredIndex, shapeProblem, parseIndexYaml]
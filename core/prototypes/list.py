@@ -23,9 +23,15 @@ class List(BasicApplication):
 
 	:ivar adminInfo: todo short info on how to use adminInfo.
 	:vartype adminInfo: dict | callable
+
+	:ivar listTotal: If set, :func:`list` counts all entries matching the current filter and provides that \
+	number as *customQueryInfo["total"]*. Counting stops after that many entries if it's an integer, but \
+	never counts more than conf["viur.db.listTotalLimit"] entries.
+	:vartype listTotal: bool | int
 	"""
 
 	accessRights = ["add", "edit", "view", "delete"]  # Possible access rights for this app
+	listTotal = False  # Provide the total amount of matching entries in customQueryInfo
 
 	def adminInfo(self):
 		return {
@@ -167,6 +173,14 @@ class List(BasicApplication):
 		query = self.listFilter(self.viewSkel().all().mergeExternalFilter(kwargs))  # Access control
 		if query is None:
 			raise errors.Unauthorized()
+		if self.listTotal:
+			upTo = conf["viur.db.listTotalLimit"]
+			if not isinstance(self.listTotal, bool):
+				upTo = min(self.listTotal, upTo)
+			try:
+				query.customQueryInfo["total"] = query.count(upTo=upTo)
+			except NotImplementedError:  # Fulltext searches and custom merges can't be counted
+				pass
 		res = query.fetch()
 		return self.render.list(res)
 
@@ -8,6 +8,7 @@ from viur.core.skeleton import SkeletonInstance
 from viur.core import conf
 from viur.core import securitykey
 from viur.core import utils, errors
+from viur.core.render.json.diagnostics import dbProfile, dbIndexReport, cacheStatistics
 import datetime, json
 
 class default(DefaultRender):
@@ -169,5 +170,8 @@ def _postProcessAppObj(obj):
 	obj["canAccess"] = canAccess
 	obj["setLanguage"] = setLanguage
 	obj["getVersion"] = getVersion
+	obj["dbProfile"] = dbProfile
+	obj["dbIndexReport"] = dbIndexReport
+	obj["cacheStatistics"] = cacheStatistics
 	obj["index"] = index
 	return obj
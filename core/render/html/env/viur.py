@@ -8,10 +8,11 @@ from collections import OrderedDict
 # from google.appengine.ext import db
 # from google.appengine.api import memcache, users
 from datetime import timedelta
-from hashlib import sha512
+from hashlib import blake2b
 from typing import Dict, List, Union
 
 from viur.core import conf, db, errors, prototypes, securitykey, utils
+from viur.core.cache import cachedFragment
 from viur.core.render.html.utils import jinjaGlobalFilter, jinjaGlobalFunction
 from viur.core.skeleton import RelSkel, SkeletonInstance
 from viur.core.utils import currentLanguage, currentRequest
@@ -29,6 +30,16 @@ def execRequest(render, path, *args, **kwargs):
 	Must not include an protocol or hostname.
 	:type path: str
 
+	:param cachetime: If given, the result is cached for that many seconds (see viur.core.cache.cachedFragment)
+	and invalidated by flushCache like responses cached by enableCache. The fragment is cached per arguments and
+	language.
+	:type cachetime: int
+
+	:param userSensitive: How the fragment depends on the current user, like the parameter of enableCache:
+	0 shares it between all users, 1 (the default) caches it for guests only, 2 caches it once for guests and once
+	for all users and 3 caches it for each user separately.
+	:type userSensitive: int
+
 	:returns: Whatever the requested resource returns. This is *not* limited to strings!
 	"""
 	if "cachetime" in kwargs:
@@ -36,8 +47,18 @@ def execRequest(render, path, *args, **kwargs):
 		del kwargs["cachetime"]
 	else:
 		cachetime = 0
+	userSensitive = kwargs.pop("userSensitive", 1)
+	assert userSensitive in (0, 1, 2, 3), "userSensitive must be 0, 1, 2 or 3"
 	if conf["viur.disableCache"] or currentRequest.get().disableCache:  # Caching disabled by config
 		cachetime = 0
+	if cachetime and userSensitive:
+		user = utils.getCurrentUser()
+		if userSensitive == 1 and user:  # Not cached for logged-in users
+			cachetime = 0
+		elif userSensitive == 2:
+			userKey = "__ISUSER" if user else None
+		elif userSensitive == 3:
+			userKey = user["key"] if user else None
 	cacheEnvKey = None
 	if conf["viur.cacheEnvironmentKey"]:
 		try:
@@ -58,12 +79,10 @@ def execRequest(render, path, *args, **kwargs):
 			appVersion = ""
 			logging.error("Could not determine the current application id! Caching might produce unexpected results!")
 		tmpList.append(appVersion)
-		mysha512 = sha512()
-		mysha512.update(str(tmpList).encode("UTF8"))
-		cacheKey = "jinja2_cache_%s" % mysha512.hexdigest()
-		res = None  # memcache.get(cacheKey)
-		if res:
-			return res
+		tmpList.append(currentLanguage.get())
+		if userSensitive > 1:
+			tmpList.append(userKey)
+		cacheKey = "jinja2_cache_%s" % blake2b(repr(tmpList).encode("UTF-8"), digest_size=32).hexdigest()
 	currReq = currentRequest.get()
 	tmp_params = currReq.kwargs.copy()
 	currReq.kwargs = {"__args": args, "__outer": tmp_params}
@@ -90,16 +109,16 @@ def execRequest(render, path, *args, **kwargs):
 		currReq.internalRequest = lastRequestState
 		return (u"%s not callable or not exposed" % str(caller))
 	try:
-		resstr = caller(*args, **kwargs)
+		if cachetime:
+			resstr = cachedFragment(cacheKey, "/" + path.strip("/"), cachetime, lambda: caller(*args, **kwargs))
+		else:
+			resstr = caller(*args, **kwargs)
 	except Exception as e:
 		logging.error("Caught execption in execRequest while calling %s" % path)
 		logging.exception(e)
 		raise
 	currReq.kwargs = tmp_params
 	currReq.internalRequest = lastRequestState
-	if cachetime:
-		pass
-		#memcache.set(cacheKey, resstr, cachetime)
 	return resstr
 
 
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+	Diagnostic endpoints shared by the admin and vi renders. They report the internal statistics of the
+	instance serving the request and are only available to root users.
+"""
+from viur.core import utils, errors
+from viur.core.cache import cacheStats
+from viur.core.dbprofiler import profiler
+from viur.core.indexadvisor import indexAdvisor
+import json
+
+
+def _checkRootAccess() -> None:
+	user = utils.getCurrentUser()
+	if not user or "root" not in user["access"]:
+		raise errors.Unauthorized()
+
+
+def dbProfile(*args, **kwargs):
+	"""
+		Returns the datastore statistics of each route and the recent slow operations collected by the profiler.
+	"""
+	_checkRootAccess()
+	return json.dumps(profiler.snapshot())
+
+
+dbProfile.exposed = True
+
+
+def dbIndexReport(existingIndexYaml=None, *args, **kwargs):
+	"""
+		Returns the indexes needed by the queries recorded by the index advisor (see indexadvisor.py).
+		If the content of the index.yaml deployed is passed, missing and unused indexes are reported, too.
+	"""
+	_checkRootAccess()
+	return json.dumps(indexAdvisor.report(existingIndexYaml))
+
+
+dbIndexReport.exposed = True
+
+
+def cacheStatistics(*args, **kwargs):
+	"""
+		Returns how the requests to functions decorated with enableCache have been served by this instance.
+	"""
+	_checkRootAccess()
+	return json.dumps(cacheStats.snapshot())
+
+
+cacheStatistics.exposed = True
@@ -11,6 +11,7 @@ from viur.core import utils
 from viur.core import request
 from viur.core import session
 from viur.core import errors
+from viur.core.render.json.diagnostics import dbProfile, dbIndexReport, cacheStatistics
 import datetime, json
 from viur.core.utils import currentRequest, currentLanguage
 from viur.core.skeleton import SkeletonInstance
@@ -162,5 +163,8 @@ def _postProcessAppObj(obj):
 	obj["canAccess"] = canAccess
 	obj["setLanguage"] = setLanguage
 	obj["getVersion"] = getVersion
+	obj["dbProfile"] = dbProfile
+	obj["dbIndexReport"] = dbIndexReport
+	obj["cacheStatistics"] = cacheStatistics
 	obj["index"] = index
 	return obj
@@ -10,6 +10,7 @@ from viur.core import errors
 from urllib.parse import urljoin, urlparse, unquote
 from viur.core.logging import requestLogger, client as loggingClient, requestLoggingRessource
 from viur.core import utils, db
+from viur.core.dbprofiler import profiler
 from viur.core.utils import currentSession, currentLanguage
 import logging
 from time import time
@@ -90,6 +91,11 @@ class BrowseHandler():  # webapp.RequestHandler
 		self.maxLogLevel = logging.DEBUG
 		self._traceID = request.headers.get('X-Cloud-Trace-Context') or utils.generateRandomString()
 		db.currentDbAccessLog.set(set())
+		# Tasks (deferred calls, QueryIter batches, cron jobs) usually touch each entity just once, so keeping
+		# them around for the rest of that request would only cost memory
+		isTaskRequest = request.path.startswith("/_tasks/") or "X-Appengine-Taskname" in request.headers
+		db.currentDbIdentityMap.set(db.IdentityMap() if not isTaskRequest else None)
+		profiler.startRequest()
 
 	def selectLanguage(self, path: str):
 		"""
@@ -154,6 +160,7 @@ class BrowseHandler():  # webapp.RequestHandler
 		self.isSSLConnection = self.request.host_url.lower().startswith("https://")  # We have an encrypted channel
 		currentLanguage.set(conf["viur.defaultLanguage"])
 		self.disableCache = False  # Shall this request bypass the caches?
+		self.routedCallable = None  # The function this request has been routed to (set by findAndCall)
 		self.args = []
 		self.kwargs = {}
 		path = self.request.path
@@ -269,6 +276,12 @@ class BrowseHandler():  # webapp.RequestHandler
 			self.response.write(res.encode("UTF-8"))
 		finally:
 			self.saveSession()
+			identityMap = db.currentDbIdentityMap.get()
+			if identityMap and identityMap.savedFetches:
+				logging.debug("Identity map saved %s of %s entity fetches for %s" % (
+					identityMap.savedFetches, identityMap.lookups, self.routePath))
+			db.currentDbIdentityMap.set(None)
+			profiler.endRequest(self.routePath)
 			SEVERITY = "DEBUG"
 			if self.maxLogLevel >= 50:
 				SEVERITY = "CRITICAL"
@@ -379,7 +392,6 @@ class BrowseHandler():  # webapp.RequestHandler
 		self.kwargs = kwargs
 		# Check if this request should bypass the caches
 		if self.request.headers.get("X-Viur-Disable-Cache"):
-			from viur.core import utils
 			# No cache requested, check if the current user is allowed to do so
 			user = utils.getCurrentUser()
 			if user and "root" in user["access"]:
@@ -389,6 +401,7 @@ class BrowseHandler():  # webapp.RequestHandler
 			if (conf["viur.debug.traceExternalCallRouting"] and not self.internalRequest) or conf[
 				"viur.debug.traceInternalCallRouting"]:
 				logging.debug("Calling %s with args=%s and kwargs=%s" % (str(caller), str(args), str(kwargs)))
+			self.routedCallable = getattr(caller, "__func__", caller)
 			res = caller(*self.args, **self.kwargs)
 			res = str(res).encode("UTF-8") if not isinstance(res, bytes) else res
 			self.response.write(res)
@@ -396,28 +409,25 @@ class BrowseHandler():  # webapp.RequestHandler
 			if self.internalRequest:  # We provide that "service" only for requests originating from outside
 				raise
 			# Check if the function got too few arguments and raise a NotAcceptable error
-			tmpRes = {}
-			argsOrder = list(caller.__code__.co_varnames)[1: caller.__code__.co_argcount]
-			# Map default values in
-			reversedArgsOrder = argsOrder[:: -1]
-			for defaultValue in list(caller.__defaults__ or [])[:: -1]:
-				tmpRes[reversedArgsOrder.pop(0)] = defaultValue
-			del reversedArgsOrder
-			# Map args in
-			setArgs = []  # Store a list of args already set by *args
-			for idx in range(0, min(len(args), len(argsOrder))):
-				setArgs.append(argsOrder[idx])
-				tmpRes[argsOrder[idx]] = args[idx]
-			# Last, we map the kwargs in
-			for k, v in kwargs.items():
-				if k in setArgs:  # This key has already been set by *args
-					raise (errors.NotAcceptable())  # We reraise that exception as we got duplicate arguments
-				tmpRes[k] = v
-			# Last check, that every parameter is satisfied:
-			if not all([x in tmpRes.keys() for x in argsOrder]):
+			try:
+				boundArgs = utils.getCallSignature(caller).bind(args, kwargs)
+			except TypeError:  # We got duplicate arguments
+				raise (errors.NotAcceptable())
+			if boundArgs is None:  # Not every parameter is satisfied
 				raise (errors.NotAcceptable())
 			raise
 
+	@property
+	def routePath(self) -> str:
+		"""
+			The path of the function called in this request without its arguments (ie. "/page/view")
+		"""
+		pathlist = getattr(self, "pathlist", None)
+		if pathlist is None:  # Routing hasn't been done (yet)
+			return self.request.path
+		offset = -len(self.args) or len(pathlist)
+		return "/" + "/".join(pathlist[: offset])
+
 	def saveSession(self):
 		currentSession.get().save(self)
 
@@ -89,8 +89,9 @@ def startClearSKeys():
 @callDeferred
 def doClearSKeys(timeStamp, cursor):
 	query = db.Query(securityKeyKindName).filter("until <", datetime.strptime(timeStamp, "%d.%m.%Y %H:%M:%S"))
-	for oldKey in query.run(100, keysOnly=True):
-		db.Delete(oldKey)
+	with db.WriteBuffer():
+		for oldKey in query.run(100, keysOnly=True):
+			db.Delete(oldKey)
 	newCursor = query.getCursor()
 	if newCursor:
 		doClearSKeys(timeStamp, newCursor)
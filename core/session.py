@@ -243,8 +243,9 @@ def killSessionByUser(user=None):
 	query = db.Query(GaeSession.kindName)
 	if user is not None:
 		query.filter("user =", str(user))
-	for key in query.iter(keysOnly=True):
-		db.Delete(key)
+	with db.WriteBuffer():
+		for key in query.iter(keysOnly=True):
+			db.Delete(key)
 
 
 @PeriodicTask(60 * 4)
@@ -258,8 +259,9 @@ def startClearSessions():
 @callDeferred
 def doClearSessions(timeStamp, cursor):
 	query = db.Query(GaeSession.kindName).filter("lastseen <", timeStamp)
-	for oldKey in query.run(100, keysOnly=True):
-		db.Delete(oldKey)
+	with db.WriteBuffer():
+		for oldKey in query.run(100, keysOnly=True):
+			db.Delete(oldKey)
 	newCursor = query.getCursor()
 	if newCursor:
 		doClearSessions(timeStamp, newCursor)
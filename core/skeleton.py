@@ -2,6 +2,7 @@
 from __future__ import annotations
 
 import copy
+import datetime
 import inspect
 import logging
 import os
@@ -75,34 +76,138 @@ def iterAllSkelClasses():
 		yield cls
 
 
+def _cloneBone(bone: baseBone) -> baseBone:
+	"""
+		Returns a modifiable copy of *bone*. Containers (dicts, lists and sets) assigned to the bone are deep-copied,
+		all other attributes (like the classes referenced by relationalBones) are shared with the original.
+	"""
+	res = copy.copy(bone)
+	for key, value in res.__dict__.items():
+		if isinstance(value, (dict, list, set)):
+			res.__dict__[key] = copy.deepcopy(value)
+	res.isClonedInstance = True
+	return res
+
+
+def _cloneValue(value: Any) -> Any:
+	"""
+		Copies the values of a skeleton like copy.deepcopy, but shares immutable values (strings, numbers, keys,
+		dates, ...) with the original instead of copying them.
+	"""
+	if value is None or isinstance(value, (str, bytes, int, float, datetime.date, datetime.time, datetime.timedelta,
+										 db.KeyClass)):
+		return value
+	elif isinstance(value, db.Entity):
+		res = copy.copy(value)
+		for k, v in value.items():
+			dict.__setitem__(res, k, _cloneValue(v))
+		res.exclude_from_indexes = set(value.exclude_from_indexes)
+		return res
+	elif type(value) is dict:
+		return {k: _cloneValue(v) for k, v in value.items()}
+	elif type(value) is list:
+		return [_cloneValue(x) for x in value]
+	elif isinstance(value, SkeletonInstance):
+		return value.clone()
+	return copy.deepcopy(value)
+
+
+class CopyOnWriteBoneMap(dict):
+	"""
+		The boneMap of a SkeletonInstance whose bones may be modified (see fullClone and clone()).
+
+		Instead of copying all bones upfront, it shares them with the skeleton it has been derived from and copies
+		each bone (see _cloneBone) the first time it's handed out, be it by its name (skel.name, boneMap[name]) or
+		by iterating over them (items(), values()). Bones which are never handed out are never copied; the loops
+		of this module only read the bones and use _readBones() to skip copying them.
+	"""
+	__slots__ = ["shared"]
+
+	def __init__(self, bones: Dict[str, baseBone], shared: Set[str]):
+		super().__init__(bones)
+		self.shared = shared  # Names of the bones not copied yet
+
+	def _unshare(self, key: str) -> baseBone:
+		bone = _cloneBone(dict.__getitem__(self, key))
+		dict.__setitem__(self, key, bone)
+		self.shared.discard(key)
+		return bone
+
+	def __getitem__(self, key):
+		if key in self.shared:
+			return self._unshare(key)
+		return dict.__getitem__(self, key)
+
+	def get(self, key, default=None):
+		if key in self.shared:
+			return self._unshare(key)
+		return dict.get(self, key, default)
+
+	def __setitem__(self, key, value):
+		self.shared.discard(key)
+		dict.__setitem__(self, key, value)
+
+	def __delitem__(self, key):
+		self.shared.discard(key)
+		dict.__delitem__(self, key)
+
+	def items(self):
+		for key in list(dict.keys(self)):
+			yield key, self[key]
+
+	def values(self):
+		for key in list(dict.keys(self)):
+			yield self[key]
+
+	def copy(self):
+		return CopyOnWriteBoneMap(dict(dict.items(self)), set(self.shared))
+
+
+def _readBones(skel: SkeletonInstance) -> Iterable[Tuple[str, baseBone]]:
+	"""
+		Iterates over the bones of *skel* without copying the ones still shared (see CopyOnWriteBoneMap).
+		The bones must not be modified; they might belong to another skeleton.
+	"""
+	return dict.items(skel.boneMap)
+
+
+# (skeletonCls, subSkelNames) -> Names of the bones in that subSkel
+_subSkelBoneNames: Dict[Tuple[type, Tuple[str, ...]], List[str]] = {}
+
+
+def _getSubSkelBoneNames(skelCls, subSkelNames: List[str]) -> List[str]:
+	cacheKey = (skelCls, tuple(subSkelNames))
+	if cacheKey not in _subSkelBoneNames:
+		boneList = ["key"] + list(chain(*[skelCls.subSkels.get(x, []) for x in ["*"] + subSkelNames]))
+		prefixes = tuple([x[:-1] for x in boneList if x[-1] == "*"])
+		boneSet = set(boneList)
+		_subSkelBoneNames[cacheKey] = [k for k in skelCls.__boneMap__ if k in boneSet or k.startswith(prefixes)]
+	return _subSkelBoneNames[cacheKey]
+
+
 class SkeletonInstance:
 	__slots__ = {"dbEntity", "accessedValues", "renderAccessedValues", "boneMap", "errors", "skeletonCls",
-				 "renderPreparation"}
+				 "renderPreparation", "lazyBones"}
 
 	def __init__(self, skelCls, subSkelNames=None, fullClone=False, clonedBoneMap=None):
 		if clonedBoneMap:
 			self.boneMap = clonedBoneMap
-		elif subSkelNames:
-			boneList = ["key"] + list(chain(*[skelCls.subSkels.get(x, []) for x in ["*"] + subSkelNames]))
-			doesMatch = lambda name: name in boneList or any([name.startswith(x[:-1]) for x in boneList if x[-1] == "*"])
-			if fullClone:
-				self.boneMap = {k: copy.deepcopy(v) for k, v in skelCls.__boneMap__.items() if doesMatch(k)}
-				for v in self.boneMap.values():
-					v.isClonedInstance = True
+		else:
+			if subSkelNames:
+				bones = {k: skelCls.__boneMap__[k] for k in _getSubSkelBoneNames(skelCls, subSkelNames)}
 			else:
-				self.boneMap = {k: v for k, v in skelCls.__boneMap__.items() if doesMatch(k)}
-		elif fullClone:
-			self.boneMap = copy.deepcopy(skelCls.__boneMap__)
-			for v in self.boneMap.values():
-				v.isClonedInstance = True
-		else:  # No Subskel, no Clone
-			self.boneMap = skelCls.__boneMap__.copy()
+				bones = skelCls.__boneMap__.copy()
+			if fullClone:  # The bones will be copied once they're accessed
+				self.boneMap = CopyOnWriteBoneMap(bones, set(bones))
+			else:
+				self.boneMap = bones
 		self.dbEntity = None
 		self.accessedValues = {}
 		self.renderAccessedValues = {}
 		self.errors = []
 		self.skeletonCls = skelCls
 		self.renderPreparation = None
+		self.lazyBones = None  # Bones missing in dbEntity as it has been fetched by a projection query
 
 	def items(self, yieldBoneValues: bool = False) -> Iterable[Tuple[str, baseBone]]:
 		if yieldBoneValues:
@@ -137,8 +242,10 @@ class SkeletonInstance:
 			if key in self.renderAccessedValues:
 				return self.renderAccessedValues[key]
 		if key not in self.accessedValues:
-			boneInstance = self.boneMap.get(key, None)
+			boneInstance = dict.get(self.boneMap, key, None)  # Reading values doesn't require a copy of the bone
 			if boneInstance:
+				if self.lazyBones and key in self.lazyBones:
+					self._loadLazyBones()
 				if self.dbEntity is not None:
 					boneInstance.unserialize(self, key)
 				else:
@@ -177,18 +284,38 @@ class SkeletonInstance:
 		return f"<SkeletonInstance of {self.skeletonCls.__name__} with {dict(self)}>"
 
 	def clone(self):
-		res = SkeletonInstance(self.skeletonCls, clonedBoneMap=copy.deepcopy(self.boneMap))
-		for k, v in res.boneMap.items():
-			v.isClonedInstance = True
-		res.dbEntity = copy.deepcopy(self.dbEntity)
-		res.accessedValues = copy.deepcopy(self.accessedValues)
-		res.renderAccessedValues = copy.deepcopy(self.renderAccessedValues)
+		bones = dict(dict.items(self.boneMap))
+		# Both instances share all bones from now on, each copies a bone before handing it out. Bones which are
+		# immutable anyway (see baseBone.__setattr__) can still be used directly by this instance.
+		modifiable = {k for k, v in bones.items() if v.isClonedInstance}
+		if isinstance(self.boneMap, CopyOnWriteBoneMap):
+			self.boneMap.shared |= modifiable
+		elif modifiable:
+			self.boneMap = CopyOnWriteBoneMap(bones, modifiable)
+		res = SkeletonInstance(self.skeletonCls, clonedBoneMap=CopyOnWriteBoneMap(bones, set(bones)))
+		res.dbEntity = _cloneValue(self.dbEntity)
+		res.accessedValues = _cloneValue(self.accessedValues)
+		res.renderAccessedValues = _cloneValue(self.renderAccessedValues)
+		res.lazyBones = self.lazyBones
 		return res
 
 	def setEntity(self, entity: db.Entity):
 		self.dbEntity = entity
 		self.accessedValues = {}
 		self.renderAccessedValues = {}
+		self.lazyBones = None
+
+	def _loadLazyBones(self):
+		"""
+			Replaces the partial entity fetched by a projection query with the complete one from the datastore.
+			Values already accessed are kept.
+		"""
+		self.lazyBones = None
+		if self.dbEntity is None or not self.dbEntity.key:
+			return
+		dbEntity = db.Get(self.dbEntity.key, useEntityCache=False)
+		if dbEntity is not None:
+			self.dbEntity = dbEntity
 
 	def __deepcopy__(self, memodict):
 		res = self.clone()
@@ -297,7 +424,7 @@ class BaseSkeleton(object, metaclass=MetaBaseSkel):
 		complete = True
 		skelValues.errors = []
 
-		for key, _bone in skelValues.items():
+		for key, _bone in _readBones(skelValues):
 			if _bone.readOnly:
 				continue
 			errors = _bone.fromClient(skelValues, key, data)
@@ -324,7 +451,7 @@ class BaseSkeleton(object, metaclass=MetaBaseSkel):
 			This function causes a refresh of all relational bones and their associated
 			information.
 		"""
-		for key, bone in skelValues.items():
+		for key, bone in _readBones(skelValues):
 			if not isinstance(bone, baseBone):
 				continue
 			skelValues[key]  # Ensure value gets loaded
@@ -481,7 +608,7 @@ class ViurTagsSearchAdapter(CustomDatabaseAdapter):
 		"""
 		def tagsFromSkel(skel):
 			tags = set()
-			for boneName, bone in skel.items():
+			for boneName, bone in _readBones(skel):
 				if bone.searchable:
 					tags = tags.union(bone.getSearchTags(skel, boneName))
 			return tags
@@ -584,7 +711,7 @@ class Skeleton(BaseSkeleton, metaclass=MetaSkel):
 		complete = super().fromClient(skelValues, data)
 
 		# Check if all unique values are available
-		for boneName, boneInstance in skelValues.items():
+		for boneName, boneInstance in _readBones(skelValues):
 			if boneInstance.unique:
 				lockValues = boneInstance.getUniquePropertyIndexValues(skelValues, boneName)
 				for lockValue in lockValues:
@@ -628,7 +755,8 @@ class Skeleton(BaseSkeleton, metaclass=MetaSkel):
 			dbKey = db.keyHelper(key, skelValues.kindName)
 		except ValueError:  # This key did not parse
 			return False
-		dbRes = db.Get(dbKey)
+		# Don't serve the entity from the instance-wide cache; it might be stale and get written back by toDB
+		dbRes = db.Get(dbKey, useEntityCache=False)
 		if dbRes is None:
 			return False
 		skelValues.setEntity(dbRes)
@@ -661,7 +789,7 @@ class Skeleton(BaseSkeleton, metaclass=MetaSkel):
 			# Load the current values from Datastore or create a new, empty db.Entity
 			if not dbKey:
 				# We'll generate the key we'll be stored under early so we can use it for locks etc
-				dbKey = db.__client__.allocate_ids(db.Key(skel.kindName), 1)[0]
+				dbKey = db.AllocateIds(db.Key(skel.kindName), 1)[0]
 				dbObj = db.Entity(dbKey)
 				oldCopy = {}
 				dbObj["viur"] = {}
@@ -687,7 +815,7 @@ class Skeleton(BaseSkeleton, metaclass=MetaSkel):
 			# Move accessed Values from srcSkel over to skel
 			skel.accessedValues = mergeFrom.accessedValues
 			skel["key"] = dbKey  # Ensure key stayes set
-			for key, bone in skel.items():
+			for key, bone in _readBones(skel):
 				if key == "key":  # Explicitly skip key on top-level - this had been set above
 					continue
 				# Remember old hashes for bones that must have an unique value
@@ -883,7 +1011,7 @@ class Skeleton(BaseSkeleton, metaclass=MetaSkel):
 					type(clearUpdateTag)))
 
 		# Allow bones to perform outstanding "magic" operations before saving to db
-		for bkey, _bone in skelValues.items():
+		for bkey, _bone in _readBones(skelValues):
 			_bone.performMagic(skelValues, bkey, isAdd=isAdd)
 
 		# Run our SaveTxn
@@ -895,7 +1023,7 @@ class Skeleton(BaseSkeleton, metaclass=MetaSkel):
 		# Perform post-save operations (postProcessSerializedData Hook, Searchindex, ..)
 		skelValues["key"] = key
 
-		for boneName, bone in skel.items():
+		for boneName, bone in _readBones(skel):
 			bone.postSavedHandler(skel, boneName, key)
 
 		skel.postSavedHandler(key, dbObj)
@@ -964,7 +1092,7 @@ class Skeleton(BaseSkeleton, metaclass=MetaSkel):
 			viurData = dbObj.get("viur") or {}
 			if dbObj.get("viur_incomming_relational_locks"):
 				raise errors.Locked("This entry is locked!")
-			for boneName, bone in skel.items():
+			for boneName, bone in _readBones(skel):
 				# Ensure that we delete any value-lock objects remaining for this entry
 				bone.delete(skel, boneName)
 				if bone.unique:
@@ -1011,7 +1139,7 @@ class Skeleton(BaseSkeleton, metaclass=MetaSkel):
 			dbObj = txnDelete(skel)
 		else:
 			dbObj = db.RunInTransaction(txnDelete, skel)
-		for boneName, _bone in skel.items():
+		for boneName, _bone in _readBones(skel):
 			_bone.postDeletedHandler(skel, boneName, key)
 		skel.postDeletedHandler(key)
 		# Inform the custom DB Adapter
@@ -1048,7 +1176,7 @@ class RelSkel(BaseSkeleton):
 		"""
 		complete = True
 		skelValues.errors = []
-		for key, _bone in skelValues.items():
+		for key, _bone in _readBones(skelValues):
 			if _bone.readOnly:
 				continue
 			errors = _bone.fromClient(skelValues, key, data)
@@ -1069,7 +1197,7 @@ class RelSkel(BaseSkeleton):
 	def serialize(self, parentIndexed):
 		if self.dbEntity is None:
 			self.dbEntity = db.Entity()
-		for key, _bone in self.items():
+		for key, _bone in _readBones(self):
 			# if key in self.accessedValues:
 			_bone.serialize(self, key, parentIndexed)
 		# if "key" in self:  # Write the key seperatly, as the base-bone doesn't store it
@@ -1092,7 +1220,7 @@ class RelSkel(BaseSkeleton):
 		self.renderAccessedValues = {}
 		# self.valuesCache = {"entity": values, "changedValues": {}, "cachedRenderValues": {}}
 		return
-		for bkey, _bone in self.items():
+		for bkey, _bone in _readBones(self):
 			if isinstance(_bone, baseBone):
 				if bkey == "key":
 					try:
@@ -1165,7 +1293,7 @@ def processRemovedRelations(removedKey, cursor=None):
 		skel = skeletonByKind(entry["viur_src_kind"])()
 		assert skel.fromDB(entry["src"].key)
 		if entry["viur_relational_consistency"] == 3:  # Set Null
-			for key, _bone in skel.items():
+			for key, _bone in _readBones(skel):
 				if isinstance(_bone, relationalBone):
 					relVal = skel[key]
 					if isinstance(relVal, dict) and relVal["dest"]["key"] == removedKey:
@@ -1201,7 +1329,7 @@ def updateRelations(destID, minChangeTime, changeList, cursor=None):
 		if not skel.fromDB(key):
 			logging.warning("Cannot update stale reference to %s (referenced from %s)" % (key, srcRelKey))
 			return
-		for key, _bone in skel.items():
+		for key, _bone in _readBones(skel):
 			_bone.refresh(skel, key)
 		skel.toDB(clearUpdateTag=True)
 
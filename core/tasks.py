@@ -642,9 +642,13 @@ class QueryIter(object, metaclass=MetaQueryIter):
 		for item in qryIter:
 			try:
 				cls.handleEntry(item, qryDict["customData"])
-			except:  # First exception - we'll try another time (probably/hopefully transaction collision)
-				sleep(5)
+			except Exception as e:
 				try:
+					if not isinstance(e, db.Conflict):
+						raise
+					# Transactions are already retried by db.RunInTransaction, so this entry is a hotspot.
+					# Give it one more chance after a short, randomized delay instead of blocking this worker.
+					sleep(db.TransactionRunner().backoffDelay(2))
 					cls.handleEntry(item, qryDict["customData"])
 				except Exception as e:  # Second exception - call errorHandler
 					try:
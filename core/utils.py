@@ -1,13 +1,15 @@
 # -*- coding: utf-8 -*-
 import hashlib
 import hmac
+import inspect
 import os
 import random
 import string
 from base64 import urlsafe_b64encode
 from contextvars import ContextVar
 from datetime import datetime, timedelta, timezone
-from typing import Any, Union
+from functools import lru_cache
+from typing import Any, Callable, Collection, Dict, Optional, Tuple, Union
 import google.auth
 from viur.core import conf, db
 
@@ -198,3 +200,54 @@ def normalizeKey(key: Union[None, 'db.KeyClass']) -> Union[None, 'db.KeyClass']:
 	else:
 		parent = None
 	return db.Key(key.kind, key.id_or_name, parent=parent)
+
+
+class CallSignature(object):
+	"""
+		The positional parameters of a callable, inspected once so that arguments can be mapped onto their names
+		without introspecting the callable on every call. Use :func:`getCallSignature` to obtain (cached) instances.
+	"""
+	__slots__ = ["names", "nameSet", "defaults"]
+
+	def __init__(self, func: Callable, skipFirst: bool = False):
+		"""
+			:param func: The callable to inspect. Decorators applied using functools.wraps are looked through.
+			:param skipFirst: Ignore the first parameter (ie. *self* of a function that's not bound yet)
+		"""
+		super(CallSignature, self).__init__()
+		parameters = list(inspect.signature(func).parameters.values())[1 if skipFirst else 0:]
+		parameters = [x for x in parameters if x.kind in {x.POSITIONAL_ONLY, x.POSITIONAL_OR_KEYWORD}]
+		self.names: Tuple[str, ...] = tuple([x.name for x in parameters])
+		self.nameSet = frozenset(self.names)
+		self.defaults: Dict[str, Any] = {x.name: x.default for x in parameters if x.default is not x.empty}
+
+	def bind(self, args: Tuple[Any, ...], kwargs: Dict[str, Any],
+			 only: Optional[Collection[str]] = None) -> Optional[Dict[str, Any]]:
+		"""
+			Maps *args* and *kwargs* onto the parameter names, default values included.
+
+			:param only: If given, arguments for parameters not listed here are ignored.
+			:returns: The mapping, or None if a parameter hasn't got a value
+			:raises TypeError: If a parameter is given twice (positional and as keyword)
+		"""
+		res = dict(self.defaults)
+		setArgs = self.names[:len(args)]
+		for name, value in zip(setArgs, args):
+			if only is None or name in only:
+				res[name] = value
+		for name, value in kwargs.items():
+			if only is None or name in only:
+				if name in setArgs:
+					raise TypeError("Got duplicate arguments for %s" % name)
+				res[name] = value
+		if not self.nameSet.issubset(res):
+			return None
+		return res
+
+
+@lru_cache(maxsize=1024)
+def getCallSignature(func: Callable, skipFirst: bool = False) -> CallSignature:
+	"""
+		Returns the :class:`CallSignature` of *func*, inspecting it only on the first call.
+	"""
+	return CallSignature(func, skipFirst)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+	Measures the cost of deriving the cache key of a request to a function decorated with enableCache.
+
+	The results are compared to the way cache.keyFromArgs worked before: introspecting the function on each call
+	and hashing the str() of the sorted arguments with sha512.
+"""
+from hashlib import sha512
+from types import SimpleNamespace
+from common import measure, report
+from viur.core import cache, utils
+
+
+def legacyKeyFromArgs(f, evaluatedArgs, path, args, kwargs):
+	# How keyFromArgs used to derive the key (without the user- and language-dependent parts)
+	res = {}
+	argsOrder = list(f.__code__.co_varnames)[1: f.__code__.co_argcount]
+	reversedArgsOrder = argsOrder[:: -1]
+	for defaultValue in list(f.__defaults__ or [])[:: -1]:
+		res[reversedArgsOrder.pop(0)] = defaultValue
+	setArgs = []
+	for idx in range(0, min(len(args), len(argsOrder))):
+		if argsOrder[idx] in evaluatedArgs:
+			setArgs.append(argsOrder[idx])
+			res[argsOrder[idx]] = args[idx]
+	for k, v in kwargs.items():
+		if k in evaluatedArgs:
+			if k in setArgs:
+				raise AssertionError("Got dupplicate arguments for %s" % k)
+			res[k] = v
+	res["__path"] = path
+	res["__appVersion"] = utils.currentRequest.get().request.environ["CURRENT_VERSION_ID"].split('.')[0]
+	if not all([x in res.keys() for x in argsOrder]):
+		return None
+	res = list(res.items())
+	res.sort(key=lambda x: x[0])
+	mysha512 = sha512()
+	mysha512.update(str(res).encode("UTF8"))
+	return mysha512.hexdigest()
+
+
+def view(self, key, language="de", page=1, sortorder="asc", *args, **kwargs):
+	return ""
+
+
+def main():
+	utils.currentRequest.set(SimpleNamespace(request=SimpleNamespace(environ={"CURRENT_VERSION_ID": "bench.1"})))
+	evaluatedArgs = ["key", "language", "page", "sortorder"]
+	args, kwargs = ("a1b2c3",), {"page": "2", "sortorder": "desc"}
+	callSignature = utils.getCallSignature(view, True)
+	assert cache.keyFromArgs(view, 0, False, evaluatedArgs, "/page/view", args, kwargs) \
+		   == cache.keyFromArgs(view, 0, False, frozenset(evaluatedArgs), "/page/view", args, kwargs, callSignature)
+	baseline = measure(lambda: legacyKeyFromArgs(view, evaluatedArgs, "/page/view", args, kwargs))
+	report("introspection + sha512 (before)", baseline)
+	report("keyFromArgs", measure(
+		lambda: cache.keyFromArgs(view, 0, False, evaluatedArgs, "/page/view", args, kwargs)), baseline)
+	evaluatedArgs = frozenset(evaluatedArgs)  # As enableCache passes them
+	report("keyFromArgs with the call signature", measure(
+		lambda: cache.keyFromArgs(view, 0, False, evaluatedArgs, "/page/view", args, kwargs, callSignature)), baseline)
+
+
+if __name__ == "__main__":
+	main()
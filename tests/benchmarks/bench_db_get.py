@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+	Measures batch gets (db.Get with a list of keys) of 10 to 5000 keys.
+
+	For up to 1000 keys, the results are compared to the time spent restoring the order of the keys given by
+	sorting with keys.index() (as db.Get did before), which is quadratic in the number of keys. Every tenth key
+	doesn't exist, so the result contains Nones at these positions.
+	Pass --latency to simulate the round-trip of each lookup; requests larger than db.MAX_KEYS_PER_GET are split
+	into chunks which are fetched in parallel.
+"""
+import argparse
+from common import measure, report
+from viur.core import db, conf
+from viur.core.dbmemory import MemoryDatastore
+
+
+def sortByIndex(keys, entities):
+	# How db.Get used to restore the order of the keys given
+	res = list(entities)
+	res.sort(key=lambda x: keys.index(x.key) if x else -1)
+	return res
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument("--latency", type=float, default=0.0, help="Seconds to sleep on each datastore call")
+	args = parser.parse_args()
+	conf["viur.db.caching"] = 0  # Measure the way to the datastore, not our caches
+	driver = MemoryDatastore(latency=args.latency)
+	db.setDriver(driver)
+	for size in (10, 100, 1000, 5000):
+		keys = [db.Key("bench", idx + 1) for idx in range(size)]
+		entities = [db.Entity(key) for idx, key in enumerate(keys) if idx % 10]
+		for entity in entities:
+			entity["name"] = entity.key.id_or_name
+		db.Put(entities)
+		res = db.Get(keys)
+		assert len(res) == size and all((res[idx] is None) == (not idx % 10) for idx in range(size))
+		assert all(entity.key == keys[idx] for idx, entity in enumerate(res) if entity is not None)
+		report("db.Get(%d keys)" % size, measure(lambda: db.Get(keys)))
+		if size <= 1000:
+			# The datastore returns entities with keys of their own, so they can't be found by identity
+			fetched = [x for x in res if x is not None]
+			for entity in fetched:
+				entity.key = db.Key(entity.key.kind, entity.key.id_or_name)
+			report("  sort by keys.index()", measure(lambda: sortByIndex(keys, fetched), repeat=1 if size > 100 else 3))
+	print("datastore calls: %s" % driver.operations)
+
+
+if __name__ == "__main__":
+	main()
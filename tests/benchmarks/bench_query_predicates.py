@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+	Measures the post-filtering of search results (Query._filterEntries) on 10,000 synthetic entities.
+
+	The results are compared to testing each entity with :func:`viur.core.db._entryMatchesQuery`, which parses
+	the filters again for each entity (as the post-filtering did before).
+"""
+import random
+from common import measure, report
+from viur.core import db
+
+
+def makeEntities(amount: int):
+	rnd = random.Random(42)
+	res = []
+	for idx in range(amount):
+		entity = db.Entity(db.Key("bench", idx + 1))
+		entity["num"] = rnd.randint(0, 100)
+		entity["name"] = rnd.choice(["alpha", "beta", "gamma", "delta"])
+		entity["tags"] = rnd.sample(["a", "b", "c", "d", "e"], 2)
+		entity["dest"] = {"name": rnd.choice(["x", "y", "z"]), "num": rnd.randint(0, 10)}
+		res.append(entity)
+	return res
+
+
+def filterEachEntity(query: db.Query, entities):
+	subQueries = query.queries if isinstance(query.queries, list) else [query.queries]
+	return [x for x in entities if any([db._entryMatchesQuery(x, y.filters) for y in subQueries])]
+
+
+def main():
+	entities = makeEntities(10000)
+	queries = {
+		"equality": db.Query("bench").filter("name =", "beta"),
+		"range + list": db.Query("bench").filter("num >=", 20).filter("num <", 70).filter("tags =", "c"),
+		"dotted path": db.Query("bench").filter("dest.name =", "x").filter("dest.num >", 3),
+		"IN (multi-query)": db.Query("bench").filter("name IN", ["alpha", "gamma", "delta"]).filter("num >", 50),
+		"!= (multi-query)": db.Query("bench").filter("name !=", "alpha"),
+	}
+	for label, query in queries.items():
+		expected = filterEachEntity(query, entities)
+		assert query._filterEntries(entities) == expected, label
+		baseline = measure(lambda: filterEachEntity(query, entities), repeat=1)
+		report("%s (%d matches)" % (label, len(expected)), baseline)
+		report("  compiled predicates", measure(lambda: query._filterEntries(entities)), baseline)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+	Measures creating, cloning and building sub-skeletons of a skeleton with 50 bones.
+
+	The results are compared to deep-copying its bone map, which each of these operations did before.
+"""
+from copy import deepcopy
+from common import measure, report
+from viur.core import db
+from viur.core.bones import stringBone, numericBone, selectBone, dateBone
+from viur.core.bones.bone import setSystemInitialized
+from viur.core.skeleton import Skeleton
+
+
+def makeSkelCls():
+	bones = {}
+	for idx in range(20):
+		bones["name%d" % idx] = stringBone(descr="Name %d" % idx, params={"tooltip": {"de": "Name"}})
+	for idx in range(14):
+		bones["num%d" % idx] = numericBone(descr="Number %d" % idx)
+	for idx in range(10):
+		bones["sel%d" % idx] = selectBone(descr="Select %d" % idx, values={"a": "A", "b": "B"})
+	for idx in range(2):
+		bones["date%d" % idx] = dateBone(descr="Date %d" % idx)
+	return type("BenchSkel", (Skeleton,), dict(bones, kindName="bench", subSkels={"small": ["name*", "num0"]}))
+
+
+def main():
+	skelCls = makeSkelCls()
+	setSystemInitialized()
+	assert len(skelCls.__boneMap__) == 50  # Including the bones every skeleton has (key, creationdate, ...)
+	skel = skelCls()
+	entity = db.Entity(db.Key("bench", 1))
+	entity.update({"name%d" % idx: "Value %d" % idx for idx in range(20)})
+	entity.update({"num%d" % idx: idx for idx in range(14)})
+	loaded = skelCls()
+	loaded.setEntity(entity)
+	for idx in range(20):  # Unserialize these values
+		assert loaded["name%d" % idx] == "Value %d" % idx
+	clone = loaded.clone()
+	clone["name0"] = "Changed"
+	clone.name1.readOnly = True
+	assert loaded["name0"] == "Value 0" and not loaded.name1.readOnly and not skelCls.__boneMap__["name1"].readOnly
+	assert sorted(skelCls.subSkel("small").keys()) == sorted(["key"] + ["name%d" % idx for idx in range(20)] + ["num0"])
+	baseline = measure(lambda: deepcopy(skelCls.__boneMap__))
+	report("deepcopy of the bone map (before)", baseline)
+	report("construct", measure(lambda: skelCls()), baseline)
+	report("clone", measure(lambda: skel.clone()), baseline)
+	report("clone with values", measure(lambda: loaded.clone()), baseline)
+	report("subSkel", measure(lambda: skelCls.subSkel("small")), baseline)
+	report("subSkel (fullClone)", measure(lambda: skelCls.subSkel("small", fullClone=True)), baseline)
+
+
+if __name__ == "__main__":
+	main()
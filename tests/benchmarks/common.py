@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+	Helpers shared by the benchmarks in this directory.
+
+	The benchmarks are plain scripts. They need an environment in which viur.core can be imported (e.g. the deploy
+	directory of a project, with this repository checked out as viur/core) and run against a
+	:class:`viur.core.dbmemory.MemoryDatastore`, so they never talk to a real datastore::
+
+		python viur/core/tests/benchmarks/bench_db_get.py
+"""
+from time import perf_counter
+from typing import Callable
+
+
+def measure(func: Callable[[], object], minTime: float = 0.2, repeat: int = 3) -> float:
+	"""
+		Calls *func* until at least *minTime* seconds have been spent, *repeat* times in a row.
+		:return: The seconds spent per call in the fastest of these runs.
+	"""
+	best = None
+	for _ in range(repeat):
+		calls = 0
+		startTime = perf_counter()
+		while True:
+			func()
+			calls += 1
+			duration = perf_counter() - startTime
+			if duration >= minTime:
+				break
+		if best is None or duration / calls < best:
+			best = duration / calls
+	return best
+
+
+def report(label: str, secondsPerCall: float, baseline: float = None) -> None:
+	"""
+		Prints the time spent per call (and the speedup compared to *baseline*, if given).
+	"""
+	line = "%-40s %12.1fus" % (label, secondsPerCall * 1e6)
+	if baseline:
+		line += "  (%.1fx)" % (baseline / secondsPerCall)
+	print(line)